@@ -0,0 +1,226 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+
+from metrics import ADMISSIONS
+from resilience import Deadline
+from shopify_client import normalize_domain
+
+# Requests answered at once by this worker, in total and per shop
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+ADMISSION_PER_SHOP = int(os.getenv("ADMISSION_PER_SHOP", "8"))
+# Requests allowed to wait for a slot, in total and per shop; beyond that they are rejected
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "256"))
+ADMISSION_PER_SHOP_QUEUED = int(os.getenv("ADMISSION_PER_SHOP_QUEUED", "16"))
+# Longest a request waits for a slot (also bounded by its own deadline)
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2"))
+# Cached results at most this far past their TTL may be served instead of a rejection
+ADMISSION_MAX_STALE = float(os.getenv("ADMISSION_MAX_STALE_SECONDS", "3600"))
+
+
+class Overloaded(Exception):
+    """
+    The request was not admitted. `status_code` is 429 when the shop is over
+    its own share and 503 when the whole worker is saturated; `retry_after`
+    is the suggested wait in whole seconds.
+    """
+
+    def __init__(self, reason: str, status_code: int, retry_after: int):
+        super().__init__(f"Service overloaded ({reason})")
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Slot:
+    """
+    A granted admission. Released once; later calls are no-ops, so streaming
+    responses can release from whichever cleanup path runs first.
+    """
+
+    def __init__(self, controller: Optional["AdmissionController"], domain: str):
+        self._controller = controller
+        self._domain = domain
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            if self._controller is not None:
+                self._controller._release(self._domain, time.monotonic() - self._started)
+
+    async def __aenter__(self) -> "Slot":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Concurrency limits in front of the analysis pipeline.
+
+    At most `max_concurrent` requests run at once, and at most `per_shop` of
+    them for any one shop. Requests beyond that wait in a per-shop FIFO; the
+    total number of waiters is bounded and each waits at most
+    `queue_timeout` (or what is left of its deadline). Freed slots go to the
+    waiting shops in round-robin order, so a shop sending a burst only queues
+    behind itself and cannot starve the others.
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, per_shop: int = ADMISSION_PER_SHOP,
+                 max_queued: int = ADMISSION_MAX_QUEUED, per_shop_queued: int = ADMISSION_PER_SHOP_QUEUED,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.per_shop = per_shop
+        self.max_queued = max_queued
+        self.per_shop_queued = per_shop_queued
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self._active_by_shop: Dict[str, int] = {}
+        # Shops with waiters, in the order they are offered the next free slot
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        # Moving average of how long a request holds its slot, for Retry-After
+        self._service_time = 1.0
+        self.admitted = 0
+        self.waited = 0
+        self.rejected: Dict[str, int] = {}
+
+    def _has_room(self, domain: str) -> bool:
+        return self.active < self.max_concurrent and self._active_by_shop.get(domain, 0) < self.per_shop
+
+    def _start(self, domain: str) -> Slot:
+        self.active += 1
+        self._active_by_shop[domain] = self._active_by_shop.get(domain, 0) + 1
+        self.admitted += 1
+        return Slot(self, domain)
+
+    def retry_after(self) -> int:
+        """
+        Seconds until a new request would likely get a slot: the queue ahead
+        of it drained at the current service rate.
+        """
+        backlog = (self.queued + 1) * self._service_time / max(self.max_concurrent, 1)
+        return min(max(math.ceil(backlog), 1), 30)
+
+    def _reject(self, reason: str, status_code: int) -> Overloaded:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        ADMISSIONS.inc(outcome=reason)
+        return Overloaded(reason, status_code, self.retry_after())
+
+    async def acquire(self, shop_domain: str, deadline: Deadline, upstream: bool = True) -> Slot:
+        """
+        Waits for a slot for the shop. Raises Overloaded when its queue (or
+        the worker's) is full, or no slot frees up in time.
+
+        A request that needs no `upstream` work (it is answered from cache or
+        joins calls already in flight) is let through at once with a Slot
+        that holds nothing.
+        """
+        domain = normalize_domain(shop_domain)
+        if not upstream:
+            ADMISSIONS.inc(outcome="no_upstream")
+            return Slot(None, domain)
+        # Whenever a slot is free every waiter is blocked on its own shop's
+        # limit, so a shop with room may go ahead of them.
+        if self._has_room(domain):
+            ADMISSIONS.inc(outcome="admitted")
+            return self._start(domain)
+
+        queue = self._queues.get(domain)
+        if queue is not None and len(queue) >= self.per_shop_queued:
+            raise self._reject("shop_queue_full", 429)
+        if self.queued >= self.max_queued:
+            raise self._reject("queue_full", 503)
+
+        future = asyncio.get_running_loop().create_future()
+        if queue is None:
+            queue = self._queues[domain] = deque()
+        queue.append(future)
+        self.queued += 1
+        self.waited += 1
+        ADMISSIONS.inc(outcome="queued")
+        # asyncio.wait leaves the future alone, so a slot granted while the
+        # caller is being cancelled is released here rather than lost
+        try:
+            await asyncio.wait((future,), timeout=min(self.queue_timeout, deadline.remaining()))
+        except BaseException:
+            if future.done() and not future.cancelled():
+                future.result().release()  # granted just as the caller gave up
+            else:
+                future.cancel()
+                self._forget(domain, future)
+            raise
+        if not future.done():
+            future.cancel()
+            self._forget(domain, future)
+            raise self._reject("queue_timeout", 503)
+        return future.result()
+
+    def _forget(self, domain: str, future: asyncio.Future):
+        queue = self._queues.get(domain)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self.queued -= 1
+        if not queue:
+            del self._queues[domain]
+
+    def _release(self, domain: str, held: float):
+        self.active -= 1
+        remaining = self._active_by_shop[domain] - 1
+        if remaining:
+            self._active_by_shop[domain] = remaining
+        else:
+            del self._active_by_shop[domain]
+        self._service_time += 0.1 * (held - self._service_time)
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        Hands free slots to waiting shops in turn. A shop that is served moves
+        to the back of the rotation.
+        """
+        while self.active < self.max_concurrent and self._queues:
+            for domain in self._queues:
+                if self._active_by_shop.get(domain, 0) < self.per_shop:
+                    break
+            else:
+                return  # every waiting shop is at its own limit
+            queue = self._queues[domain]
+            future = queue.popleft()
+            self.queued -= 1
+            if future.done():  # caller gave up (cancelled or timed out)
+                if not queue:
+                    del self._queues[domain]
+                continue
+            if queue:
+                self._queues.move_to_end(domain)
+            else:
+                del self._queues[domain]
+            future.set_result(self._start(domain))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "per_shop": self.per_shop,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "waited": self.waited,
+            "rejected": dict(self.rejected),
+            "avg_service_seconds": round(self._service_time, 3),
+            "shops": {domain: {"active": self._active_by_shop.get(domain, 0),
+                               "queued": len(self._queues.get(domain, ()))}
+                      for domain in set(self._active_by_shop) | set(self._queues)},
+        }
+
+
+# Shared by every agent in the worker process.
+admission = AdmissionController()
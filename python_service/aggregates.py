@@ -0,0 +1,566 @@
+import asyncio
+import datetime
+import heapq
+import os
+import time
+from collections import OrderedDict, defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from cache import result_cache
+from local_engine import SHOPIFY_QL_BACKEND, SnapshotStore, snapshot_store
+from logs import get_logger
+from shared_store import EVENT_RETENTION_SECONDS, SharedStore, shared_store
+from shopify_client import normalize_domain
+from shopifyql import UnsupportedQuery
+from stock_risk import risk_engine
+from table import ColumnarTable
+
+logger = get_logger("aggregates")
+
+# Days of per-day buckets kept per shop, and the window of the "SINCE -30d
+# UNTIL today" intents served from them.
+AGGREGATE_RETENTION_DAYS = int(os.getenv("AGGREGATE_RETENTION_DAYS", "90"))
+SALES_WINDOW_DAYS = 30
+
+# Webhook ids remembered per shop, so redelivered webhooks are counted once
+_SEEN_WEBHOOKS = 10000
+# Orders and refunds kept per shop to re-apply on top of a newer snapshot
+# (those created after its latest order)
+AGGREGATE_REPLAY_SECONDS = float(os.getenv("AGGREGATE_REPLAY_SECONDS", str(2 * 24 * 3600)))
+_REPLAY_EVENTS = 10000
+
+# Multi-process mode: how often a worker replays webhooks its peers received
+EVENT_SYNC_SECONDS = float(os.getenv("AGGREGATE_SYNC_SECONDS", "0.1"))
+
+
+@dataclass
+class DayBucket:
+    sales: float = 0.0
+    orders: int = 0
+    discounts: Dict[str, List[float]] = field(default_factory=lambda: defaultdict(lambda: [0, 0.0]))
+
+
+def _money(value: Any) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _day(timestamp: Optional[str]) -> datetime.date:
+    """
+    Shop-local calendar day of a webhook timestamp ("2023-11-20T10:00:00-05:00").
+    """
+    if not timestamp:
+        return datetime.date.today()
+    return datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00")).date()
+
+
+def _epoch(timestamp: Optional[str]) -> float:
+    if not timestamp:
+        return time.time()
+    return datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+
+
+class ShopAggregates:
+    """
+    Materialized aggregates for one shop, updated incrementally per webhook:
+
+    * per-day buckets (sales, order count, discount usage) for the last
+      AGGREGATE_RETENTION_DAYS days,
+    * all-time per-product and per-country counters.
+
+    Reads never rescan orders: the daily series and discount usage sum at
+    most one bucket per day of the SALES_WINDOW_DAYS window, and the other
+    intents read running totals directly.
+
+    Buckets are keyed by the shop-local day of each order, while `today`
+    is the server's; the window runs past `today` by a day so a shop east of
+    the server has its own today counted.
+
+    The counts are only complete when there is no gap between the history
+    they were seeded with and the webhook stream: webhooks are applied from
+    `stream_since` (wall-clock) on, and a snapshot seeds the orders up to the
+    time it was written.
+    """
+
+    def __init__(self, stream_since: Optional[float] = None, today: Optional[datetime.date] = None):
+        self.days: Dict[datetime.date, DayBucket] = {}
+        self.products: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])  # title -> [net qty, net sales]
+        self.countries: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0])  # country -> [sales, orders]
+        self.today = today or datetime.date.today()
+        self.stream_since = time.time() if stream_since is None else stream_since
+        # Webhooks alone are complete from this day on
+        self.since = datetime.date.fromtimestamp(self.stream_since)
+        # The snapshot versions seeded from (see AggregateStore.get), when
+        # they were written, and the creation time of their latest order
+        self.snapshot: Optional[Tuple[Any, Any]] = None
+        self.snapshot_time = 0.0
+        self.high_water: Optional[float] = None
+        self.seeded = False
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        # (created at, topic, payload) of recent orders and refunds, and the
+        # newest creation time that was dropped from them
+        self._recent: Deque[Tuple[float, str, Dict[str, Any]]] = deque()
+        self._dropped_after = 0.0
+
+    # -- window maintenance ------------------------------------------------
+
+    def _window_start(self, today: datetime.date) -> datetime.date:
+        return today - datetime.timedelta(days=SALES_WINDOW_DAYS)
+
+    def roll(self, today: Optional[datetime.date] = None):
+        """
+        Advances the window to `today`, dropping buckets past retention.
+        """
+        today = today or datetime.date.today()
+        if today <= self.today:
+            return
+        cutoff = today - datetime.timedelta(days=AGGREGATE_RETENTION_DAYS)
+        for day in [d for d in self.days if d < cutoff]:
+            del self.days[day]
+        self.today = today
+
+    def _window(self) -> List[datetime.date]:
+        """
+        The days of the sales window, through the latest bucket when a shop's
+        own day is already ahead of the server's (at most one day).
+        """
+        start = self._window_start(self.today)
+        latest = max((day for day in self.days if day > self.today), default=self.today)
+        end = min(latest, self.today + datetime.timedelta(days=1))
+        return [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+
+    def _bucket(self, day: datetime.date) -> DayBucket:
+        bucket = self.days.get(day)
+        if bucket is None:
+            bucket = self.days[day] = DayBucket()
+        return bucket
+
+    def seen(self, webhook_id: Optional[str]) -> bool:
+        if not webhook_id:
+            return False
+        if webhook_id in self._seen:
+            return True
+        self._seen[webhook_id] = None
+        if len(self._seen) > _SEEN_WEBHOOKS:
+            self._seen.popitem(last=False)
+        return False
+
+    # -- webhook events ----------------------------------------------------
+
+    def apply(self, topic: str, payload: Dict[str, Any]) -> bool:
+        """
+        Applies an orders/create or refunds/create payload unless the seeding
+        snapshot already counts it (created at or before its latest order).
+        """
+        created = _epoch(payload.get("created_at"))
+        # Snapshot timestamps have whole seconds
+        if self.high_water is not None and int(created) <= self.high_water:
+            return False
+        if topic == "orders/create":
+            self.add_order(payload)
+        else:
+            self.add_refund(payload)
+        self._remember(created, topic, payload)
+        return True
+
+    def _remember(self, created: float, topic: str, payload: Dict[str, Any]):
+        self._recent.append((created, topic, payload))
+        cutoff = time.time() - AGGREGATE_REPLAY_SECONDS
+        while self._recent and (len(self._recent) > _REPLAY_EVENTS or self._recent[0][0] < cutoff):
+            self._dropped_after = max(self._dropped_after, self._recent.popleft()[0])
+
+    def replay_onto(self, shop: "ShopAggregates"):
+        """
+        Carries this shop's webhook state over to `shop`, newly seeded from a
+        newer snapshot: the webhook ids seen and the orders and refunds
+        created after the snapshot's latest order. If some of those were
+        already dropped, `shop` counts as streaming only from now on.
+        """
+        shop._seen = self._seen
+        for created, topic, payload in self._recent:
+            shop.apply(topic, payload)
+        if shop.high_water is None or self._dropped_after > shop.high_water:
+            shop.stream_since = max(shop.stream_since, time.time())
+            shop.since = datetime.date.fromtimestamp(shop.stream_since)
+
+    def add_order(self, order: Dict[str, Any]):
+        day = _day(order.get("created_at"))
+        total = _money(order.get("total_price"))
+        bucket = self._bucket(day)
+        bucket.sales += total
+        bucket.orders += 1
+
+        for discount in order.get("discount_codes") or []:
+            code = discount.get("code")
+            if not code:
+                continue
+            bucket.discounts[code][0] += 1
+            bucket.discounts[code][1] += total
+
+        country = (order.get("billing_address") or {}).get("country")
+        if country:
+            self.countries[country][0] += total
+            self.countries[country][1] += 1
+
+        for item in order.get("line_items") or []:
+            quantity = int(item.get("quantity") or 0)
+            product = self.products[item.get("title") or "Unknown"]
+            product[0] += quantity
+            product[1] += quantity * _money(item.get("price"))
+
+    def add_refund(self, refund: Dict[str, Any]):
+        for item in refund.get("refund_line_items") or []:
+            line = item.get("line_item") or {}
+            product = self.products[line.get("title") or "Unknown"]
+            product[0] -= int(item.get("quantity") or 0)
+            product[1] -= _money(item.get("subtotal"))
+
+    # -- seeding -----------------------------------------------------------
+
+    def seed_from_snapshot(self, store: SnapshotStore, shop_domain: str) -> bool:
+        """
+        Backfills the counters from the shop's columnar snapshot (orders and
+        sales tables), so all-time intents are answerable before webhooks
+        have seen the whole history. Returns False when there is no snapshot.
+        """
+        versions = (store.version(shop_domain, "orders"), store.version(shop_domain, "sales"))
+        try:
+            orders = store.open(shop_domain, "orders")
+            sales = store.open(shop_domain, "sales")
+        except UnsupportedQuery:
+            return False
+
+        timestamps = np.asarray(orders.values("timestamp"))
+        if len(timestamps):
+            self.high_water = float(timestamps.max().astype("datetime64[s]").astype(np.int64))
+        else:
+            self.high_water = 0.0
+        # Both tables hold every order up to the time the older one was written
+        self.snapshot_time = min(version[1] for version in versions if version is not None)
+
+        days = timestamps.astype("datetime64[D]")
+        totals = np.asarray(orders.values("total_price"), dtype=np.float64)
+        cutoff = np.datetime64(self.today - datetime.timedelta(days=AGGREGATE_RETENTION_DAYS), "D")
+        recent = days >= cutoff
+
+        unique_days, inverse = np.unique(days[recent], return_inverse=True)
+        day_sales = np.bincount(inverse, weights=totals[recent], minlength=len(unique_days))
+        day_orders = np.bincount(inverse, minlength=len(unique_days))
+        for day, day_total, count in zip(unique_days.tolist(), day_sales.tolist(), day_orders.tolist()):
+            bucket = self._bucket(day)
+            bucket.sales += day_total
+            bucket.orders += count
+
+        codes = np.asarray(orders.values("discount_code"))[recent]
+        names = orders.dictionary("discount_code")
+        pairs = np.stack([inverse, codes], axis=1)
+        uniques, pair_index = np.unique(pairs, axis=0, return_inverse=True)
+        pair_index = pair_index.reshape(-1)
+        uses = np.bincount(pair_index, minlength=len(uniques))
+        revenue = np.bincount(pair_index, weights=totals[recent], minlength=len(uniques))
+        for (day_index, code_index), count, amount in zip(uniques.tolist(), uses.tolist(), revenue.tolist()):
+            code = names[code_index]
+            if not code:
+                continue
+            day = unique_days[day_index].item()
+            bucket = self._bucket(day)
+            bucket.discounts[code][0] += count
+            bucket.discounts[code][1] += amount
+
+        countries = np.asarray(orders.values("billing_address_country"))
+        counts = np.bincount(countries)
+        sums = np.bincount(countries, weights=totals)
+        for name, amount, count in zip(orders.dictionary("billing_address_country").tolist(),
+                                       sums.tolist(), counts.tolist()):
+            if count:
+                self.countries[name][0] += amount
+                self.countries[name][1] += count
+
+        codes = np.asarray(sales.values("product_title"))
+        quantity = np.bincount(codes, weights=np.asarray(sales.values("net_quantity"), dtype=np.float64))
+        net_sales = np.bincount(codes, weights=np.asarray(sales.values("total_sales"), dtype=np.float64))
+        for name, qty, amount in zip(sales.dictionary("product_title").tolist(), quantity.tolist(), net_sales.tolist()):
+            self.products[name][0] += int(round(qty))
+            self.products[name][1] += amount
+
+        self.seeded = True
+        return True
+
+    # -- reads -------------------------------------------------------------
+
+    def current(self) -> bool:
+        """
+        True when the seeding snapshot was written after the webhook stream
+        started, so snapshot and webhooks together hold every order to date.
+        """
+        return self.seeded and self.snapshot_time >= self.stream_since
+
+    def covers_window(self) -> bool:
+        return self.current() or self.since <= self._window_start(self.today)
+
+    def daily_sales(self) -> ColumnarTable:
+        days = self._window()
+        sales = [round(self.days[d].sales, 2) if d in self.days else 0.0 for d in days]
+        return ColumnarTable.from_arrays(
+            ["day", "daily_sales"],
+            [np.array([d.isoformat() for d in days], dtype=object), np.array(sales, dtype=np.float64)],
+        )
+
+    def top_selling(self, limit: int) -> ColumnarTable:
+        top = heapq.nlargest(limit, self.products.items(), key=lambda kv: kv[1][0])
+        return ColumnarTable.from_arrays(
+            ["product_title", "total_sold", "revenue"],
+            [np.array([name for name, _ in top], dtype=object),
+             np.array([int(v[0]) for _, v in top], dtype=np.int64),
+             np.array([round(v[1], 2) for _, v in top], dtype=np.float64)],
+        )
+
+    def discount_usage(self) -> ColumnarTable:
+        totals: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        for day in self._window():
+            bucket = self.days.get(day)
+            if bucket is None:
+                continue
+            for code, (uses, revenue) in bucket.discounts.items():
+                totals[code][0] += uses
+                totals[code][1] += revenue
+        ranked = sorted(totals.items(), key=lambda kv: kv[1][1], reverse=True)
+        return ColumnarTable.from_arrays(
+            ["discount_code", "usages", "revenue_generated"],
+            [np.array([code for code, _ in ranked], dtype=object),
+             np.array([int(v[0]) for _, v in ranked], dtype=np.int64),
+             np.array([round(v[1], 2) for _, v in ranked], dtype=np.float64)],
+        )
+
+    def geography(self) -> ColumnarTable:
+        ranked = sorted(self.countries.items(), key=lambda kv: kv[1][0], reverse=True)
+        return ColumnarTable.from_arrays(
+            ["billing_address_country", "total_sales", "order_count"],
+            [np.array([name for name, _ in ranked], dtype=object),
+             np.array([round(v[0], 2) for _, v in ranked], dtype=np.float64),
+             np.array([int(v[1]) for _, v in ranked], dtype=np.int64)],
+        )
+
+
+# Source tables whose cached ShopifyQL results a webhook topic makes stale
+TOPIC_TABLES: Dict[str, Set[str]] = {
+    "orders/create": {"orders", "sales", "customers"},
+    "refunds/create": {"sales"},
+    "inventory_levels/update": {"inventory"},
+}
+
+
+class AggregateStore:
+    """
+    ShopAggregates per shop domain, created on first use. With the local
+    backend they are seeded from the shop's snapshot when one exists, and
+    seeded again from a newer snapshot once it is written. Seeding reads
+    whole snapshot tables, so on the event loop it runs in a thread; until it
+    finishes the shop keeps collecting webhooks but answers nothing.
+
+    With a SharedStore, webhooks are appended to its event log instead of
+    being applied directly, and every worker replays the log into its own
+    aggregates, so all of them see every webhook whichever worker received it.
+    The log is continuous from when it was started, so a worker's webhook
+    stream counts from then rather than from its own start. Log reads and
+    writes run on the store's thread; `run` replays peers' webhooks in the
+    background.
+    """
+
+    def __init__(self, store: SnapshotStore, shared: Optional[SharedStore] = None,
+                 backend: str = SHOPIFY_QL_BACKEND):
+        self.store = store
+        self.shared = shared
+        self.backend = backend
+        self._shops: Dict[str, ShopAggregates] = {}
+        self._last_event = 0
+        self._log_started: Optional[float] = None
+        self._sync_lock = asyncio.Lock()
+        self._seeding: Dict[str, asyncio.Task] = {}
+
+    def _snapshot(self, domain: str) -> Optional[Tuple[Any, Any]]:
+        """
+        Versions of the snapshot tables the shop's aggregates are seeded
+        from; None without the local backend or without a snapshot.
+        """
+        if self.backend != "local":
+            return None
+        orders, sales = self.store.version(domain, "orders"), self.store.version(domain, "sales")
+        return (orders, sales) if orders is not None and sales is not None else None
+
+    def _stream_since(self) -> float:
+        if self.shared is None:
+            return time.time()
+        if self._log_started is None:
+            self._log_started = self.shared.log_started()
+        return max(self._log_started, time.time() - EVENT_RETENTION_SECONDS)
+
+    def get(self, shop_domain: str) -> ShopAggregates:
+        domain = normalize_domain(shop_domain)
+        snapshot = self._snapshot(domain)
+        shop = self._shops.get(domain)
+        if (shop is None or shop.snapshot != snapshot) and domain not in self._seeding:
+            shop = self._reseed(domain, snapshot, shop)
+        shop.roll()
+        return shop
+
+    def _reseed(self, domain: str, snapshot: Optional[Tuple[Any, Any]],
+                previous: Optional[ShopAggregates]) -> ShopAggregates:
+        stream_since = previous.stream_since if previous is not None else self._stream_since()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None  # a worker thread (catch_up): seed in place
+        if snapshot is None or loop is None:
+            return self._install(domain, self._seeded(domain, snapshot, stream_since), previous)
+        self._seeding[domain] = loop.create_task(self._seed_later(domain, snapshot, stream_since))
+        if previous is None:
+            # Collects webhooks while the snapshot is read
+            previous = self._shops[domain] = ShopAggregates(stream_since)
+        return previous
+
+    def _seeded(self, domain: str, snapshot: Optional[Tuple[Any, Any]], stream_since: float) -> ShopAggregates:
+        shop = ShopAggregates(stream_since)
+        shop.snapshot = snapshot
+        if snapshot is not None:
+            shop.seed_from_snapshot(self.store, domain)
+        return shop
+
+    def _install(self, domain: str, shop: ShopAggregates, previous: Optional[ShopAggregates]) -> ShopAggregates:
+        if previous is not None:
+            previous.replay_onto(shop)
+        self._shops[domain] = shop
+        return shop
+
+    async def _seed_later(self, domain: str, snapshot: Tuple[Any, Any], stream_since: float):
+        try:
+            shop = await asyncio.to_thread(self._seeded, domain, snapshot, stream_since)
+            self._install(domain, shop, self._shops.get(domain))
+        except Exception:
+            logger.exception("Seeding aggregates failed", extra={"shop": domain})
+            # Not retried until the next snapshot is written
+            self._shops[domain].snapshot = snapshot
+        finally:
+            del self._seeding[domain]
+
+    def seeding(self, shop_domain: str) -> Optional[asyncio.Task]:
+        """
+        The task seeding the shop's aggregates, if one is running.
+        """
+        return self._seeding.get(normalize_domain(shop_domain))
+
+    async def apply(self, shop_domain: str, topic: str, payload: Dict[str, Any],
+                    webhook_id: Optional[str] = None) -> Set[str]:
+        """
+        Applies one webhook and returns the source tables it affects.
+        """
+        if self.shared is None:
+            return self._apply(shop_domain, topic, payload, webhook_id)
+        if not await self.shared.run(self.shared.append_event, normalize_domain(shop_domain),
+                                     topic, payload, webhook_id):
+            return set()
+        await self.sync()
+        return TOPIC_TABLES.get(topic, set())
+
+    def _apply(self, shop_domain: str, topic: str, payload: Dict[str, Any],
+               webhook_id: Optional[str] = None) -> Set[str]:
+        shop = self.get(shop_domain)
+        if shop.seen(webhook_id):
+            return set()
+        if topic in ("orders/create", "refunds/create"):
+            shop.apply(topic, payload)
+        elif topic == "inventory_levels/update":
+            risk_engine.set_level(shop_domain, payload)
+        return TOPIC_TABLES.get(topic, set())
+
+    async def sync(self):
+        """
+        Replays webhooks logged since the last sync (by any worker) and drops
+        this worker's cached results for the tables they touched.
+        """
+        if self.shared is None:
+            return
+        async with self._sync_lock:
+            self._replay(await self.shared.run(self.shared.events_since, self._last_event))
+
+    def _replay(self, events: List[Tuple[int, str, str, Dict[str, Any]]]):
+        for event_id, shop_domain, topic, payload in events:
+            tables = self._apply(shop_domain, topic, payload)
+            result_cache.invalidate_local(shop_domain, tables)
+            self._last_event = event_id
+
+    def catch_up(self):
+        """
+        Replays the whole shared event log into this worker's aggregates;
+        each shop skips the orders its snapshot already holds. Blocking,
+        meant for a thread at startup before requests are served.
+        """
+        self._log_started = self.shared.log_started()
+        self._replay(self.shared.events_since(self._last_event))
+
+    async def run(self):
+        """
+        Replays peers' webhooks every EVENT_SYNC_SECONDS, as a background
+        task for the app's lifetime.
+        """
+        while True:
+            await asyncio.sleep(EVENT_SYNC_SECONDS)
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("Webhook log sync failed")
+
+    def _covering(self, shop_domain: str, intent_id: str) -> Optional[ShopAggregates]:
+        """
+        The shop's aggregates if they hold the complete data for the intent.
+        """
+        if intent_id not in ("sales", "discounts", "top_selling", "geography"):
+            return None
+        domain = normalize_domain(shop_domain)
+        if domain not in self._shops and self._snapshot(domain) is None:
+            return None
+        shop = self.get(domain)
+        if domain in self._seeding:
+            return None
+        if intent_id in ("sales", "discounts"):
+            return shop if shop.covers_window() else None
+        # All-time intents need the history a current snapshot provides
+        return shop if shop.current() else None
+
+    def answers(self, shop_domain: str, intent_id: str) -> bool:
+        """
+        True if `answer` would return a table for the intent, without
+        building it.
+        """
+        if intent_id in ("stock_risk", "reorder"):
+            return risk_engine.index(shop_domain) is not None
+        return self._covering(shop_domain, intent_id) is not None
+
+    def answer(self, shop_domain: str, intent_id: str, params: Dict[str, str]) -> Optional[ColumnarTable]:
+        """
+        The result table for an intent when it can be read from the
+        aggregates, else None (the caller queries Shopify as usual).
+        """
+        # Stock-out risk and reorders come from the shop's risk index
+        table = risk_engine.answer(shop_domain, intent_id)
+        if table is not None:
+            return table
+        shop = self._covering(shop_domain, intent_id)
+        if shop is None:
+            return None
+        if intent_id == "sales":
+            return shop.daily_sales()
+        if intent_id == "discounts":
+            return shop.discount_usage()
+        if intent_id == "top_selling":
+            return shop.top_selling(int(params.get("limit", 5)))
+        return shop.geography()
+
+
+# Shared by every agent in the worker process.
+aggregates = AggregateStore(snapshot_store, shared=shared_store)
@@ -0,0 +1,58 @@
+import time
+
+import numpy as np
+
+import forecasting
+from forecasting import FORECAST_WORKERS, Forecaster, fit, forecast
+
+# Benchmark for the batch demand forecaster.
+# Synthesizes daily sales for a large catalog (weekly seasonality, trend and
+# Poisson noise) and times a full fit in one process and across the process
+# pool, an incremental one-day update, and the 30-day forecast itself.
+#
+#   python bench_forecast.py
+
+PRODUCTS = 50000
+DAYS = 120
+
+rng = np.random.default_rng(42)
+
+
+def synthetic_history(products: int, days: int) -> np.ndarray:
+    base = rng.gamma(1.5, 4.0, products)[:, None]
+    weekly = 1 + 0.3 * np.sin(2 * np.pi * np.arange(days) / 7)[None, :]
+    trend = 1 + rng.normal(0, 0.002, products)[:, None] * np.arange(days)[None, :]
+    return rng.poisson(np.maximum(base * weekly * trend, 0)).astype(np.float64)
+
+
+def timed(label: str, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{label:<34} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+if __name__ == "__main__":
+    history = synthetic_history(PRODUCTS, DAYS + 1)
+    products = np.array([f"SKU-{i:06d}" for i in range(PRODUCTS)], dtype=object)
+    print(f"{PRODUCTS} products x {DAYS} days, {len(forecasting.PARAMETER_GRID)} parameter sets, "
+          f"{FORECAST_WORKERS} pool workers\n")
+
+    state = timed("fit (one process)", lambda: fit(history[:, :DAYS]))
+    timed("fit (process pool, incl. startup)", lambda: forecasting._fit_parallel(history[:, :DAYS]))
+    timed("fit (process pool, warm)", lambda: forecasting._fit_parallel(history[:, :DAYS]))
+    predicted, confidence = timed("forecast 30 days", lambda: forecast(state, 30))
+
+    model_cache = Forecaster()
+    first_day = 0
+
+    def window(first: int, last: int) -> np.ndarray:
+        return history[:, max(first - first_day, 0):last - first_day + 1]
+
+    timed("Forecaster: first request", lambda: model_cache.model(("bench",), products, DAYS - 1, window))
+    timed("Forecaster: cached", lambda: model_cache.model(("bench",), products, DAYS - 1, window))
+    timed("Forecaster: one new day", lambda: model_cache.model(("bench",), products, DAYS, window))
+
+    error = np.abs(predicted / 30 - history[:, DAYS - 30:DAYS].mean(axis=1)).mean()
+    print(f"\nmean |daily forecast - last 30d mean|: {error:.2f} units, "
+          f"median confidence {np.median(confidence):.0%}")
@@ -0,0 +1,80 @@
+import random
+import string
+import time
+
+from intents import INTENTS, Intent, IntentMatcher
+
+# Micro-benchmark for intent classification.
+# Grows the intent table with synthetic entries and compares the compiled
+# single-pass matcher against the old approach of substring-scanning every
+# keyword of every intent in order.
+#
+#   python bench_intents.py
+
+TABLE_SIZES = [len(INTENTS), 50, 100, 250, 500, 1000, 2000]
+QUESTIONS = 2000
+
+
+def synthetic_word() -> str:
+    return "".join(random.choice(string.ascii_lowercase) for _ in range(random.randint(5, 10)))
+
+
+def build_table(size: int):
+    table = list(INTENTS)
+    while len(table) < size:
+        n = len(table)
+        table.append(Intent(
+            id=f"synthetic_{n}",
+            keywords=tuple(synthetic_word() for _ in range(3)),
+            template=f"FROM sales SHOW count() #synthetic_{n}",
+        ))
+    return table
+
+
+def build_questions(table):
+    keywords = [k for intent in table for k in intent.keywords]
+    filler = ["show", "me", "the", "for", "my", "store", "last", "month", "please", "what", "is"]
+    questions = []
+    for _ in range(QUESTIONS):
+        words = random.sample(filler, 6) + [random.choice(keywords)]
+        random.shuffle(words)
+        questions.append(" ".join(words))
+    return questions
+
+
+def linear_classify(table, question: str) -> str:
+    q = question.lower()
+    for intent in table:
+        for keyword in intent.keywords:
+            if keyword in q:
+                return intent.id
+    return "fallback"
+
+
+def time_per_question(fn, questions) -> float:
+    start = time.perf_counter()
+    for question in questions:
+        fn(question)
+    return (time.perf_counter() - start) / len(questions) * 1e6
+
+
+def main():
+    random.seed(42)
+    print(f"{'intents':>8} {'keywords':>9} {'compile ms':>11} {'matcher us/q':>13} {'linear us/q':>12}")
+    for size in TABLE_SIZES:
+        table = build_table(size)
+        questions = build_questions(table)
+
+        start = time.perf_counter()
+        compiled = IntentMatcher(table)
+        compile_ms = (time.perf_counter() - start) * 1e3
+
+        matcher_us = time_per_question(compiled.classify, questions)
+        linear_us = time_per_question(lambda q: linear_classify(table, q), questions)
+
+        keyword_count = sum(len(intent.keywords) for intent in table)
+        print(f"{size:>8} {keyword_count:>9} {compile_ms:>11.2f} {matcher_us:>13.2f} {linear_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Local stand-in for the Shopify Admin GraphQL API, for load tests.
+
+Answers shopifyqlQuery requests (single and aliased batch documents) with
+synthetic tables shaped after the query's SHOW/BY clauses, and emulates the
+behaviour that matters for performance work:
+
+    --latency-ms / --jitter-ms   response time
+    --error-rate                 share of requests answered with HTTP 502
+    --rows                       rows per result table
+    --bucket / --restore-rate    per-shop leaky bucket; THROTTLED errors and
+    --query-cost                 extensions.cost like the real API (--bucket 0 disables)
+    --bulk-orders / --bulk-variants  size of bulk operation exports (bulkOperationRunQuery),
+    --bulk-delay-ms                  served as streamed JSONL from /bulk/<id>.jsonl
+
+Shops are addressed by path, matching SHOPIFY_API_BASE_URL:
+
+    python benchmarks/fake_shopify.py --port 9100 --latency-ms 80
+    SHOPIFY_API_BASE_URL=http://127.0.0.1:9100/shops/{shop} uvicorn main:app
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shopifyql import UnsupportedQuery, parse  # noqa: E402
+
+app = FastAPI(title="Fake Shopify Admin GraphQL")
+
+# Defaults; overridden from the command line (or FAKE_SHOPIFY_* variables when run under uvicorn directly)
+config = argparse.Namespace(
+    latency_ms=float(os.getenv("FAKE_SHOPIFY_LATENCY_MS", "50")),
+    jitter_ms=float(os.getenv("FAKE_SHOPIFY_JITTER_MS", "20")),
+    error_rate=float(os.getenv("FAKE_SHOPIFY_ERROR_RATE", "0")),
+    rows=int(os.getenv("FAKE_SHOPIFY_ROWS", "20")),
+    bucket=float(os.getenv("FAKE_SHOPIFY_BUCKET", "1000")),
+    restore_rate=float(os.getenv("FAKE_SHOPIFY_RESTORE_RATE", "50")),
+    query_cost=float(os.getenv("FAKE_SHOPIFY_QUERY_COST", "10")),
+    bulk_orders=int(os.getenv("FAKE_SHOPIFY_BULK_ORDERS", "10000")),
+    bulk_variants=int(os.getenv("FAKE_SHOPIFY_BULK_VARIANTS", "2000")),
+    bulk_delay_ms=float(os.getenv("FAKE_SHOPIFY_BULK_DELAY_MS", "1000")),
+)
+
+_buckets: Dict[str, List[float]] = {}  # shop -> [available, updated_at]
+_tables: Dict[str, bytes] = {}  # ShopifyQL -> encoded TableResponse
+_bulk_operations: Dict[int, Dict[str, Any]] = {}
+counters = {"requests": 0, "queries": 0, "throttled": 0, "errors": 0, "bulk_operations": 0}
+
+
+def _columns(query: str) -> List[str]:
+    try:
+        parsed = parse(query)
+    except UnsupportedQuery:
+        return ["product_title", "predicted_demand", "confidence"]
+    dims = list(parsed.group_by) + ([parsed.over[0]] if parsed.over else [])
+    return dims + [f.alias for f in parsed.fields]
+
+
+def _table(query: str) -> bytes:
+    """
+    Synthetic TableResponse for a query, built once and reused. The first
+    column is a label (or a date for day/date columns), the rest are numbers.
+    """
+    encoded = _tables.get(query)
+    if encoded is None:
+        rng = random.Random(query)
+        headers = _columns(query)
+        today = datetime.date.today()
+        rows = []
+        for i in range(config.rows):
+            if headers[0] in ("day", "date"):
+                label = (today - datetime.timedelta(days=config.rows - i)).isoformat()
+            else:
+                label = f"{headers[0].replace('_', ' ').title()} {i + 1}"
+            rows.append([label] + [round(rng.uniform(1, 500), 2) for _ in headers[1:]])
+        table = {"__typename": "TableResponse", "headers": headers, "rows": rows}
+        encoded = _tables[query] = json.dumps(table, separators=(",", ":")).encode()
+    return encoded
+
+
+def _take(shop: str, cost: float) -> Dict[str, Any]:
+    """
+    Leaky bucket for one shop; returns the throttleStatus after the charge,
+    with "throttled" set when the bucket could not cover `cost`.
+    """
+    now = time.monotonic()
+    available, updated = _buckets.get(shop, [config.bucket, now])
+    available = min(config.bucket, available + (now - updated) * config.restore_rate)
+    throttled = available < cost
+    if not throttled:
+        available -= cost
+    _buckets[shop] = [available, now]
+    return {
+        "throttled": throttled,
+        "maximumAvailable": config.bucket,
+        "currentlyAvailable": round(available, 1),
+        "restoreRate": config.restore_rate,
+    }
+
+
+def _bulk_lines(kind: str, shop: str):
+    """
+    JSONL export generated on the fly, in the flattened shape Shopify uses:
+    child objects (line items, inventory levels) on their own lines with a
+    __parentId.
+    """
+    rng = random.Random(f"{shop}/{kind}")
+    products = [f"Product {i:05d}" for i in range(max(config.bulk_variants // 2, 1))]
+    if kind == "inventory":
+        for i in range(config.bulk_variants):
+            product = products[i % len(products)]
+            variant_id = f"gid://shopify/ProductVariant/{i + 1}"
+            levels = [rng.randint(0, 40) for _ in range(rng.randint(1, 2))]
+            yield json.dumps({
+                "id": variant_id, "title": "Default" if i < len(products) else "Large",
+                "inventoryQuantity": sum(levels), "product": {"title": product},
+                "inventoryItem": {"id": f"gid://shopify/InventoryItem/{i + 1}"},
+            }) + "\n"
+            for location, available in enumerate(levels, start=1):
+                yield json.dumps({
+                    "id": f"gid://shopify/InventoryLevel/{i + 1}?inventory_item_id={i + 1}&location_id={location}",
+                    "location": {"id": f"gid://shopify/Location/{location}"},
+                    "quantities": [{"name": "available", "quantity": available}],
+                    "__parentId": variant_id,
+                }) + "\n"
+        return
+    now = time.time()
+    countries = ["United States", "Canada", "United Kingdom", "Germany", "Australia"]
+    for i in range(config.bulk_orders):
+        order_id = f"gid://shopify/Order/{i + 1}"
+        created = datetime.datetime.fromtimestamp(now - rng.uniform(0, 120 * 86400), datetime.timezone.utc)
+        yield json.dumps({
+            "id": order_id, "createdAt": created.isoformat().replace("+00:00", "Z"),
+            "totalPriceSet": {"shopMoney": {"amount": f"{rng.uniform(5, 300):.2f}"}},
+            "billingAddress": {"country": rng.choice(countries)},
+            "discountCodes": [rng.choice(["SUMMER20", "WELCOME10"])] if rng.random() < 0.3 else [],
+            "customer": {"displayName": f"Customer {rng.randint(1, max(config.bulk_orders // 3, 1))}"},
+        }) + "\n"
+        for j in range(rng.randint(1, 3)):
+            quantity = rng.randint(1, 3)
+            yield json.dumps({
+                "id": f"gid://shopify/LineItem/{i * 10 + j}", "title": rng.choice(products), "quantity": quantity,
+                "originalTotalSet": {"shopMoney": {"amount": f"{quantity * rng.uniform(10, 90):.2f}"}},
+                "__parentId": order_id,
+            }) + "\n"
+
+
+def _bulk_operation(query: str, variables: Dict[str, Any], shop: str, base_url: str) -> bytes:
+    if "bulkOperationRunQuery" in query:
+        number = len(_bulk_operations) + 1
+        kind = "inventory" if "productVariants" in variables.get("query", "") else "orders"
+        _bulk_operations[number] = {"kind": kind, "shop": shop,
+                                    "ready_at": time.monotonic() + config.bulk_delay_ms / 1000}
+        counters["bulk_operations"] += 1
+        operation = {"id": f"gid://shopify/BulkOperation/{number}", "status": "CREATED"}
+        return json.dumps({"bulkOperationRunQuery": {"bulkOperation": operation, "userErrors": []}}).encode()
+
+    number = int(str(variables.get("id", "")).rsplit("/", 1)[-1] or 0)
+    operation = _bulk_operations.get(number)
+    if operation is None:
+        return b'{"node":null}'
+    done = time.monotonic() >= operation["ready_at"]
+    objects = config.bulk_variants if operation["kind"] == "inventory" else config.bulk_orders * 3
+    return json.dumps({"node": {
+        "id": f"gid://shopify/BulkOperation/{number}", "status": "COMPLETED" if done else "RUNNING",
+        "errorCode": None, "objectCount": str(objects if done else 0),
+        "url": f"{base_url}bulk/{number}.jsonl" if done else None, "partialDataUrl": None,
+    }}).encode()
+
+
+def _chunked(lines, size: int = 64 * 1024):
+    buffer, length = [], 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+@app.get("/bulk/{number}.jsonl")
+def bulk_file(number: int):
+    operation = _bulk_operations.get(number)
+    if operation is None:
+        return Response(status_code=404)
+    lines = _bulk_lines(operation["kind"], operation["shop"])
+    return StreamingResponse(_chunked(lines), media_type="application/jsonl")
+
+
+@app.post("/shops/{shop}/admin/api/{version}/graphql.json")
+async def graphql(shop: str, version: str, request: Request):
+    body = await request.json()
+    variables: Dict[str, str] = body.get("variables") or {}
+    counters["requests"] += 1
+    counters["queries"] += len(variables)
+
+    delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+    await asyncio.sleep(max(delay, 0.0) / 1000)
+
+    if random.random() < config.error_rate:
+        counters["errors"] += 1
+        return Response(status_code=502, content=b"Bad Gateway")
+
+    cost = config.query_cost * max(len(variables), 1)
+    extensions = b""
+    if config.bucket > 0:
+        status = _take(shop, cost)
+        throttled = status.pop("throttled")
+        extensions = json.dumps({"cost": {
+            "requestedQueryCost": cost,
+            "actualQueryCost": None if throttled else cost,
+            "throttleStatus": status,
+        }}, separators=(",", ":")).encode()
+        if throttled:
+            counters["throttled"] += 1
+            body = b'{"errors":[{"message":"Throttled","extensions":{"code":"THROTTLED"}}],"extensions":' + \
+                extensions + b"}"
+            return Response(content=body, media_type="application/json")
+
+    document = body.get("query") or ""
+    if "bulkOperationRunQuery" in document or "BulkOperation" in document:
+        data = _bulk_operation(document, variables, shop, str(request.base_url))
+    elif "qlQuery" in variables:
+        data = b'{"shopifyqlQuery":' + _table(variables["qlQuery"]) + b"}"
+    else:
+        data = b"{" + b",".join(
+            json.dumps(alias).encode() + b":" + _table(query) for alias, query in variables.items()
+        ) + b"}"
+    content = b'{"data":' + data + (b',"extensions":' + extensions if extensions else b"") + b"}"
+    return Response(content=content, media_type="application/json")
+
+
+@app.get("/stats")
+def stats():
+    return counters
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=config.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=config.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=config.error_rate)
+    parser.add_argument("--rows", type=int, default=config.rows)
+    parser.add_argument("--bucket", type=float, default=config.bucket)
+    parser.add_argument("--restore-rate", type=float, default=config.restore_rate)
+    parser.add_argument("--query-cost", type=float, default=config.query_cost)
+    parser.add_argument("--bulk-orders", type=int, default=config.bulk_orders)
+    parser.add_argument("--bulk-variants", type=int, default=config.bulk_variants)
+    parser.add_argument("--bulk-delay-ms", type=float, default=config.bulk_delay_ms)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    for key in vars(config):
+        setattr(config, key, getattr(args, key))
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
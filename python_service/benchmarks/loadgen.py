@@ -0,0 +1,257 @@
+"""
+Load generator for /analyze.
+
+Replays a weighted mix of the agent's intents from many concurrent clients
+across a set of shops (a few hot, many cold) and reports throughput, latency
+percentiles, service memory and fallback rate.
+
+Against a running service:
+
+    python benchmarks/loadgen.py --url http://127.0.0.1:8000 --duration 30
+
+Or let it start the fake Shopify server and the service itself (Linux; the
+service's RSS is read from /proc), passing fake server knobs through:
+
+    python benchmarks/loadgen.py --spawn --latency-ms 80 --error-rate 0.02 --save baseline
+    python benchmarks/loadgen.py --spawn --latency-ms 80 --error-rate 0.02 --compare baseline
+
+Baselines are JSON files in benchmarks/baselines/.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from fake_shopify import add_arguments
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(HERE)
+BASELINE_DIR = os.path.join(HERE, "baselines")
+
+# (question, weight): roughly what merchants ask a dashboard assistant
+QUESTION_MIX = [
+    ("What were my sales in the last 30 days?", 20),
+    ("What are my top 5 selling products?", 12),
+    ("Which products are likely to go out of stock soon?", 8),
+    ("Show me current inventory levels", 8),
+    ("How many units should I reorder?", 6),
+    ("Where are my customers located?", 6),
+    ("Which discount codes performed best?", 5),
+    ("Where is my traffic coming from?", 5),
+    ("Who are my repeat customers?", 5),
+    ("Forecast demand for next month", 4),
+    ("What is my return rate?", 3),
+    ("Which device do customers buy from?", 3),
+    ("How many abandoned carts did I have?", 3),
+    ("How did my email campaign do?", 2),
+    ("Tell me something interesting", 2),
+]
+
+_METRIC = re.compile(r'^analyze_questions_total\{intent="([^"]*)",source="([^"]*)"\} (\S+)$', re.M)
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(q / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def _rss_mb(pid: Optional[int]) -> Dict[str, Optional[float]]:
+    """
+    Current and peak resident memory of a process, from /proc (Linux only).
+    """
+    result: Dict[str, Optional[float]] = {"rss_mb": None, "peak_rss_mb": None}
+    if pid is None:
+        return result
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    result["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith("VmHWM:"):
+                    result["peak_rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return result
+
+
+def _fallback_counts(metrics_text: str) -> Dict[str, float]:
+    counts = {"total": 0.0, "fallback": 0.0, "unmatched": 0.0}
+    for intent, source, value in _METRIC.findall(metrics_text):
+        counts["total"] += float(value)
+        if source == "fallback":
+            counts["fallback"] += float(value)
+            if intent == "fallback":
+                counts["unmatched"] += float(value)
+    return counts
+
+
+async def _scrape(client: httpx.AsyncClient, url: str) -> Dict[str, float]:
+    try:
+        response = await client.get(f"{url}/metrics")
+        return _fallback_counts(response.text)
+    except httpx.HTTPError:
+        return {"total": 0.0, "fallback": 0.0, "unmatched": 0.0}
+
+
+async def run_load(url: str, duration: float, concurrency: int, shops: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    questions = [q for q, _ in QUESTION_MIX]
+    weights = [w for _, w in QUESTION_MIX]
+    domains = [f"bench-shop-{i}.myshopify.com" for i in range(shops)]
+    # Zipf-like: the first shops get most of the traffic
+    shop_weights = [1 / (i + 1) for i in range(shops)]
+
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        before = await _scrape(client, url)
+        stop_at = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < stop_at:
+                payload = {
+                    "query": rng.choices(questions, weights)[0],
+                    "shop_domain": rng.choices(domains, shop_weights)[0],
+                    "access_token": "bench-token",
+                }
+                start = time.perf_counter()
+                try:
+                    response = await client.post(f"{url}/analyze", json=payload)
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        after = await _scrape(client, url)
+
+    latencies.sort()
+    answered = after["total"] - before["total"]
+    fallbacks = after["fallback"] - before["fallback"]
+    unmatched = after["unmatched"] - before["unmatched"]
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "statuses": statuses,
+        # Mock answers for questions the agent understood (upstream trouble), and overall
+        "fallback_rate": round((fallbacks - unmatched) / max(answered - unmatched, 1), 4),
+        "fallback_rate_all": round(fallbacks / max(answered, 1), 4),
+    }
+
+
+def _wait_for(url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def _spawn(args) -> List[subprocess.Popen]:
+    fake_args = [
+        "--port", str(args.fake_port),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", str(args.error_rate), "--rows", str(args.rows),
+        "--bucket", str(args.bucket), "--restore-rate", str(args.restore_rate),
+        "--query-cost", str(args.query_cost),
+    ]
+    fake = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_shopify.py")] + fake_args)
+    _wait_for(f"http://127.0.0.1:{args.fake_port}/stats")
+
+    env = dict(os.environ, SHOPIFY_API_BASE_URL=f"http://127.0.0.1:{args.fake_port}/shops/{{shop}}",
+               LOG_LEVEL=os.getenv("LOG_LEVEL", "ERROR"))
+    service = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=SERVICE_DIR, env=env,
+    )
+    _wait_for(f"http://127.0.0.1:{args.port}/")
+    return [fake, service]
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(current: Dict[str, Any], baseline: Dict[str, Any]):
+    print(f"\nCompared with baseline (revision {baseline.get('revision')}):")
+    for key in ("rps", "p50_ms", "p95_ms", "p99_ms", "max_ms", "fallback_rate", "rss_mb", "peak_rss_mb"):
+        old, new = baseline["results"].get(key), current["results"].get(key)
+        if old is None or new is None:
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"  {key:<14} {old:>10} -> {new:<10} ({change})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--shops", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--service-pid", type=int, help="PID of an already running service, for memory figures")
+    parser.add_argument("--spawn", action="store_true", help="start the fake Shopify server and the service")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--save", metavar="NAME", help="write results to baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare results with baselines/NAME.json")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    processes: List[subprocess.Popen] = []
+    url, pid = args.url, args.service_pid
+    try:
+        if args.spawn:
+            processes = _spawn(args)
+            url, pid = f"http://127.0.0.1:{args.port}", processes[1].pid
+
+        print(f"Running {args.concurrency} clients for {args.duration:.0f}s against {url} ...")
+        results = asyncio.run(run_load(url, args.duration, args.concurrency, args.shops, args.seed))
+        results.update(_rss_mb(pid))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(timeout=10)
+
+    report = {
+        "revision": _git_revision(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("save", "compare", "service_pid")},
+        "results": results,
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            _compare(report, json.load(f))
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {path}")
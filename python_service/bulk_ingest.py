@@ -0,0 +1,361 @@
+"""
+Seeds or refreshes a shop's columnar snapshot from Shopify bulk operations:
+one bulkOperationRunQuery per export, polled until it completes, with the
+JSONL result streamed line by line into typed column buffers and written
+with SnapshotStore.write_table.
+
+    python bulk_ingest.py demo-store.myshopify.com --token shpat_...
+    python bulk_ingest.py demo-store.myshopify.com --token x --tables inventory
+
+Against benchmarks/fake_shopify.py (which also serves bulk exports):
+
+    SHOPIFY_API_BASE_URL=http://127.0.0.1:9100/shops/{shop} python bulk_ingest.py demo-store --token x
+"""
+import argparse
+import array
+import asyncio
+import datetime
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import httpx
+import numpy as np
+
+from local_engine import SnapshotStore, snapshot_store
+from logs import get_logger
+from shopify_client import get_bulk_operation, normalize_domain, run_bulk_query
+from stock_risk import REORDER_COVER_DAYS
+
+logger = get_logger("bulk_ingest")
+
+BULK_POLL_SECONDS = float(os.getenv("BULK_POLL_SECONDS", "2"))
+BULK_MAX_POLL_SECONDS = float(os.getenv("BULK_MAX_POLL_SECONDS", "15"))
+BULK_TIMEOUT_SECONDS = float(os.getenv("BULK_TIMEOUT_SECONDS", "3600"))
+# Sales velocity for the inventory table is averaged over this many recent days
+VELOCITY_DAYS = int(os.getenv("VELOCITY_DAYS", "30"))
+# Reorder point: this many days of sales at the current velocity
+REORDER_LEAD_DAYS = float(os.getenv("REORDER_LEAD_DAYS", "14"))
+
+ORDERS_BULK_QUERY = """
+{
+  orders {
+    edges {
+      node {
+        id
+        createdAt
+        totalPriceSet { shopMoney { amount } }
+        billingAddress { country }
+        discountCodes
+        customer { displayName }
+        lineItems {
+          edges {
+            node {
+              id
+              title
+              quantity
+              originalTotalSet { shopMoney { amount } }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+INVENTORY_BULK_QUERY = """
+{
+  productVariants {
+    edges {
+      node {
+        id
+        title
+        inventoryQuantity
+        product { title }
+        inventoryItem {
+          id
+          inventoryLevels {
+            edges {
+              node {
+                id
+                location { id }
+                quantities(names: ["available"]) { name quantity }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+BULK_QUERIES = {"orders": ORDERS_BULK_QUERY, "inventory": INVENTORY_BULK_QUERY}
+FINAL_STATUSES = {"COMPLETED", "FAILED", "CANCELED", "CANCELLED", "EXPIRED"}
+
+
+class BulkOperationFailed(RuntimeError):
+    pass
+
+
+def _gid_number(gid: Optional[str]) -> int:
+    """
+    Numeric part of a global id ("gid://shopify/Order/123" -> 123).
+    """
+    try:
+        return int(str(gid).rsplit("/", 1)[-1])
+    except ValueError:
+        return 0
+
+
+def _money(value: Optional[Dict[str, Any]]) -> float:
+    try:
+        return float(((value or {}).get("shopMoney") or {}).get("amount") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _epoch_seconds(timestamp: Optional[str]) -> int:
+    if not timestamp:
+        return 0
+    return int(datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp())
+
+
+class ColumnBuffers:
+    """
+    Append-only typed columns for one table. Numbers go into array.array
+    buffers (8 bytes a value, no Python objects per row) and strings are
+    dictionary encoded as they arrive, so memory grows with the data rather
+    than with the JSONL text.
+    """
+
+    def __init__(self, kinds: Dict[str, str]):
+        # kind: "f" float, "i" integer, "t" epoch seconds, "s" string
+        self.kinds = kinds
+        self._numbers = {name: array.array("d" if kind == "f" else "q")
+                         for name, kind in kinds.items() if kind != "s"}
+        self._codes = {name: array.array("q") for name, kind in kinds.items() if kind == "s"}
+        self._dictionaries: Dict[str, Dict[str, int]] = {name: {} for name in self._codes}
+
+    def append(self, **values: Any):
+        for name, value in values.items():
+            codes = self._codes.get(name)
+            if codes is None:
+                self._numbers[name].append(value)
+            else:
+                dictionary = self._dictionaries[name]
+                codes.append(dictionary.setdefault(value or "", len(dictionary)))
+
+    def __len__(self) -> int:
+        buffers = self._numbers or self._codes
+        return len(next(iter(buffers.values()))) if buffers else 0
+
+    def column(self, name: str) -> np.ndarray:
+        if name in self._codes:
+            values = np.empty(len(self._dictionaries[name]), dtype=object)
+            values[:] = list(self._dictionaries[name])
+            return values[np.frombuffer(self._codes[name], dtype=np.int64)]
+        values = np.frombuffer(self._numbers[name], dtype=np.float64 if self.kinds[name] == "f" else np.int64)
+        if self.kinds[name] == "t":
+            return values.astype("datetime64[s]")
+        return values
+
+    def columns(self, names: Sequence[str]) -> Dict[str, np.ndarray]:
+        return {name: self.column(name) for name in names}
+
+
+async def iter_jsonl(url: str, timeout: float = 60.0) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streams a JSONL export and yields one decoded object per line; only the
+    current chunk of the file is held in memory.
+    """
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+class BulkIngest:
+    """
+    Runs the bulk exports for one shop, one at a time (Shopify allows a single
+    bulk query operation per shop), and writes them into the snapshot store.
+    """
+
+    def __init__(self, shop_domain: str, access_token: str, store: SnapshotStore = snapshot_store):
+        self.shop_domain = normalize_domain(shop_domain)
+        self.access_token = access_token
+        self.store = store
+
+    async def run(self, tables: Sequence[str] = ("orders", "inventory")) -> Dict[str, int]:
+        """
+        Ingests the given exports ("orders" writes the orders, sales and
+        customers tables; "inventory" the inventory table). Returns rows
+        written per table.
+        """
+        written: Dict[str, int] = {}
+        for export in tables:
+            url = await self.export(BULK_QUERIES[export])
+            if export == "orders":
+                written.update(await self.ingest_orders(url))
+            else:
+                written.update(await self.ingest_inventory(url))
+        return written
+
+    async def export(self, query: str) -> Optional[str]:
+        """
+        Starts a bulk operation and polls (with backoff) until it finishes.
+        Returns the JSONL url, or None when the export is empty.
+        """
+        operation = await run_bulk_query(self.shop_domain, self.access_token, query)
+        logger.info("Bulk operation started", extra={"shop": self.shop_domain, "operation": operation["id"]})
+        give_up = time.monotonic() + BULK_TIMEOUT_SECONDS
+        delay = BULK_POLL_SECONDS
+        while operation.get("status") not in FINAL_STATUSES:
+            if time.monotonic() > give_up:
+                raise BulkOperationFailed(f"Bulk operation {operation['id']} did not finish in time")
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, BULK_MAX_POLL_SECONDS)
+            operation = await get_bulk_operation(self.shop_domain, self.access_token, operation["id"])
+        if operation["status"] != "COMPLETED":
+            raise BulkOperationFailed(
+                f"Bulk operation {operation['id']} ended {operation['status']} ({operation.get('errorCode')})")
+        logger.info("Bulk operation completed", extra={"shop": self.shop_domain, "operation": operation["id"],
+                                                       "objects": operation.get("objectCount")})
+        return operation.get("url")
+
+    async def ingest_orders(self, url: Optional[str]) -> Dict[str, int]:
+        orders = ColumnBuffers({"id": "i", "timestamp": "t", "total_price": "f",
+                                "billing_address_country": "s", "discount_code": "s"})
+        customers = ColumnBuffers({"timestamp": "t", "customer_name": "s"})
+        # Line items reference their order by id; timestamps are joined on after the stream
+        lines = ColumnBuffers({"order_id": "i", "product_title": "s", "net_quantity": "i", "total_sales": "f"})
+
+        if url:
+            async for record in iter_jsonl(url):
+                parent = record.get("__parentId")
+                if parent is None:
+                    created = _epoch_seconds(record.get("createdAt"))
+                    codes = record.get("discountCodes") or [""]
+                    orders.append(id=_gid_number(record.get("id")), timestamp=created,
+                                  total_price=_money(record.get("totalPriceSet")),
+                                  billing_address_country=(record.get("billingAddress") or {}).get("country"),
+                                  discount_code=codes[0])
+                    customer = (record.get("customer") or {}).get("displayName")
+                    if customer:
+                        customers.append(timestamp=created, customer_name=customer)
+                else:
+                    lines.append(order_id=_gid_number(parent), product_title=record.get("title"),
+                                 net_quantity=int(record.get("quantity") or 0),
+                                 total_sales=_money(record.get("originalTotalSet")))
+
+        order_ids = orders.column("id")
+        order_times = orders.column("timestamp")
+        by_id = np.argsort(order_ids, kind="stable")
+        parent = lines.column("order_id")
+        position = np.minimum(np.searchsorted(order_ids[by_id], parent), max(len(order_ids) - 1, 0))
+        known = order_ids[by_id][position] == parent if len(order_ids) else np.zeros(len(parent), dtype=bool)
+
+        sales = lines.columns(["product_title", "net_quantity", "total_sales"])
+        sales = {"timestamp": order_times[by_id][position][known], **{k: v[known] for k, v in sales.items()}}
+
+        self.store.write_table(self.shop_domain, "orders", orders.columns(
+            ["timestamp", "total_price", "billing_address_country", "discount_code"]), time_column="timestamp")
+        self.store.write_table(self.shop_domain, "sales", sales, time_column="timestamp")
+        self.store.write_table(self.shop_domain, "customers", customers.columns(["timestamp", "customer_name"]),
+                               time_column="timestamp")
+        return {"orders": len(orders), "sales": int(known.sum()), "customers": len(customers)}
+
+    async def ingest_inventory(self, url: Optional[str]) -> Dict[str, int]:
+        variants = ColumnBuffers({"id": "i", "inventory_item_id": "i", "product_title": "s",
+                                  "product_variant_title": "s", "quantity": "i"})
+        # Inventory levels reference their variant by id; item ids are joined on after the stream
+        levels = ColumnBuffers({"variant_id": "i", "location_id": "i", "available": "i"})
+        if url:
+            async for record in iter_jsonl(url):
+                parent = record.get("__parentId")
+                if parent is None:
+                    product = (record.get("product") or {}).get("title") or ""
+                    variants.append(id=_gid_number(record.get("id")),
+                                    inventory_item_id=_gid_number((record.get("inventoryItem") or {}).get("id")),
+                                    product_title=product,
+                                    product_variant_title=f"{product} ({record.get('title') or 'Default'})",
+                                    quantity=int(record.get("inventoryQuantity") or 0))
+                else:
+                    available = next((q.get("quantity") for q in record.get("quantities") or []
+                                      if q.get("name") == "available"), 0)
+                    levels.append(variant_id=_gid_number(parent),
+                                  location_id=_gid_number((record.get("location") or {}).get("id")),
+                                  available=int(available or 0))
+
+        variant_ids = variants.column("id")
+        by_id = np.argsort(variant_ids, kind="stable")
+        parent = levels.column("variant_id")
+        position = np.minimum(np.searchsorted(variant_ids[by_id], parent), max(len(variant_ids) - 1, 0))
+        known = variant_ids[by_id][position] == parent if len(variant_ids) else np.zeros(len(parent), dtype=bool)
+        # Written before the inventory table, whose rewrite makes the risk index reload both
+        self.store.write_table(self.shop_domain, "inventory_levels", {
+            "inventory_item_id": variants.column("inventory_item_id")[by_id][position][known],
+            "location_id": levels.column("location_id")[known],
+            "available": levels.column("available")[known],
+        })
+
+        columns = variants.columns(["inventory_item_id", "product_title", "product_variant_title", "quantity"])
+        velocity = self._variant_velocity(columns["product_title"])
+        reorder_point = np.ceil(velocity * REORDER_LEAD_DAYS)
+        target = reorder_point + velocity * REORDER_COVER_DAYS
+        columns.update({
+            "avg_daily_sales": np.round(velocity, 2),
+            "reorder_point": reorder_point.astype(np.int64),
+            "recommended_order_qty": np.maximum(np.ceil(target - columns["quantity"]), 0).astype(np.int64),
+        })
+        self.store.write_table(self.shop_domain, "inventory", columns,
+                               aggs={"avg_daily_sales": "avg", "reorder_point": "avg"})
+        return {"inventory": len(variants), "inventory_levels": int(known.sum())}
+
+    def _variant_velocity(self, variant_products: np.ndarray) -> np.ndarray:
+        """
+        Units sold per day over the last VELOCITY_DAYS for each variant's
+        product (from the sales snapshot), split evenly across the product's
+        variants. Zero when there is no sales history.
+        """
+        velocity = np.zeros(len(variant_products))
+        if not len(variant_products) or not self.store.has_table(self.shop_domain, "sales"):
+            return velocity
+        sales = self.store.open(self.shop_domain, "sales")
+        since = np.datetime64("now", "s") - np.timedelta64(VELOCITY_DAYS, "D")
+        recent = np.asarray(sales.values("timestamp")) >= since
+        titles = sales.dictionary("product_title")
+        sold = np.bincount(np.asarray(sales.values("product_title"))[recent],
+                           weights=np.asarray(sales.values("net_quantity"))[recent], minlength=len(titles))
+        products, inverse = np.unique(variant_products.astype(str), return_inverse=True)
+        per_product = np.zeros(len(products))
+        matched = np.searchsorted(titles.astype(str), products)
+        matched = np.minimum(matched, max(len(titles) - 1, 0))
+        found = titles.astype(str)[matched] == products if len(titles) else np.zeros(len(products), dtype=bool)
+        per_product[found] = sold[matched[found]] / VELOCITY_DAYS
+        variant_counts = np.bincount(inverse, minlength=len(products))
+        return per_product[inverse] / variant_counts[inverse]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("shop_domain")
+    parser.add_argument("--token", required=True, help="Admin API access token")
+    parser.add_argument("--tables", default="orders,inventory",
+                        help="comma separated exports to run: orders, inventory")
+    args = parser.parse_args()
+
+    exports: List[str] = [t.strip() for t in args.tables.split(",") if t.strip()]
+    unknown = [t for t in exports if t not in BULK_QUERIES]
+    if unknown:
+        parser.error(f"unknown export(s): {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    written = asyncio.run(BulkIngest(args.shop_domain, args.token).run(exports))
+    rows = ", ".join(f"{table}: {count}" for table, count in written.items())
+    print(f"Ingested {normalize_domain(args.shop_domain)} ({rows}) "
+          f"in {time.perf_counter() - start:.1f}s under {snapshot_store.root}")
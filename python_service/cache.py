@@ -0,0 +1,285 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from serialization import Payload
+from shared_store import SharedStore, shared_store
+from shopify_client import normalize_domain
+from table import ColumnarTable
+
+# How often a worker checks the shared store while a peer fetches a query
+PEER_POLL_SECONDS = 0.05
+
+
+def normalize_query(query: str) -> str:
+    """
+    Collapses whitespace so trivially different spellings share a cache slot.
+    """
+    return " ".join(query.split())
+
+
+def cache_key(shop_domain: str, query: str) -> Tuple[str, str]:
+    return normalize_domain(shop_domain), normalize_query(query)
+
+
+@dataclass
+class CacheEntry:
+    data: Any
+    size: int
+    stored_at: float
+    expires_at: float
+    # Response encoding of `data`, built on first use (see ResultCache.payload)
+    payload: Optional[Payload] = None
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.stored_at
+
+
+class ResultCache:
+    """
+    Bounded in-process cache of ShopifyQL results keyed on
+    (shop domain, normalized ShopifyQL).
+
+    Entries expire after a per-entry TTL (chosen by the caller from the intent)
+    and the least recently used entries are evicted once the total encoded size
+    exceeds `max_bytes`.
+
+    With a SharedStore (multi-process serving) this is the L1 in front of it:
+    tables are written through, L1 misses are read from the store, and the
+    store's leases let one worker fetch a query while the others wait. Store
+    calls, and the decoding around them, run on the store's thread.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, shared: Optional[SharedStore] = None):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.current_bytes = 0
+        self._entries: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.shared_hits = 0
+        self.stale_hits = 0
+
+    async def get(self, shop_domain: str, query: str) -> Optional[CacheEntry]:
+        key = cache_key(shop_domain, query)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            entry = await self._get_shared(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+        else:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def get_stale(self, shop_domain: str, query: str, max_stale: float) -> Optional[CacheEntry]:
+        """
+        This worker's entry for the query, even up to `max_stale` seconds past
+        its TTL (without refreshing it). For degraded answers under overload,
+        so the shared store is not consulted.
+        """
+        entry = self._entries.get(cache_key(shop_domain, query))
+        if entry is None or entry.expires_at + max_stale <= time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        if entry.expires_at <= time.monotonic():
+            self.stale_hits += 1
+        return entry
+
+    def holds(self, shop_domain: str, query: str) -> bool:
+        """
+        True if this worker has a fresh entry for the query. Does not count
+        as a lookup.
+        """
+        entry = self._entries.get(cache_key(shop_domain, query))
+        return entry is not None and entry.expires_at > time.monotonic()
+
+    def remaining_ttl(self, shop_domain: str, query: str) -> Optional[float]:
+        """
+        Seconds until this worker's entry for the query expires (negative once
+        it has), or None if there is none. Does not count as a lookup.
+        """
+        entry = self._entries.get(cache_key(shop_domain, query))
+        return entry.expires_at - time.monotonic() if entry is not None else None
+
+    def payload(self, shop_domain: str, query: str, entry: CacheEntry,
+                to_json: Callable[[Any], Any]) -> Payload:
+        """
+        The entry's data serialized for responses (`to_json` gives its JSON
+        shape), encoded on first use and kept with the entry, so repeated
+        answers skip re-encoding and gzip responses reuse its compressed form.
+        The encoded size counts toward max_bytes while the entry is held.
+        """
+        if entry.payload is None:
+            entry.payload = Payload.of(to_json(entry.data))
+            key = cache_key(shop_domain, query)
+            if self._entries.get(key) is entry:
+                entry.size += len(entry.payload)
+                self.current_bytes += len(entry.payload)
+                self._evict()
+        return entry.payload
+
+    async def _get_shared(self, key: Tuple[str, str]) -> Optional[CacheEntry]:
+        """
+        Looks the key up in the shared store and promotes a hit into L1,
+        keeping the age and expiry it was stored with.
+        """
+        if self.shared is None:
+            return None
+        found = await self.shared.run(self._load_shared, key)
+        if found is None:
+            return None
+        table, stored_at, expires_at = found
+        # Wall-clock times from the store, mapped onto this process's monotonic clock
+        offset = time.monotonic() - time.time()
+        if table.nbytes > self.max_bytes:
+            return CacheEntry(data=table, size=table.nbytes, stored_at=stored_at + offset,
+                              expires_at=expires_at + offset)
+        return self._insert(key, table, table.nbytes, stored_at + offset, expires_at + offset)
+
+    def _load_shared(self, key: Tuple[str, str]) -> Optional[Tuple[ColumnarTable, float, float]]:
+        found = self.shared.get(*key)
+        if found is None:
+            return None
+        payload, stored_at, expires_at = found
+        return ColumnarTable.from_rows(payload.get("headers") or [], payload.get("rows") or []), stored_at, expires_at
+
+    def put(self, shop_domain: str, query: str, data: Any, ttl: float,
+            size: Optional[int] = None) -> Optional[CacheEntry]:
+        if size is None:
+            size = len(json.dumps(data, separators=(",", ":")))
+        if ttl <= 0 or size > self.max_bytes:
+            return None
+
+        key = cache_key(shop_domain, query)
+        if self.shared is not None and isinstance(data, ColumnarTable):
+            self.shared.submit(lambda: self.shared.put(*key, data.to_dict(), ttl))
+        now = time.monotonic()
+        return self._insert(key, data, size, now, now + ttl)
+
+    def _insert(self, key: Tuple[str, str], data: Any, size: int,
+                stored_at: float, expires_at: float) -> CacheEntry:
+        if key in self._entries:
+            self._remove(key)
+
+        entry = CacheEntry(data=data, size=size, stored_at=stored_at, expires_at=expires_at)
+        self._entries[key] = entry
+        self.current_bytes += size
+        self._evict()
+        return entry
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry.size
+
+    @staticmethod
+    def _prefixes(tables: Iterable[str]) -> Tuple[str, ...]:
+        return tuple(f"from {table.lower()} " for table in tables)
+
+    def invalidate_local(self, shop_domain: str, tables: Iterable[str]) -> int:
+        """
+        Drops this worker's entries for the shop's queries reading any of
+        `tables` (matched on the FROM clause), leaving the shared store alone
+        (a peer already cleared it). Returns the number of entries removed.
+        """
+        domain = normalize_domain(shop_domain)
+        prefixes = self._prefixes(tables)
+        if not prefixes:
+            return 0
+        stale = [key for key in self._entries
+                 if key[0] == domain and key[1].lower().startswith(prefixes)]
+        for key in stale:
+            self._remove(key)
+        self.invalidations += len(stale)
+        return len(stale)
+
+    async def invalidate(self, shop_domain: str, tables: Iterable[str]) -> int:
+        """
+        Like invalidate_local, and clears the shared store too.
+        """
+        removed = self.invalidate_local(shop_domain, tables)
+        prefixes = self._prefixes(tables)
+        if self.shared is not None and prefixes:
+            shared_removed = await self.shared.run(self.shared.invalidate, normalize_domain(shop_domain), prefixes)
+            self.invalidations += shared_removed
+            removed += shared_removed
+        return removed
+
+    async def claim(self, shop_domain: str, query: str) -> bool:
+        """
+        True if this worker should fetch the query itself: there is no shared
+        store, or no other worker holds a live lease on it.
+        """
+        return self.shared is None or await self.shared.run(self.shared.claim, *cache_key(shop_domain, query))
+
+    def release(self, shop_domain: str, query: str):
+        """
+        Gives up the lease on a query, after the write-through of its result.
+        """
+        if self.shared is not None:
+            self.shared.submit(self.shared.release, *cache_key(shop_domain, query))
+
+    async def wait_for_peer(self, shop_domain: str, query: str, timeout: float) -> Optional[CacheEntry]:
+        """
+        Waits up to `timeout` seconds for the worker holding the lease on a
+        query to store its result. None when the lease ends (the peer failed
+        or its result was not cacheable) or time runs out without one.
+        """
+        if self.shared is None:
+            return None
+        key = cache_key(shop_domain, query)
+        give_up = time.monotonic() + timeout
+        while time.monotonic() < give_up:
+            await asyncio.sleep(PEER_POLL_SECONDS)
+            entry = await self._get_shared(key)
+            if entry is not None:
+                self.hits += 1
+                self.shared_hits += 1
+                return entry
+            if not await self.shared.run(self.shared.leased, *key):
+                return None
+        return None
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "shared_hits": self.shared_hits,
+            "stale_hits": self.stale_hits,
+        }
+
+
+# Shared by every agent in the worker process.
+result_cache = ResultCache(max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+                           shared=shared_store)
@@ -0,0 +1,146 @@
+import json
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, Mapping
+
+from serialization import Payload
+from table import ColumnarTable
+
+# Mock/fallback tables served when Shopify cannot be queried (demo shops,
+# staging, degraded mode). Keyed by the intent ids declared in intents.py.
+_TABLES: Dict[str, Dict[str, Any]] = {
+    "forecast": {
+        "headers": ["Product", "Predicted Demand (Next Month)", "Confidence"],
+        "rows": [["Product X", 120, "85%"], ["Product Y", 45, "92%"], ["Product Z", 30, "78%"]]
+    },
+    "stock_risk": {
+        "headers": ["Product", "Current Stock", "Avg Daily Sales", "Days Until Empty"],
+        "rows": [["Fast-Selling Tee", 12, 4.0, 3], ["Limited Edition Mug", 5, 1.2, 4], ["Summer Hat", 2, 0.5, 4]]
+    },
+    "reorder": {
+        "headers": ["Product", "Current Stock", "Rec. Reorder Qty"],
+        "rows": [["Classic Jeans", 15, 50], ["White Sneakers", 8, 30], ["Black Belt", 18, 20]]
+    },
+    "customers": {
+        "headers": ["Customer Name", "Order Count", "Last Order Date"],
+        "rows": [["Alice Smith", 5, "2023-12-10"], ["Bob Jones", 3, "2023-12-05"], ["Charlie Day", 2, "2023-11-28"]]
+    },
+    "returns": {
+        "headers": ["Product", "Return Rate", "Total Returned"],
+        "rows": [["Wool Sweater", "15%", 12], ["Skinny Jeans", "8%", 8], ["Boots", "5%", 4]]
+    },
+    "geography": {
+        "headers": ["Country", "Total Sales", "Order Count"],
+        "rows": [["United States", "$12,500", 150], ["Canada", "$4,200", 45], ["United Kingdom", "$2,100", 20]]
+    },
+    "traffic": {
+        "headers": ["Source", "Visits", "Conversion Rate"],
+        "rows": [["Google", 1200, "2.5%"], ["Instagram", 850, "4.2%"], ["Email Newsletter", 400, "5.8%"]]
+    },
+    "social": {
+        "headers": ["Platform", "Shares", "Traffic Generated"],
+        "rows": [["Instagram", 1500, 850], ["Facebook", 450, 300], ["TikTok", 890, 1200]]
+    },
+    "email": {
+        "headers": ["Campaign", "Open Rate", "Click Rate"],
+        "rows": [["Winter Sale", "25%", "4.2%"], ["Welcome Series", "65%", "12.5%"], ["Weekly Digest", "18%", "1.1%"]]
+    },
+    "csat": {
+        "headers": ["Rating", "Count", "Recent Comment"],
+        "rows": [["5 Stars", 45, "Great quality!"], ["4 Stars", 12, "Good but slow ship"], ["1 Star", 2, "Wrong size sent"]]
+    },
+    "competitor": {
+        "headers": ["Compressor", "Price Match", "Market Share"],
+        "rows": [["Competitor A", "High ($120)", "30%"], ["Competitor B", "Low ($85)", "15%"], ["You", "Mid ($99)", "45%"]]
+    },
+    "abandoned_carts": {
+        "headers": ["Metric", "Rate", "Total"],
+        "rows": [["Cart Abandonment", "68%", 340], ["Checkout Completion", "32%", 160]]
+    },
+    "discounts": {
+        "headers": ["Discount Code", "Times Used", "Total Revenue Generated"],
+        "rows": [["SUMMER20", 45, "$3,200.00"], ["WELCOME10", 120, "$1,800.00"], ["FREESHIP", 30, "$450.00"]]
+    },
+    "fulfillment": {
+        "headers": ["Metric", "Average Time"],
+        "rows": [["Order to Ship", "1.2 Days"], ["Ship to Delivery", "3.5 Days"], ["Total Fulfillment", "4.7 Days"]]
+    },
+    "device": {
+        "headers": ["Device Type", "Orders", "Revenue Share"],
+        "rows": [["Mobile", 250, "65%"], ["Desktop", 120, "30%"], ["Tablet", 15, "5%"]]
+    },
+    "fallback": {
+        "headers": ["Store Metric", "Current Status", "Trend"],
+        "rows": [
+            ["Total Revenue (YTD)", "$45,200", "▲ 12%"],
+            ["Active Live Carts", "14", "▲ 2%"],
+            ["Pending Orders", "8", "-"],
+            ["Customer Satisfaction", "4.8/5.0", "-"]
+        ]
+    },
+    "sales": {
+        "headers": ["Date", "Total Sales"],
+        "rows": [["2023-11-20", "1500.00"], ["2023-11-21", "2300.50"], ["2023-11-22", "1800.00"]]
+    },
+    "inventory": {
+        "headers": ["Product Variant", "Quantity"],
+        "rows": [["T-Shirt (Blue/L)", 5], ["Jeans (32)", 2], ["Cap (Red)", 0]]
+    },
+    # Served for intents without a dedicated table
+    "default": {
+        "headers": ["Metric", "Value"],
+        "rows": [["Status", "System Online"], ["Data", "Available"]]
+    },
+}
+
+# Tables that are not a real answer to the question
+_LOW_CONFIDENCE = {"fallback", "default"}
+
+
+@dataclass(frozen=True)
+class Fixture:
+    """
+    A fallback response body, serialized once at import.
+
+    `raw` is the JSON encoding of `data` and can be written to the response
+    as-is (`payload` wraps it with its compressed form). `data` is a
+    read-only view of the same payload and `table` its columnar form for the
+    explain step.
+    """
+    data: Mapping[str, Any]
+    table: ColumnarTable
+    raw: bytes
+    payload: Payload
+    confidence: str
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _build(intent_id: str, table: Dict[str, Any]) -> Fixture:
+    raw = json.dumps({"data": {"table": table}}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    confidence = "low" if intent_id in _LOW_CONFIDENCE else "high"
+    return Fixture(
+        data=_freeze(json.loads(raw)),
+        table=ColumnarTable.from_rows(table["headers"], table["rows"]),
+        raw=raw,
+        payload=Payload(raw),
+        confidence=confidence,
+    )
+
+
+FIXTURES: Mapping[str, Fixture] = MappingProxyType(
+    {intent_id: _build(intent_id, table) for intent_id, table in _TABLES.items()}
+)
+
+
+def get_fixture(intent_id: str) -> Fixture:
+    """
+    O(1) lookup of the fallback table for an intent id.
+    """
+    return FIXTURES.get(intent_id) or FIXTURES["default"]
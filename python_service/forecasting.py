@@ -0,0 +1,245 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+# Days of daily history a model is fitted on, and how many new days may be
+# folded in incrementally before the smoothing parameters are re-selected.
+FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "120"))
+FORECAST_REFIT_DAYS = int(os.getenv("FORECAST_REFIT_DAYS", "7"))
+# Catalogs with at least this many products are fitted across a process pool
+FORECAST_PARALLEL_MIN_PRODUCTS = int(os.getenv("FORECAST_PARALLEL_MIN_PRODUCTS", "20000"))
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", str(min(os.cpu_count() or 1, 8))))
+
+SEASON_DAYS = 7
+TREND_DAMPING = 0.9
+
+# Candidate (alpha, beta, gamma) smoothing parameters; every product is run
+# with all of them at once and keeps the one with the lowest one-step error.
+PARAMETER_GRID = np.array(
+    [(a, b, g) for a in (0.05, 0.2, 0.5) for b in (0.0, 0.1) for g in (0.05, 0.3)], dtype=np.float64
+)
+
+# Horizon units accepted by forecast(col, "<n><unit>")
+HORIZON_UNITS = {"d": 1, "w": 7, "m": 30}
+
+
+@dataclass
+class SmoothingState:
+    """
+    Damped-trend additive Holt-Winters state for a batch of series. Arrays
+    have the products on the last axis (season: products x SEASON_DAYS).
+    `abs_error` and `volume` accumulate one-step errors and actuals for the
+    confidence score.
+    """
+    alpha: np.ndarray
+    beta: np.ndarray
+    gamma: np.ndarray
+    level: np.ndarray
+    trend: np.ndarray
+    season: np.ndarray
+    abs_error: np.ndarray
+    volume: np.ndarray
+    days: int  # days observed so far; the next day is season slot days % SEASON_DAYS
+
+
+_ARRAYS = ("alpha", "beta", "gamma", "level", "trend", "season", "abs_error", "volume")
+
+
+def _smooth(history: np.ndarray, state: SmoothingState) -> SmoothingState:
+    """
+    Runs the recursions over `history` (... x products x days) for every
+    series at once; the loop is over days only. Updates `state` in place.
+    """
+    alpha, beta, gamma = state.alpha, state.beta, state.gamma
+    level, trend, season = state.level, state.trend, state.season
+    for day in range(history.shape[-1]):
+        slot = (state.days + day) % SEASON_DAYS
+        observed = history[..., day]
+        seasonal = season[..., slot]
+        damped = TREND_DAMPING * trend
+        error = observed - (level + damped + seasonal)
+        state.abs_error += np.abs(error)
+        state.volume += observed
+        new_level = alpha * (observed - seasonal) + (1 - alpha) * (level + damped)
+        trend = beta * (new_level - level) + (1 - beta) * damped
+        season[..., slot] = gamma * (observed - new_level) + (1 - gamma) * seasonal
+        level = new_level
+    state.level, state.trend = level, trend
+    state.days += history.shape[-1]
+    return state
+
+
+def fit(history: np.ndarray) -> SmoothingState:
+    """
+    Fits every product (rows of `history`, products x days) against the whole
+    parameter grid in one pass and keeps each product's best parameters.
+    """
+    history = np.asarray(history, dtype=np.float64)
+    products, days = history.shape
+    grid = len(PARAMETER_GRID)
+    if days < 2 * SEASON_DAYS:
+        # Too short for seasonality: a flat forecast at the recent mean
+        mean = history.mean(axis=1) if days else np.zeros(products)
+        zeros = np.zeros(products)
+        params = np.broadcast_to(PARAMETER_GRID[0], (products, 3))
+        return SmoothingState(params[:, 0].copy(), params[:, 1].copy(), params[:, 2].copy(), mean, zeros,
+                              np.zeros((products, SEASON_DAYS)), np.abs(history - mean[:, None]).sum(axis=1),
+                              history.sum(axis=1), days)
+
+    # Initial components from the first two weeks
+    first = history[:, :SEASON_DAYS].mean(axis=1)
+    second = history[:, SEASON_DAYS:2 * SEASON_DAYS].mean(axis=1)
+    season = history[:, :SEASON_DAYS] - first[:, None]
+
+    # Grid on the leading axis: (grid x products) for every state array
+    state = SmoothingState(
+        alpha=PARAMETER_GRID[:, 0, None], beta=PARAMETER_GRID[:, 1, None], gamma=PARAMETER_GRID[:, 2, None],
+        level=np.broadcast_to(first, (grid, products)).copy(),
+        trend=np.broadcast_to((second - first) / SEASON_DAYS, (grid, products)).copy(),
+        season=np.broadcast_to(season, (grid, products, SEASON_DAYS)).copy(),
+        abs_error=np.zeros((grid, products)), volume=np.zeros((grid, products)), days=SEASON_DAYS,
+    )
+    _smooth(history[:, SEASON_DAYS:], state)
+
+    best = np.argmin(state.abs_error, axis=0)
+    columns = np.arange(products)
+    return SmoothingState(
+        alpha=PARAMETER_GRID[best, 0], beta=PARAMETER_GRID[best, 1], gamma=PARAMETER_GRID[best, 2],
+        level=state.level[best, columns], trend=state.trend[best, columns],
+        season=state.season[best, columns], abs_error=state.abs_error[best, columns],
+        volume=state.volume[best, columns], days=state.days,
+    )
+
+
+def _fit_parallel(history: np.ndarray) -> SmoothingState:
+    chunks = np.array_split(np.arange(len(history)), FORECAST_WORKERS)
+    parts = list(_pool().map(fit, [history[rows] for rows in chunks if len(rows)]))
+    return SmoothingState(*(np.concatenate([getattr(p, name) for p in parts]) for name in _ARRAYS),
+                          days=parts[0].days)
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned, not forked: the service process runs threads (logging, to_thread)
+            _executor = ProcessPoolExecutor(FORECAST_WORKERS, mp_context=get_context("spawn"))
+        return _executor
+
+
+def shutdown():
+    """
+    Stops the fitting processes, if any were started (app shutdown).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+
+
+def forecast(state: SmoothingState, horizon: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Total predicted demand over the next `horizon` days per product, and a
+    confidence score in [0, 1] (1 - in-sample mean absolute error relative
+    to mean demand).
+    """
+    steps = np.arange(1, horizon + 1)
+    # Sum over h of (phi + ... + phi^h): the damped trend's total contribution
+    trend_weight = np.cumsum(TREND_DAMPING ** steps).sum()
+    slot_counts = np.bincount((state.days + steps - 1) % SEASON_DAYS, minlength=SEASON_DAYS)
+    total = horizon * state.level + trend_weight * state.trend + state.season @ slot_counts
+    with np.errstate(divide="ignore", invalid="ignore"):
+        confidence = np.where(state.volume > 0, 1 - state.abs_error / state.volume, 0.0)
+    return np.maximum(total, 0.0), np.clip(confidence, 0.0, 1.0)
+
+
+def parse_horizon(spec: str) -> int:
+    """
+    Days in a ShopifyQL forecast horizon such as "1m", "2w" or "30d".
+    """
+    spec = spec.strip().lower()
+    if len(spec) < 2 or spec[-1] not in HORIZON_UNITS or not spec[:-1].isdigit():
+        raise ValueError(f"Unsupported forecast horizon {spec!r}")
+    return int(spec[:-1]) * HORIZON_UNITS[spec[-1]]
+
+
+@dataclass
+class ShopModel:
+    products: np.ndarray
+    state: SmoothingState
+    last_day: int  # last day (days since epoch) folded into the state
+    fitted_day: int  # last day of the history the parameters were selected on
+
+
+class Forecaster:
+    """
+    Fitted models per (shop, table, product column, quantity column). A model
+    is fitted once; later requests fold in only the days added since (with
+    the same parameters) until FORECAST_REFIT_DAYS have passed or the product
+    catalog changes, which trigger a full refit.
+
+    Each key has its own lock, so one shop's full refit never holds up
+    forecasts for the others; concurrent requests for the same key wait
+    for its fit instead of repeating it.
+    """
+
+    def __init__(self):
+        self._models: Dict[Tuple[str, ...], ShopModel] = {}
+        self._locks: Dict[Tuple[str, ...], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.fits = 0
+        self.updates = 0
+
+    def model(self, key: Tuple[str, ...], products: np.ndarray, last_day: int,
+              history: Callable[[int, int], np.ndarray]) -> ShopModel:
+        """
+        `history(first_day, last_day)` returns the products x days matrix of
+        daily quantities for that inclusive day range.
+        """
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            model = self._models.get(key)
+            if model is not None and len(model.products) == len(products) and \
+                    np.array_equal(model.products, products):
+                if last_day <= model.last_day:
+                    return model
+                if last_day - model.fitted_day < FORECAST_REFIT_DAYS:
+                    _smooth(history(model.last_day + 1, last_day), model.state)
+                    model.last_day = last_day
+                    self.updates += 1
+                    return model
+
+            matrix = history(last_day - FORECAST_HISTORY_DAYS + 1, last_day)
+            parallel = len(products) >= FORECAST_PARALLEL_MIN_PRODUCTS and FORECAST_WORKERS > 1
+            state = _fit_parallel(matrix) if parallel else fit(matrix)
+            model = self._models[key] = ShopModel(products, state, last_day, last_day)
+            self.fits += 1
+            return model
+
+
+def daily_matrix(codes: np.ndarray, days: np.ndarray, quantities: np.ndarray,
+                 n_products: int, first_day: int, last_day: int) -> np.ndarray:
+    """
+    Products x days matrix of summed quantities from row-level columns
+    (product codes, day numbers), built with a single bincount.
+    """
+    width = last_day - first_day + 1
+    inside = (days >= first_day) & (days <= last_day)
+    index = codes[inside].astype(np.int64) * width + (days[inside] - first_day)
+    weights = quantities[inside].astype(np.float64)
+    return np.bincount(index, weights=weights, minlength=n_products * width).reshape(n_products, width)
+
+
+# Shared by every agent in the worker process.
+forecaster = Forecaster()
@@ -0,0 +1,31 @@
+"""
+Production serving: several uvicorn worker processes under gunicorn.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The app is imported once in the master (preload_app) and forked, so
+fixtures, compiled intent patterns and other read-only state are shared
+copy-on-write. Workers share query results, fetch leases and the webhook
+event log through the SQLite file at SHARED_STORE_PATH (see shared_store.py).
+"""
+import multiprocessing
+import os
+import tempfile
+
+# Must be set before the app is preloaded; the store is opened at import
+os.environ.setdefault("SHARED_STORE_PATH", os.path.join(tempfile.gettempdir(), "shopify-analytics-shared.db"))
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Streaming responses and slow shops can legitimately take a while
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+
+
+def post_fork(server, worker):
+    # The master's log listener thread did not survive the fork
+    import logs
+    logs.restart()
@@ -0,0 +1,272 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+
+@dataclass(frozen=True)
+class Intent:
+    """
+    One row of the declarative intent table.
+
+    `keywords` are matched as plain substrings of the lowercased question (the
+    same semantics as the old `"x" in q` checks). `params` holds the default
+    template parameters and `param_keywords` overrides them when a given
+    substring also appears in the question. `ttl` is how long, in seconds, a
+    result for this intent may be served from the result cache.
+    """
+    id: str
+    keywords: Tuple[str, ...]
+    template: str
+    ttl: float = 300.0
+    params: Dict[str, str] = field(default_factory=dict)
+    param_keywords: Dict[str, Dict[str, str]] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class IntentMatch:
+    intent: Intent
+    params: Dict[str, str]
+    shopify_ql: str
+
+    @property
+    def id(self) -> str:
+        return self.intent.id
+
+
+FALLBACK = Intent(id="fallback", keywords=(), template="FALLBACK_INTENT")
+
+# Ordered by precedence: when a question matches several intents, the one
+# listed first wins.
+INTENTS: List[Intent] = [
+    Intent(
+        id="forecast",
+        keywords=("need", "forecast", "predict"),
+        template='FROM sales SHOW forecast(net_quantity, "1m") AS predicted_demand BY product_title',
+        ttl=3600,
+    ),
+    Intent(
+        id="stock_risk",
+        keywords=("out of stock", "run out", "empty"),
+        template='FROM inventory SHOW quantity, avg_daily_sales, (quantity/avg_daily_sales) as days_left BY product_title WHERE days_left < 7 ORDER BY days_left ASC #out_of_stock_risk',
+        ttl=60,
+    ),
+    Intent(
+        id="returns",
+        keywords=("return", "refund"),
+        template='FROM sales SHOW sum(returns) AS total_returned, (sum(returns)/sum(net_quantity)) AS return_rate BY product_title ORDER BY return_rate DESC #returns',
+        ttl=1800,
+    ),
+    Intent(
+        id="geography",
+        keywords=("location", "country", "where"),
+        template='FROM orders SHOW sum(total_price) AS total_sales, count() AS order_count BY billing_address_country ORDER BY total_sales DESC',
+        ttl=900,
+    ),
+    Intent(
+        id="traffic",
+        keywords=("traffic", "referrer", "source"),
+        template='FROM visits SHOW count() AS visits, conversion_rate BY referrer_source ORDER BY visits DESC',
+        ttl=300,
+    ),
+    Intent(
+        id="social",
+        keywords=("social", "facebook", "instagram", "tiktok"),
+        template='FROM visits SHOW count() AS visits BY referrer_source WHERE type = "social" ORDER BY visits DESC #social',
+        ttl=300,
+    ),
+    Intent(
+        id="email",
+        keywords=("email", "newsletter", "open rate"),
+        template='FROM marketing_campaigns SHOW open_rate, click_rate BY campaign_name ORDER BY open_rate DESC #email',
+        ttl=900,
+    ),
+    Intent(
+        id="csat",
+        keywords=("review", "satisfaction", "rating", "csat"),
+        template='FROM reviews SHOW count() AS total_reviews, avg(rating) as average_rating BY rating_value #csat',
+        ttl=900,
+    ),
+    Intent(
+        id="competitor",
+        keywords=("competitor", "market", "other store"),
+        template='FROM market_intel SHOW price_index, market_share BY competitor_name #competitor',
+        ttl=3600,
+    ),
+    Intent(
+        id="abandoned_carts",
+        keywords=("abandon", "cart", "checkout"),
+        template='FROM checkouts SHOW abandonment_rate, count() AS total_carts BY date SINCE -30d UNTIL today',
+        ttl=300,
+    ),
+    Intent(
+        id="discounts",
+        keywords=("discount", "code", "promotion"),
+        template='FROM orders SHOW count() AS usages, sum(total_price) AS revenue_generated BY discount_code SINCE -30d UNTIL today ORDER BY revenue_generated DESC',
+        ttl=600,
+    ),
+    Intent(
+        id="fulfillment",
+        keywords=("shipping", "time", "fulfill", "deliver"),
+        template='FROM fulfillment SHOW avg(fulfillment_time) AS avg_ship_time BY date SINCE -90d UNTIL today',
+        ttl=3600,
+    ),
+    Intent(
+        id="device",
+        keywords=("mobile", "desktop", "device", "platform"),
+        template='FROM visits SHOW count() AS visits, sum(total_sales) AS revenue BY device_type SINCE -30d UNTIL today',
+        ttl=600,
+    ),
+    Intent(
+        id="reorder",
+        keywords=("reorder", "replenish", "buy more"),
+        template='FROM inventory SHOW quantity, recommended_order_qty BY product_title WHERE quantity < reorder_point',
+        ttl=120,
+    ),
+    Intent(
+        id="top_selling",
+        keywords=("top", "best"),
+        template='FROM sales SHOW sum(net_quantity) AS total_sold, sum(total_sales) AS revenue BY product_title ORDER BY total_sold DESC LIMIT {limit} #top_selling',
+        ttl=300,
+        params={"limit": "5"},
+        param_keywords={"10": {"limit": "10"}},
+    ),
+    Intent(
+        id="customers",
+        keywords=("customer", "repeat", "who bought"),
+        template='FROM customers SHOW count() AS orders_count, max(timestamp) as last_order BY customer_name WHERE orders_count > 1 SINCE -90d UNTIL today ORDER BY orders_count DESC',
+        ttl=900,
+    ),
+    Intent(
+        id="inventory",
+        keywords=("inventory", "stock", "count"),
+        template='FROM inventory SHOW sum(quantity) BY product_variant_title SINCE -1d UNTIL today',
+        ttl=60,
+    ),
+    Intent(
+        id="sales",
+        keywords=("sales", "sold", "revenue"),
+        template='FROM orders SHOW sum(total_price) OVER day(timestamp) AS daily_sales SINCE -30d UNTIL today ORDER BY day ASC',
+        ttl=300,
+    ),
+]
+
+
+# Conjunctions that separate the parts of a compound question
+# ("show sales and inventory, plus top products")
+_CLAUSE_BREAK = re.compile(r"\s*(?:,|;|&|\band\b|\bplus\b|\bas well as\b)\s*", re.IGNORECASE)
+
+
+class _TrieNode:
+    __slots__ = ("children", "group")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.group = None
+
+
+class IntentMatcher:
+    """
+    Compiles an intent table into a single regex so a question is classified
+    in one left-to-right scan.
+
+    All keywords are merged into a prefix trie and emitted as nested
+    alternations, so at any position the regex engine only follows the branch
+    for the current character; the cost per character is bounded by the
+    alphabet rather than by the number of keywords. Every trie node that ends a
+    keyword carries an empty named group. The deepest group reached at a
+    position (`lastgroup`) is looked up in a table that already includes all
+    shorter keywords ending on the same path, so overlapping substrings
+    ("count" inside "country") are all reported.
+    """
+
+    def __init__(self, intents: List[Intent], fallback: Intent = FALLBACK):
+        self.intents = list(intents)
+        self.fallback = fallback
+
+        # keyword -> (intent indexes it votes for, param overrides it carries)
+        payloads: Dict[str, Tuple[set, list]] = {}
+        for index, intent in enumerate(self.intents):
+            for keyword in intent.keywords:
+                payloads.setdefault(keyword, (set(), []))[0].add(index)
+            for keyword, overrides in intent.param_keywords.items():
+                payloads.setdefault(keyword, (set(), []))[1].append((index, overrides))
+
+        root = _TrieNode()
+        self._hits: Dict[str, Tuple[frozenset, tuple]] = {}
+        for n, keyword in enumerate(sorted(payloads)):
+            node = root
+            for char in keyword:
+                node = node.children.setdefault(char, _TrieNode())
+            node.group = f"k{n}"
+
+        # Fold every keyword's payload into all longer keywords that extend it.
+        def collect(node, prefix, inherited_intents, inherited_params):
+            intents_here, params_here = inherited_intents, inherited_params
+            if node.group is not None:
+                own_intents, own_params = payloads[prefix]
+                intents_here = inherited_intents | own_intents
+                params_here = inherited_params + tuple(own_params)
+                self._hits[node.group] = (frozenset(intents_here), params_here)
+            for char, child in node.children.items():
+                collect(child, prefix + char, intents_here, params_here)
+
+        collect(root, "", frozenset(), ())
+        self.pattern = re.compile(f"(?=(?:{self._emit(root)}))") if root.children else None
+
+    def _emit(self, node: _TrieNode) -> str:
+        alternatives = [re.escape(char) + self._emit(child)
+                        for char, child in sorted(node.children.items())]
+        body = ""
+        if alternatives:
+            body = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+        if node.group is None:
+            return body
+        marker = f"(?P<{node.group}>)"
+        return marker + (f"(?:{body})?" if body else "")
+
+    def classify(self, question: str) -> IntentMatch:
+        """
+        Returns the highest-precedence intent, its parameters and the rendered
+        ShopifyQL in a single pass over the question.
+        """
+        matched = set()
+        overrides = []
+        if self.pattern is not None:
+            hits = self._hits
+            for m in self.pattern.finditer(question.lower()):
+                intent_indexes, params = hits[m.lastgroup]
+                matched.update(intent_indexes)
+                if params:
+                    overrides.extend(params)
+
+        if not matched:
+            return IntentMatch(self.fallback, {}, self.fallback.template)
+
+        best = min(matched)
+        intent = self.intents[best]
+        params = dict(intent.params)
+        for index, values in overrides:
+            if index == best:
+                params.update(values)
+        return IntentMatch(intent, params, intent.template.format(**params) if params else intent.template)
+
+    def classify_all(self, question: str) -> List[IntentMatch]:
+        """
+        Every intent asked for in a compound question ("show sales and
+        inventory and top products"): each clause between conjunctions is
+        classified on its own, keeping one match per distinct query in the
+        order asked. Questions with fewer than two such intents get the single
+        match classify() gives for the whole question.
+        """
+        matches: Dict[str, IntentMatch] = {}
+        for clause in _CLAUSE_BREAK.split(question):
+            match = self.classify(clause)
+            if match.intent is not self.fallback:
+                matches.setdefault(match.shopify_ql, match)
+        if len(matches) < 2:
+            return [self.classify(question)]
+        return list(matches.values())
+
+
+# Compiled once at import and shared by every agent instance.
+matcher = IntentMatcher(INTENTS)
@@ -0,0 +1,564 @@
+import datetime
+import json
+import os
+import shutil
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from forecasting import Forecaster, daily_matrix, forecast, forecaster, parse_horizon
+from shopify_client import normalize_domain
+from shopifyql import Agg, BinOp, Col, Condition, Expr, Forecast, Lit, Query, UnsupportedQuery, parse
+from table import ColumnarTable
+
+# Execution backend for ShopifyQL: "graphql" always asks Shopify; "local"
+# answers from the shop's columnar snapshot when it has the queried table and
+# falls back to GraphQL otherwise.
+SHOPIFY_QL_BACKEND = os.getenv("SHOPIFY_QL_BACKEND", "graphql")
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots"))
+# Versions of each snapshot table kept on disk (the current one and older ones still being read)
+SNAPSHOT_KEEP_VERSIONS = int(os.getenv("SNAPSHOT_KEEP_VERSIONS", "3"))
+
+NUMERIC = "numeric"
+STRING = "string"
+DATETIME = "datetime"
+
+
+class SnapshotTable:
+    """
+    One table of a shop snapshot: a directory with schema.json and one .npy
+    file per column, opened memory-mapped. String columns are dictionary
+    encoded (`<col>.codes.npy` + `<col>.dict.json`) so filters and group-bys
+    work on integer codes.
+    """
+
+    def __init__(self, path: str):
+        # Pinned to the version directory, so a later write never changes
+        # which files this table reads
+        self.path = path = os.path.realpath(path)
+        with open(os.path.join(path, "schema.json")) as f:
+            self.schema = json.load(f)
+        self.n_rows: int = self.schema["rows"]
+        self.time_column: Optional[str] = self.schema.get("time_column")
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._dictionaries: Dict[str, np.ndarray] = {}
+        self._blanks: Dict[str, np.ndarray] = {}
+
+    def has(self, name: str) -> bool:
+        return name in self.schema["columns"]
+
+    def kind(self, name: str) -> str:
+        try:
+            return self.schema["columns"][name]["kind"]
+        except KeyError:
+            raise UnsupportedQuery(f"Column '{name}' is not in the local snapshot")
+
+    def default_agg(self, name: str) -> str:
+        return self.schema["columns"][name].get("agg", "sum")
+
+    def values(self, name: str) -> np.ndarray:
+        """
+        Numeric values, datetime64[s] values or dictionary codes.
+        """
+        array = self._arrays.get(name)
+        if array is None:
+            suffix = ".codes.npy" if self.kind(name) == STRING else ".npy"
+            array = np.load(os.path.join(self.path, name + suffix), mmap_mode="r")
+            self._arrays[name] = array
+        return array
+
+    def dictionary(self, name: str) -> np.ndarray:
+        values = self._dictionaries.get(name)
+        if values is None:
+            with open(os.path.join(self.path, name + ".dict.json")) as f:
+                entries = json.load(f)
+            values = np.empty(len(entries), dtype=object)
+            values[:] = entries
+            self._dictionaries[name] = values
+        return values
+
+    def blank_codes(self, name: str) -> np.ndarray:
+        """
+        Codes of a string column that stand for no value ("" or null).
+        """
+        codes = self._blanks.get(name)
+        if codes is None:
+            codes = np.flatnonzero([value is None or value == "" for value in self.dictionary(name)])
+            self._blanks[name] = codes
+        return codes
+
+
+class SnapshotStore:
+    """
+    Per-shop columnar snapshots under SNAPSHOT_DIR/<shop domain>/<table>/.
+
+    Every write goes to a new hidden version directory
+    (<shop>/.<table>.v<ns>/) and <table> is a symlink swapped to it with
+    os.replace, so files readers have memory-mapped are never rewritten or
+    truncated. The last SNAPSHOT_KEEP_VERSIONS versions are kept for readers
+    still holding an older one.
+    """
+
+    def __init__(self, root: str = SNAPSHOT_DIR):
+        self.root = root
+        self._tables: Dict[Tuple[str, str], Tuple[Tuple[str, float], SnapshotTable]] = {}
+        self._lock = threading.Lock()
+
+    def table_path(self, shop_domain: str, table: str) -> str:
+        return os.path.join(self.root, normalize_domain(shop_domain), table)
+
+    def has_table(self, shop_domain: str, table: str) -> bool:
+        return os.path.exists(os.path.join(self.table_path(shop_domain, table), "schema.json"))
+
+    def version(self, shop_domain: str, table: str) -> Optional[Tuple[str, float]]:
+        """
+        Identifies the current snapshot of a table and changes on every
+        write; None if there is none.
+        """
+        real = os.path.realpath(self.table_path(shop_domain, table))
+        try:
+            return real, os.stat(os.path.join(real, "schema.json")).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def open(self, shop_domain: str, table: str) -> SnapshotTable:
+        version = self.version(shop_domain, table)
+        if version is None:
+            raise UnsupportedQuery(f"No local snapshot of '{table}' for {shop_domain}")
+        key = (normalize_domain(shop_domain), table)
+        with self._lock:
+            cached = self._tables.get(key)
+            # Reopen when the snapshot was rewritten
+            if cached is None or cached[0] != version:
+                cached = (version, SnapshotTable(version[0]))
+                self._tables[key] = cached
+        return cached[1]
+
+    def write_table(self, shop_domain: str, table: str, columns: Dict[str, Any],
+                    aggs: Optional[Dict[str, str]] = None, time_column: Optional[str] = None):
+        """
+        Writes (or replaces) a snapshot table from whole columns. Strings are
+        dictionary encoded, datetimes stored as datetime64[s].
+        """
+        path = self.table_path(shop_domain, table)
+        parent = os.path.dirname(path)
+        version = os.path.join(parent, f".{table}.v{time.time_ns()}")
+        os.makedirs(version)
+        aggs = aggs or {}
+        schema: Dict[str, Any] = {"rows": None, "columns": {}, "time_column": time_column}
+        for name, values in columns.items():
+            array = np.asarray(values)
+            if array.dtype.kind in "iufb":
+                kind = NUMERIC
+                np.save(os.path.join(version, name + ".npy"), array)
+            elif array.dtype.kind == "M":
+                kind = DATETIME
+                np.save(os.path.join(version, name + ".npy"), array.astype("datetime64[s]"))
+            else:
+                kind = STRING
+                dictionary, codes = np.unique(array.astype(str), return_inverse=True)
+                np.save(os.path.join(version, name + ".codes.npy"), codes.astype(np.int32))
+                with open(os.path.join(version, name + ".dict.json"), "w") as f:
+                    json.dump(dictionary.tolist(), f)
+            schema["columns"][name] = {"kind": kind, "agg": aggs.get(name, "sum")}
+            schema["rows"] = len(array)
+        with open(os.path.join(version, "schema.json"), "w") as f:
+            json.dump(schema, f)
+        self._publish(path, version)
+
+    def _publish(self, path: str, version: str):
+        parent, table = os.path.split(path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            # A table written in place before versioning: keep it as the oldest version
+            os.replace(path, os.path.join(parent, f".{table}.v0"))
+        link = f"{path}.{os.getpid()}.tmp"
+        os.symlink(os.path.basename(version), link)
+        os.replace(link, path)
+
+        prefix = f".{table}.v"
+        versions = sorted((name for name in os.listdir(parent) if name.startswith(prefix)),
+                          key=lambda name: int(name[len(prefix):]))
+        for name in versions[:-SNAPSHOT_KEEP_VERSIONS]:
+            shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+
+
+class _Frame:
+    """
+    Execution state for one query: the filtered row selection and, once
+    grouped, the group index of every selected row.
+    """
+
+    def __init__(self, table: SnapshotTable, rows: Optional[np.ndarray]):
+        self.table = table
+        self.rows = rows
+        self.inverse: Optional[np.ndarray] = None
+        self.n_groups = 0
+        self.dims: Dict[str, Tuple[np.ndarray, str]] = {}
+
+    def column(self, name: str) -> np.ndarray:
+        values = self.table.values(name)
+        return values[self.rows] if self.rows is not None else np.asarray(values)
+
+
+def _day_numbers(values: np.ndarray) -> np.ndarray:
+    return values.astype("datetime64[D]").astype(np.int64)
+
+
+def _format_days(days: np.ndarray) -> np.ndarray:
+    return np.datetime_as_string(days.astype("datetime64[D]"), unit="D").astype(object)
+
+
+def _format_times(seconds: np.ndarray) -> np.ndarray:
+    return np.datetime_as_string(seconds.astype("datetime64[s]"), unit="s").astype(object)
+
+
+def _group_reduce(ufunc, values: np.ndarray, inverse: np.ndarray, n_groups: int) -> np.ndarray:
+    order = np.argsort(inverse, kind="stable")
+    sorted_groups = inverse[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    out = np.zeros(n_groups, dtype=values.dtype)
+    out[sorted_groups[starts]] = ufunc.reduceat(values[order], starts)
+    return out
+
+
+class LocalEngine:
+    """
+    Executes the ShopifyQL subset produced by the intent table against a
+    shop's columnar snapshot using vectorized filters, group-bys (np.unique +
+    bincount/reduceat) and top-k selection (argpartition). forecast() fields
+    are answered by the batch forecaster in forecasting.py.
+    """
+
+    def __init__(self, store: SnapshotStore, backend: str = SHOPIFY_QL_BACKEND,
+                 forecasts: Forecaster = forecaster):
+        self.store = store
+        self.backend = backend
+        self.forecasts = forecasts
+        self._parse = lru_cache(maxsize=1024)(parse)
+
+    def can_execute(self, shop_domain: str, query: str) -> bool:
+        if self.backend != "local":
+            return False
+        try:
+            source = self._parse(query).source
+        except UnsupportedQuery:
+            return False
+        return self.store.has_table(shop_domain, source)
+
+    def execute(self, shop_domain: str, query: str) -> ColumnarTable:
+        parsed = self._parse(query)
+        table = self.store.open(shop_domain, parsed.source)
+        if any(isinstance(f.expr, Forecast) for f in parsed.fields):
+            return self._execute_forecast(shop_domain, parsed, table)
+
+        # 1. Row filters: time range plus WHERE conditions on raw columns
+        mask = self._time_mask(parsed, table)
+        post_conditions = []
+        for condition in parsed.where:
+            if self._is_row_condition(condition, table, parsed):
+                cond_mask = self._row_condition(condition, table)
+                mask = cond_mask if mask is None else mask & cond_mask
+            else:
+                post_conditions.append(condition)
+        # Rows without a value for a grouped string column (orders without a
+        # discount code) belong to no group
+        for dim in parsed.group_by:
+            if table.kind(dim) == STRING and len(table.blank_codes(dim)):
+                present = ~np.isin(table.values(dim), table.blank_codes(dim))
+                mask = present if mask is None else mask & present
+        frame = _Frame(table, np.flatnonzero(mask) if mask is not None else None)
+
+        # 2. Grouping
+        dims = list(parsed.group_by)
+        if parsed.over is not None:
+            dims.append(parsed.over[0])
+        has_agg = any(self._has_agg(f.expr) for f in parsed.fields)
+        if dims or has_agg:
+            self._group(frame, parsed, dims)
+
+        # 3. Projection
+        names: List[str] = []
+        columns: Dict[str, np.ndarray] = {}
+        for dim in dims:
+            values, kind = frame.dims[dim]
+            names.append(dim)
+            columns[dim] = self._output(values, kind)
+        for f in parsed.fields:
+            values, kind = self._eval(f.expr, frame)
+            names.append(f.alias)
+            columns[f.alias] = self._output(values, kind)
+
+        length = len(next(iter(columns.values()))) if columns else 0
+        selection = np.arange(length)
+
+        # 4. Filters on aggregates / aliases (HAVING semantics)
+        for condition in post_conditions:
+            left = self._eval_output(condition.left, columns)
+            right = self._eval_output(condition.right, columns)
+            selection = selection[self._compare(left, condition.op, right)[selection]]
+
+        # 5. ORDER BY + LIMIT with partial sort for top-k
+        if parsed.order_by is not None:
+            key_name, descending = parsed.order_by
+            if key_name not in columns:
+                raise UnsupportedQuery(f"Cannot order by '{key_name}'")
+            keys = columns[key_name][selection]
+            if keys.dtype == object:
+                keys = keys.astype(str)
+            selection = self._top(selection, keys, descending, parsed.limit)
+        elif parsed.limit is not None:
+            selection = selection[:parsed.limit]
+
+        return ColumnarTable.from_arrays(names, [columns[n][selection] for n in names])
+
+    def _execute_forecast(self, shop_domain: str, parsed: Query, table: SnapshotTable) -> ColumnarTable:
+        """
+        FROM t SHOW forecast(qty, "1m") [AS a] BY product [ORDER BY ..] [LIMIT n]:
+        fits (or incrementally updates) one smoothing model per product over
+        the daily history and returns predicted demand plus a confidence.
+        """
+        if len(parsed.fields) != 1 or len(parsed.group_by) != 1 or parsed.where or parsed.over:
+            raise UnsupportedQuery("forecast() is supported as the only field with one BY column")
+        field = parsed.fields[0]
+        dim = parsed.group_by[0]
+        if not isinstance(field.expr.arg, Col) or table.kind(field.expr.arg.name) != NUMERIC:
+            raise UnsupportedQuery("forecast() takes a numeric column locally")
+        if table.kind(dim) != STRING or table.time_column is None:
+            raise UnsupportedQuery("forecast() needs a text BY column and a time column")
+        try:
+            horizon = parse_horizon(field.expr.horizon)
+        except ValueError as e:
+            raise UnsupportedQuery(str(e))
+
+        codes = table.values(dim)
+        days = _day_numbers(table.values(table.time_column))
+        quantities = table.values(field.expr.arg.name)
+        products = table.dictionary(dim)
+        # The last day of the snapshot is usually partial; forecast from complete days
+        last_day = int(days.max()) - 1 if len(days) else 0
+
+        def history(first_day: int, last: int) -> np.ndarray:
+            return daily_matrix(codes, days, quantities, len(products), first_day, last)
+
+        key = (normalize_domain(shop_domain), parsed.source, dim, field.expr.arg.name)
+        model = self.forecasts.model(key, products, last_day, history)
+        predicted, confidence = forecast(model.state, horizon)
+
+        columns = {dim: products, field.alias: np.rint(predicted).astype(np.int64), "confidence": confidence}
+        order_name, descending = parsed.order_by or (field.alias, True)
+        if order_name not in columns:
+            raise UnsupportedQuery(f"Cannot order by '{order_name}'")
+        keys = columns[order_name]
+        selection = self._top(np.arange(len(products)), keys.astype(str) if keys.dtype == object else keys,
+                              descending, parsed.limit)
+        percent = np.char.add(np.rint(confidence[selection] * 100).astype(np.int64).astype(str), "%")
+        return ColumnarTable.from_arrays(
+            [dim, field.alias, "confidence"],
+            [products[selection], columns[field.alias][selection], percent.astype(object)],
+        )
+
+    # -- planning helpers -------------------------------------------------
+
+    @staticmethod
+    def _time_mask(query: Query, table: SnapshotTable) -> Optional[np.ndarray]:
+        if table.time_column is None or (query.since_days is None and not query.until_today):
+            return None
+        times = table.values(table.time_column)
+        today = np.datetime64(datetime.datetime.now(datetime.timezone.utc).date(), "D")
+        mask = np.ones(len(times), dtype=bool)
+        if query.since_days is not None:
+            mask &= times >= (today - np.timedelta64(query.since_days, "D")).astype("datetime64[s]")
+        if query.until_today:
+            mask &= times < (today + np.timedelta64(1, "D")).astype("datetime64[s]")
+        return mask
+
+    def _has_agg(self, expr: Expr) -> bool:
+        if isinstance(expr, Agg):
+            return True
+        if isinstance(expr, BinOp):
+            return self._has_agg(expr.left) or self._has_agg(expr.right)
+        return False
+
+    def _is_row_condition(self, condition: Condition, table: SnapshotTable, query: Query) -> bool:
+        # Computed aliases (days_left) filter after aggregation; a bare column keeps its own name
+        aliases = {f.alias for f in query.fields if f.expr != Col(f.alias)}
+
+        def raw(expr: Expr) -> bool:
+            if isinstance(expr, Col):
+                return table.has(expr.name) and expr.name not in aliases
+            if isinstance(expr, BinOp):
+                return raw(expr.left) and raw(expr.right)
+            return isinstance(expr, Lit)
+
+        return raw(condition.left) and raw(condition.right)
+
+    def _row_condition(self, condition: Condition, table: SnapshotTable) -> np.ndarray:
+        left, right = condition.left, condition.right
+        if isinstance(left, Col) and table.kind(left.name) == STRING and isinstance(right, Lit):
+            if condition.op not in ("=", "!="):
+                raise UnsupportedQuery("Only = and != are supported on text columns")
+            codes = np.asarray(table.values(left.name))
+            matches = np.flatnonzero(table.dictionary(left.name) == right.value)
+            mask = codes == matches[0] if len(matches) else np.zeros(len(codes), dtype=bool)
+            return mask if condition.op == "=" else ~mask
+
+        def row_values(expr: Expr):
+            if isinstance(expr, Lit):
+                return expr.value
+            if isinstance(expr, Col):
+                if table.kind(expr.name) != NUMERIC:
+                    raise UnsupportedQuery(f"Unsupported comparison on '{expr.name}'")
+                return np.asarray(table.values(expr.name))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _ARITHMETIC[expr.op](row_values(expr.left), row_values(expr.right))
+
+        return self._compare(row_values(left), condition.op, row_values(right))
+
+    def _group(self, frame: _Frame, query: Query, dims: List[str]):
+        keys = []
+        for dim in dims:
+            if query.over is not None and dim == query.over[0]:
+                source = query.over[1]
+                if query.over[0] != "day":
+                    raise UnsupportedQuery(f"OVER {query.over[0]}() is not supported locally")
+                keys.append((_day_numbers(frame.column(source)), "day"))
+            elif frame.table.kind(dim) == DATETIME:
+                keys.append((_day_numbers(frame.column(dim)), "day"))
+            else:
+                keys.append((frame.column(dim), frame.table.kind(dim)))
+
+        if not keys:
+            n = frame.table.n_rows if frame.rows is None else len(frame.rows)
+            frame.inverse = np.zeros(n, dtype=np.intp)
+            frame.n_groups = 1 if n else 0
+            return
+
+        if len(keys) == 1:
+            uniques, inverse = np.unique(keys[0][0], return_inverse=True)
+            uniques = [uniques]
+        else:
+            stacked = np.stack([k for k, _ in keys], axis=1)
+            rows, inverse = np.unique(stacked, axis=0, return_inverse=True)
+            uniques = [rows[:, i] for i in range(len(keys))]
+        frame.inverse = inverse.reshape(-1)
+        frame.n_groups = len(uniques[0])
+        for dim, (_, kind), values in zip(dims, keys, uniques):
+            if kind == STRING:
+                values = frame.table.dictionary(dim)[values]
+            frame.dims[dim] = (values, kind)
+
+    # -- evaluation ------------------------------------------------------
+
+    def _eval(self, expr: Expr, frame: _Frame) -> Tuple[np.ndarray, str]:
+        grouped = frame.inverse is not None
+        if isinstance(expr, Lit):
+            size = frame.n_groups if grouped else (frame.table.n_rows if frame.rows is None else len(frame.rows))
+            return np.full(size, expr.value), NUMERIC if isinstance(expr.value, float) else STRING
+        if isinstance(expr, Col):
+            if expr.name in frame.dims:
+                return frame.dims[expr.name]
+            kind = frame.table.kind(expr.name)
+            if not grouped or kind != NUMERIC:
+                if grouped:
+                    raise UnsupportedQuery(f"'{expr.name}' must be aggregated or listed in BY")
+                if kind == STRING:
+                    return frame.table.dictionary(expr.name)[frame.column(expr.name)], kind
+                return frame.column(expr.name), kind
+            # Bare numeric columns under BY use the column's default aggregate
+            return self._eval(Agg(frame.table.default_agg(expr.name), expr), frame)
+        if isinstance(expr, Agg):
+            if not grouped:
+                raise UnsupportedQuery("Aggregate without grouping")
+            counts = np.bincount(frame.inverse, minlength=frame.n_groups)
+            if expr.fn == "count":
+                return counts, NUMERIC
+            if not isinstance(expr.arg, Col):
+                raise UnsupportedQuery(f"{expr.fn}() takes a column locally")
+            kind = frame.table.kind(expr.arg.name)
+            values = frame.column(expr.arg.name)
+            if kind == DATETIME and expr.fn in ("min", "max"):
+                seconds = values.astype(np.int64)
+                ufunc = np.maximum if expr.fn == "max" else np.minimum
+                return _group_reduce(ufunc, seconds, frame.inverse, frame.n_groups), DATETIME
+            if kind != NUMERIC:
+                raise UnsupportedQuery(f"{expr.fn}() on non-numeric column '{expr.arg.name}'")
+            if expr.fn == "sum":
+                sums = np.bincount(frame.inverse, weights=values, minlength=frame.n_groups)
+                # bincount always sums in float64; keep integer columns integral and money at cents
+                if values.dtype.kind in "iub":
+                    return np.rint(sums).astype(np.int64), NUMERIC
+                return np.round(sums, 2), NUMERIC
+            if expr.fn == "avg":
+                sums = np.bincount(frame.inverse, weights=values, minlength=frame.n_groups)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    return sums / counts, NUMERIC
+            ufunc = np.maximum if expr.fn == "max" else np.minimum
+            return _group_reduce(ufunc, np.asarray(values), frame.inverse, frame.n_groups), NUMERIC
+        left, _ = self._eval(expr.left, frame)
+        right, _ = self._eval(expr.right, frame)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return _ARITHMETIC[expr.op](left, right), NUMERIC
+
+    @staticmethod
+    def _output(values: np.ndarray, kind: str) -> np.ndarray:
+        if kind == STRING:
+            return values.astype(object)
+        if kind == "day":
+            return _format_days(values)
+        if kind == DATETIME:
+            return _format_times(values)
+        return np.asarray(values)
+
+    @staticmethod
+    def _eval_output(expr: Expr, columns: Dict[str, np.ndarray]):
+        if isinstance(expr, Lit):
+            return expr.value
+        if isinstance(expr, Col):
+            if expr.name not in columns:
+                raise UnsupportedQuery(f"Unknown column '{expr.name}' in WHERE")
+            return columns[expr.name]
+        raise UnsupportedQuery("Only column/literal comparisons are supported after aggregation")
+
+    @staticmethod
+    def _compare(left, op: str, right) -> np.ndarray:
+        return np.asarray(_COMPARISONS[op](left, right), dtype=bool)
+
+    @staticmethod
+    def _top(selection: np.ndarray, keys: np.ndarray, descending: bool, limit: Optional[int]) -> np.ndarray:
+        if keys.dtype.kind in "fiu" and descending:
+            keys = -keys.astype(np.float64)
+        if limit is not None and limit < len(keys) and keys.dtype.kind in "fiu":
+            candidates = np.argpartition(keys, limit)[:limit]
+            order = candidates[np.argsort(keys[candidates], kind="stable")]
+        else:
+            order = np.argsort(keys, kind="stable")
+            if descending and keys.dtype.kind not in "fiu":
+                order = order[::-1]
+            if limit is not None:
+                order = order[:limit]
+        return selection[order]
+
+
+_ARITHMETIC = {
+    "+": np.add,
+    "-": np.subtract,
+    "*": np.multiply,
+    "/": np.true_divide,
+}
+
+_COMPARISONS = {
+    "<": np.less,
+    ">": np.greater,
+    "<=": np.less_equal,
+    ">=": np.greater_equal,
+    "=": np.equal,
+    "!=": np.not_equal,
+}
+
+
+# Shared by every agent in the worker process.
+snapshot_store = SnapshotStore()
+local_engine = LocalEngine(snapshot_store)
@@ -0,0 +1,78 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Attributes every LogRecord has; anything else was passed via `extra=`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: timestamp, level, logger, message and any
+    `extra={...}` fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+_listener = None
+
+
+def _start(root: logging.Logger):
+    """
+    The request path only enqueues records (QueueHandler); formatting and the
+    blocking write to stdout happen on the QueueListener's thread.
+    """
+    global _listener
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+
+
+def _configure() -> logging.Logger:
+    root = logging.getLogger("analytics")
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    _start(root)
+    atexit.register(lambda: _listener.stop())
+    return root
+
+
+_root = _configure()
+
+
+def restart():
+    """
+    Starts a fresh queue and listener thread. Threads do not survive fork(),
+    so a worker forked from a preloaded app calls this first (gunicorn
+    post_fork) or its records would queue up unwritten.
+    """
+    _start(_root)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return _root.getChild(name)
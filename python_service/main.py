@@ -1,7 +1,26 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+from admission import ADMISSION_MAX_STALE, Overloaded, Slot, admission
 from agent import ShopifyAgent
+from aggregates import aggregates
+from cache import result_cache
+import forecasting
+from logs import get_logger
+import metrics
+from prewarm import PREWARM_DEADLINE, prewarmer
+from rate_limit import BACKGROUND, scheduler
+from resilience import Deadline, breakers
+from shopify_client import pool
+from serialization import Chunk, accepted_encodings, dumps, encode_body
+from shared_store import shared_store
+from singleflight import shopify_inflight
+from streaming import NDJSON, SSE, encode_ndjson, encode_sse
+from webhooks import SUPPORTED_TOPICS, verify_webhook
 import uvicorn
 import os
 from dotenv import load_dotenv
@@ -10,7 +29,50 @@ from fastapi.middleware.cors import CORSMiddleware
 
 load_dotenv()
 
-app = FastAPI(title="Shopify AI Analytics Service")
+logger = get_logger("main")
+
+# Multi-process mode: how often each worker publishes its metrics to the shared store
+METRICS_PUBLISH_SECONDS = float(os.getenv("METRICS_PUBLISH_SECONDS", "5"))
+
+async def _publish_metrics():
+    while True:
+        await asyncio.sleep(METRICS_PUBLISH_SECONDS)
+        try:
+            await shared_store.run(shared_store.put_metrics, metrics.state())
+        except Exception:
+            logger.exception("Publishing metrics failed")
+
+async def _prewarm(shop_domain: str, access_token: str, matches: list) -> list:
+    agent = ShopifyAgent(shop_domain=shop_domain, access_token=access_token,
+                         priority=BACKGROUND, deadline=Deadline(PREWARM_DEADLINE))
+    return await agent.refresh(matches)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Bring this worker's aggregates up to date with the shared webhook log,
+    # then follow the webhooks its peers receive
+    sync_task = metrics_task = None
+    if aggregates.shared is not None:
+        await asyncio.to_thread(aggregates.catch_up)
+        sync_task = asyncio.create_task(aggregates.run())
+    # Publish this worker's metrics so a scrape of any worker covers all of them
+    if shared_store is not None:
+        metrics_task = asyncio.create_task(_publish_metrics())
+    # Keeps each shop's most asked questions warm in the result cache
+    prewarm_task = asyncio.create_task(prewarmer.run(_prewarm)) if prewarmer.interval > 0 else None
+    yield
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+    if sync_task is not None:
+        sync_task.cancel()
+    if metrics_task is not None:
+        metrics_task.cancel()
+    # Drain the shared per-shop connection pools on shutdown
+    await pool.aclose()
+    # Stop the forecast fitting processes
+    forecasting.shutdown()
+
+app = FastAPI(title="Shopify AI Analytics Service", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,34 +92,261 @@ class QueryResponse(BaseModel):
     shopify_ql: Optional[str] = None
     data: Optional[dict] = None
     confidence: str
+    cached: bool = False
+    cache_age: Optional[float] = None  # seconds since the result was fetched from Shopify
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    shop_domain: str
+    access_token: str
+
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]
+
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "25"))
+
+def _result_chunks(result: dict) -> List[Chunk]:
+    """
+    The QueryResponse JSON for one result, built straight from the agent's
+    trusted dict without re-validating it. A pre-serialized `data_json`
+    Payload (cached tables, fallback fixtures) is embedded as-is; the rest is
+    encoded with orjson.
+    """
+    data = result["data_json"] if "data_json" in result else dumps(result.get("data"))
+    return [
+        b'{"answer":' + dumps(result["answer"]) + b',"shopify_ql":' + dumps(result.get("shopify_ql")) + b',"data":',
+        data,
+        b',"confidence":' + dumps(result.get("confidence", "medium"))
+        + b',"cached":' + dumps(result.get("cached", False))
+        + b',"cache_age":' + dumps(result.get("cache_age")) + b"}",
+    ]
+
+def _batch_chunks(results: List[dict]) -> List[Chunk]:
+    chunks: List[Chunk] = [b'{"results":[']
+    for i, result in enumerate(results):
+        if i:
+            chunks.append(b",")
+        chunks.extend(_result_chunks(result))
+    chunks.append(b"]}")
+    return chunks
+
+def _json_response(chunks: List[Chunk], http_request: Request, headers: Optional[dict] = None) -> Response:
+    """
+    Sends the body gzip- or brotli-compressed when the client accepts it.
+    """
+    body, encoding = encode_body(chunks, accepted_encodings(http_request.headers.get("accept-encoding")))
+    headers = {"Vary": "Accept-Encoding", **(headers or {})}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+class _SlotStreamingResponse(StreamingResponse):
+    """
+    Releases the admission slot however the response ends. The body's own
+    finally only runs once iteration starts, which a client that leaves
+    before the first row never lets happen.
+    """
+
+    def __init__(self, content, slot: Slot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slot.release()
+
+def _streaming_response(agent: ShopifyAgent, question: str, media_type: str, slot: Slot) -> StreamingResponse:
+    encode = encode_sse if media_type == SSE else encode_ndjson
+
+    async def body():
+        # The admission slot is held until the last row is sent
+        try:
+            async for event, payload in agent.stream_question(question):
+                # NDJSON rows are bare arrays; other records say what they are
+                if media_type == NDJSON and event != "row":
+                    payload = {"event": event, **payload}
+                yield encode(event, payload)
+        finally:
+            slot.release()
+
+    return _SlotStreamingResponse(body(), slot, media_type=media_type)
+
+def _overloaded_response(agent: ShopifyAgent, questions: List[str], error: Overloaded, http_request: Request,
+                         batch: bool = False, degrade: bool = True) -> Response:
+    """
+    Answer for a request that was not admitted: what the worker already holds
+    for every question (aggregates, or cached results even past their TTL),
+    else a 429/503 with Retry-After.
+    """
+    retry_after = {"Retry-After": str(error.retry_after)}
+    results = [agent.answer_without_upstream(q, ADMISSION_MAX_STALE) for q in questions] if degrade else [None]
+    if any(result is None for result in results):
+        raise HTTPException(status_code=error.status_code, detail=str(error), headers=retry_after)
+    metrics.ADMISSIONS.inc(outcome="served_stale")
+    chunks = _batch_chunks(results) if batch else _result_chunks(results[0])
+    return _json_response(chunks, http_request,
+                          headers={**retry_after, "Warning": '199 - "Answered from cache while overloaded"'})
 
 @app.get("/")
 def health_check():
     return {"status": "ok", "service": "Shopify AI Analytics"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Prometheus scrape endpoint: per-stage latency histograms by intent and
+    shop tier, answer-source and fallback counters, upstream outcomes.
+
+    In multi-process mode the figures are the sum over every worker, each as
+    of its last publish (at most METRICS_PUBLISH_SECONDS old), whichever
+    worker answers the scrape.
+    """
+    if shared_store is None:
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+    await shared_store.run(shared_store.put_metrics, metrics.state())
+    states = await shared_store.run(shared_store.all_metrics)
+    return PlainTextResponse(metrics.render(states), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {**result_cache.stats(), **shopify_inflight.stats()}
+
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    """
+    Per-shop view of the GraphQL cost buckets: learned capacity and restore
+    rate, points available now, queued requests and throttles seen.
+    """
+    return scheduler.stats()
+
+@app.get("/admission/stats")
+def admission_stats():
+    """
+    Requests running and waiting for a slot, overall and per shop, and
+    rejections by reason.
+    """
+    return admission.stats()
+
+@app.get("/prewarm/stats")
+def prewarm_stats():
+    """
+    Pre-warming passes and outcomes, and each shop's most asked queries with
+    their decayed ask counts.
+    """
+    return prewarmer.stats()
+
+@app.get("/breakers/stats")
+def breaker_stats():
+    """
+    Per-shop circuit breaker state and recent failure rate.
+    """
+    return breakers.stats()
+
 @app.post("/analyze", response_model=QueryResponse)
-async def analyze_query(request: QueryRequest):
+async def analyze_query(request: QueryRequest, http_request: Request):
     """
     Analyzes a natural language query, converts it to ShopifyQL, 
     fetches data from Shopify, and returns a human-readable answer.
+
+    Send `Accept: application/x-ndjson` or `Accept: text/event-stream` to
+    stream the table instead: a "meta" record with the answer and headers
+    comes first, then one record per row, then an "end" record.
+
+    Requests that need a Shopify call or a local query are admission
+    controlled (see admission.py): under overload the answer comes from
+    cached data, even if stale, or the request is rejected with 429/503 and
+    Retry-After.
     """
+    # Started before any work so every later stage draws on the same budget
+    deadline = Deadline()
+    agent = ShopifyAgent(
+        shop_domain=request.shop_domain,
+        access_token=request.access_token,
+        deadline=deadline
+    )
+    accept = http_request.headers.get("accept", "")
+    streaming = NDJSON in accept or SSE in accept
+
     try:
-        agent = ShopifyAgent(
-            shop_domain=request.shop_domain,
-            access_token=request.access_token
-        )
-        
-        result = await agent.process_question(request.query)
-        
-        return QueryResponse(
-            answer=result["answer"],
-            shopify_ql=result.get("shopify_ql"),
-            data=result.get("data"),
-            confidence=result.get("confidence", "medium")
-        )
+        # Cache hits and calls already in flight are answered without a slot
+        slot = await admission.acquire(request.shop_domain, deadline,
+                                       upstream=agent.needs_upstream([request.query], streaming))
+    except Overloaded as e:
+        return _overloaded_response(agent, [request.query], e, http_request, degrade=not streaming)
+
+    try:
+        if streaming:
+            return _streaming_response(agent, request.query, SSE if SSE in accept else NDJSON, slot)
+
+        async with slot:
+            result = await agent.process_question(request.query)
+
+        return _json_response(_result_chunks(result), http_request)
         
     except Exception as e:
+        slot.release()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze/batch", response_model=BatchQueryResponse)
+async def analyze_batch(request: BatchQueryRequest, http_request: Request):
+    """
+    Answers several questions about one shop (e.g. every tile of a dashboard).
+    All distinct ShopifyQL queries go to Shopify in a single GraphQL request;
+    answers are returned in the order of `queries`.
+    """
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+
+    # Started before any work so every later stage draws on the same budget
+    deadline = Deadline()
+    agent = ShopifyAgent(
+        shop_domain=request.shop_domain,
+        access_token=request.access_token,
+        deadline=deadline
+    )
+    try:
+        slot = await admission.acquire(request.shop_domain, deadline,
+                                       upstream=agent.needs_upstream(request.queries))
+    except Overloaded as e:
+        return _overloaded_response(agent, request.queries, e, http_request, batch=True)
+
+    try:
+        async with slot:
+            results = await agent.process_questions(request.queries)
+        return _json_response(_batch_chunks(results), http_request)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/webhooks/{topic:path}")
+async def shopify_webhook(topic: str, request: Request):
+    """
+    Receives Shopify webhooks (orders/create, refunds/create,
+    inventory_levels/update), updates the shop's materialized aggregates and
+    drops cached results that read the affected tables.
+    """
+    if topic not in SUPPORTED_TOPICS:
+        raise HTTPException(status_code=404, detail=f"Unsupported webhook topic '{topic}'")
+
+    body = await request.body()
+    if not verify_webhook(body, request.headers.get("x-shopify-hmac-sha256")):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    shop_domain = request.headers.get("x-shopify-shop-domain")
+    if not shop_domain:
+        raise HTTPException(status_code=400, detail="Missing X-Shopify-Shop-Domain header")
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not JSON")
+
+    tables = await aggregates.apply(shop_domain, topic, payload,
+                                    webhook_id=request.headers.get("x-shopify-webhook-id"))
+    invalidated = await result_cache.invalidate(shop_domain, tables)
+    return {"status": "ok", "invalidated": invalidated}
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
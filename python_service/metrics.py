@@ -0,0 +1,200 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Tracing is optional: spans are emitted when the OpenTelemetry API is
+# installed (and exported when an SDK is configured); otherwise a no-op.
+try:
+    from opentelemetry import trace
+    _tracer = trace.get_tracer("shopify-ai-analytics")
+except ImportError:
+    _tracer = None
+
+# Seconds; spans in-process classification (µs) up to slow upstream calls
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def state(self) -> List[list]:
+        """
+        This process's series as JSON-serializable [labels, value] pairs.
+        """
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def collect(self, states: Optional[Sequence[List[list]]] = None) -> List[str]:
+        """
+        Exposition lines for the sum of `states` (one per process), or for
+        this process alone.
+        """
+        values: Dict[Tuple[str, ...], float] = {}
+        for state in [self.state()] if states is None else states:
+            for key, value in state:
+                values[tuple(key)] = values.get(tuple(key), 0.0) + value
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def state(self) -> List[list]:
+        """
+        This process's series as JSON-serializable [labels, bucket counts,
+        sum] triples.
+        """
+        with self._lock:
+            return [[list(key), list(counts), total] for key, (counts, total) in self._series.items()]
+
+    def collect(self, states: Optional[Sequence[List[list]]] = None) -> List[str]:
+        """
+        Exposition lines for the sum of `states` (one per process), or for
+        this process alone.
+        """
+        series: Dict[Tuple[str, ...], list] = {}
+        for state in [self.state()] if states is None else states:
+            for key, counts, total in state:
+                merged = series.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "analyze_stage_seconds",
+    "Time spent per pipeline stage (classify, execute, fallback, explain).",
+    ("stage", "intent", "shop_tier"),
+)
+QUESTIONS = Counter(
+    "analyze_questions_total",
+    "Questions answered, by where the data came from (live, cache, fallback).",
+    ("intent", "source"),
+)
+FALLBACKS = Counter(
+    "analyze_fallback_total",
+    "Questions answered with mock data, by reason.",
+    ("intent", "reason"),
+)
+UPSTREAM_RESPONSES = Counter(
+    "shopify_upstream_responses_total",
+    "Outcomes of Shopify GraphQL calls (HTTP status or error class).",
+    ("status",),
+)
+ADMISSIONS = Counter(
+    "analyze_admission_total",
+    "Admission decisions for /analyze requests (admitted, queued, rejected by reason, served stale, no upstream).",
+    ("outcome",),
+)
+
+REGISTRY = (STAGE_SECONDS, QUESTIONS, FALLBACKS, UPSTREAM_RESPONSES, ADMISSIONS)
+
+
+def fallback_reason(error: BaseException) -> str:
+    name = type(error).__name__
+    return {
+        "CircuitOpen": "circuit_open",
+        "DeadlineExceeded": "deadline",
+        "ShopifyThrottled": "throttled",
+        "TimeoutError": "timeout",
+    }.get(name, "timeout" if "Timeout" in name else "error")
+
+
+@contextmanager
+def stage(name: str, shop_tier: str, intent: str = "unknown") -> Iterator[Dict[str, str]]:
+    """
+    Times one pipeline stage into STAGE_SECONDS (and a trace span when
+    tracing is available). Yields a dict whose "intent" may be filled in by
+    the body once it is known, e.g. after classification.
+    """
+    labels = {"intent": intent}
+    span_context = _tracer.start_as_current_span(f"analyze.{name}") if _tracer is not None else nullcontext()
+    start = time.perf_counter()
+    with span_context as span:
+        try:
+            yield labels
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage=name, intent=labels["intent"], shop_tier=shop_tier)
+            if span is not None:
+                span.set_attribute("analyze.intent", labels["intent"])
+                span.set_attribute("shop.tier", shop_tier)
+
+
+def span(name: str, **attributes):
+    """
+    A trace span only (no histogram), for steps that cover several intents.
+    """
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+
+def state() -> Dict[str, Any]:
+    """
+    Every metric's series in this process, for merging with other workers'.
+    """
+    return {metric.name: metric.state() for metric in REGISTRY}
+
+
+def render(states: Optional[List[Dict[str, Any]]] = None) -> str:
+    """
+    Prometheus text exposition format (version 0.0.4), for this process or,
+    given the `state()` of several worker processes, for their sum.
+    """
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect(None if states is None else [s.get(metric.name, []) for s in states]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,186 @@
+import asyncio
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from admission import admission
+from cache import ResultCache, normalize_query, result_cache
+from intents import IntentMatch
+from logs import get_logger
+from resilience import CLOSED, breakers
+from shopify_client import normalize_domain
+
+logger = get_logger("prewarm")
+
+# Seconds between pre-warming passes; 0 disables pre-warming
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL_SECONDS", "30"))
+# The most asked queries per shop that are kept warm
+PREWARM_TOP_K = int(os.getenv("PREWARM_TOP_K", "5"))
+# Decayed ask count a query needs before it is worth keeping warm (asked more than once lately)
+PREWARM_MIN_SCORE = float(os.getenv("PREWARM_MIN_SCORE", "1.5"))
+# Half-life of the ask counts: a day, so yesterday's dashboard is warm this morning
+PREWARM_HALF_LIFE = float(os.getenv("PREWARM_HALF_LIFE_SECONDS", str(24 * 3600)))
+# Shops not seen for this long are forgotten (with their access token)
+PREWARM_FORGET_AFTER = float(os.getenv("PREWARM_FORGET_AFTER_SECONDS", str(2 * 24 * 3600)))
+# Shops refreshed at once, and the time budget of one shop's refresh
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "4"))
+PREWARM_DEADLINE = float(os.getenv("PREWARM_DEADLINE_SECONDS", "30"))
+# Longest a failing query is left alone before it is tried again
+PREWARM_MAX_BACKOFF = 3600.0
+
+# refresh(shop, token, matches) -> per match, None on success or the error
+Refresh = Callable[[str, str, List[IntentMatch]], Awaitable[List[Optional[BaseException]]]]
+
+
+@dataclass
+class Popularity:
+    match: IntentMatch
+    score: float
+    updated: float
+    failures: int = 0
+    retry_at: float = 0.0
+
+    def decayed(self, now: float) -> float:
+        return self.score * math.exp2(-(now - self.updated) / PREWARM_HALF_LIFE)
+
+
+class ShopActivity:
+    def __init__(self, access_token: str):
+        self.access_token = access_token
+        self.last_seen = time.monotonic()
+        self.queries: Dict[str, Popularity] = {}
+
+
+class Prewarmer:
+    """
+    Keeps each shop's most asked queries warm in the result cache.
+
+    Interactive questions are recorded per shop with an exponentially decayed
+    count per ShopifyQL query. Every `interval` seconds the top `top_k`
+    queries of each shop whose cached result is missing or would expire
+    before the next pass are fetched again through `refresh` at BACKGROUND
+    priority, so they draw only on the share of the shop's GraphQL budget
+    that interactive requests leave free. Passes are skipped while requests
+    are queueing for admission; shops with an open circuit are skipped, and
+    queries that fail are retried with exponential backoff.
+    """
+
+    def __init__(self, cache: ResultCache, interval: float = PREWARM_INTERVAL, top_k: int = PREWARM_TOP_K):
+        self.cache = cache
+        self.interval = interval
+        self.top_k = top_k
+        self._shops: Dict[str, ShopActivity] = {}
+        self.passes = 0
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped_busy = 0
+
+    def record(self, shop_domain: str, access_token: str, match: IntentMatch):
+        """
+        Counts one interactive question. The latest access token seen for a
+        shop is the one used to refresh it.
+        """
+        if match.id == "fallback" or not access_token:
+            return
+        domain = normalize_domain(shop_domain)
+        shop = self._shops.get(domain)
+        if shop is None:
+            shop = self._shops[domain] = ShopActivity(access_token)
+        shop.access_token = access_token
+        now = shop.last_seen = time.monotonic()
+        query = normalize_query(match.shopify_ql)
+        popularity = shop.queries.get(query)
+        if popularity is None:
+            shop.queries[query] = Popularity(match, 1.0, now)
+        else:
+            popularity.score = popularity.decayed(now) + 1.0
+            popularity.updated = now
+
+    def due(self, now: float) -> List[Tuple[str, str, List[Popularity]]]:
+        """
+        (shop, token, queries to refresh) for every shop with popular queries
+        that are cold or about to go stale. Forgets idle shops.
+        """
+        work = []
+        for domain in list(self._shops):
+            shop = self._shops[domain]
+            if now - shop.last_seen > PREWARM_FORGET_AFTER:
+                del self._shops[domain]
+                continue
+            if breakers.get(domain).state != CLOSED:
+                continue
+            ranked = sorted(shop.queries.values(), key=lambda p: p.decayed(now), reverse=True)
+            stale = []
+            for popularity in ranked[:self.top_k]:
+                if popularity.decayed(now) < PREWARM_MIN_SCORE or popularity.retry_at > now:
+                    continue
+                remaining = self.cache.remaining_ttl(domain, popularity.match.shopify_ql)
+                if remaining is None or remaining < 2 * self.interval:
+                    stale.append(popularity)
+            # Drop queries that have decayed to nothing
+            shop.queries = {q: p for q, p in shop.queries.items() if p.decayed(now) >= 0.01}
+            if stale:
+                work.append((domain, shop.access_token, stale))
+        return work
+
+    async def run_once(self, refresh: Refresh):
+        self.passes += 1
+        if admission.queued:
+            self.skipped_busy += 1
+            return
+        semaphore = asyncio.Semaphore(PREWARM_CONCURRENCY)
+
+        async def warm(domain: str, token: str, stale: List[Popularity]):
+            async with semaphore:
+                try:
+                    errors = await refresh(domain, token, [p.match for p in stale])
+                except Exception as e:
+                    errors = [e] * len(stale)
+            now = time.monotonic()
+            for popularity, error in zip(stale, errors):
+                if error is not None:
+                    self.failed += 1
+                    popularity.failures += 1
+                    popularity.retry_at = now + min(self.interval * 2 ** popularity.failures, PREWARM_MAX_BACKOFF)
+                    logger.info("Pre-warm failed", extra={"shop": domain, "intent": popularity.match.id,
+                                                          "error": str(error)})
+                else:
+                    self.refreshed += 1
+                    popularity.failures = 0
+
+        await asyncio.gather(*(warm(*item) for item in self.due(time.monotonic())))
+
+    async def run(self, refresh: Refresh):
+        """
+        Pre-warming loop, started as a background task for the app's lifetime.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once(refresh)
+            except Exception:
+                logger.exception("Pre-warm pass failed")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "interval": self.interval,
+            "passes": self.passes,
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "skipped_busy": self.skipped_busy,
+            "shops": {
+                domain: {
+                    query: round(popularity.decayed(now), 2)
+                    for query, popularity in sorted(shop.queries.items(), key=lambda item: -item[1].decayed(now))
+                    [:self.top_k]
+                }
+                for domain, shop in self._shops.items()
+            },
+        }
+
+
+# Shared by every agent in the worker process.
+prewarmer = Prewarmer(result_cache)
@@ -0,0 +1,197 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Request priorities: lower runs first. Interactive /analyze traffic always
+# goes ahead of background work (pre-warming, bulk jobs).
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Shopify's standard GraphQL Admin limits; the real values for a shop are
+# learned from `extensions.cost.throttleStatus` on its first response.
+DEFAULT_BUCKET_SIZE = float(os.getenv("SHOPIFY_BUCKET_SIZE", "1000"))
+DEFAULT_RESTORE_RATE = float(os.getenv("SHOPIFY_RESTORE_RATE", "50"))
+# Cost assumed for one shopifyqlQuery field until Shopify reports one
+DEFAULT_QUERY_COST = float(os.getenv("SHOPIFY_QL_QUERY_COST", "10"))
+# Share of the bucket background work must leave untouched for interactive requests
+BACKGROUND_RESERVE = float(os.getenv("SHOPIFY_BACKGROUND_RESERVE", "0.2"))
+
+# Shops whose per-shop state (cost bucket, circuit breaker, HTTP client) a
+# worker keeps; the least recently used idle ones are dropped beyond that.
+SHOPIFY_MAX_SHOPS = int(os.getenv("SHOPIFY_MAX_SHOPS", "1000"))
+
+
+class ShopifyThrottled(Exception):
+    """
+    Shopify kept throttling a query after every allowed retry.
+    """
+
+
+def is_throttled(body: Dict[str, Any]) -> bool:
+    return any((e.get("extensions") or {}).get("code") == "THROTTLED" for e in body.get("errors") or [])
+
+
+class ShopBucket:
+    """
+    Client-side mirror of one shop's GraphQL leaky bucket.
+
+    Points restore at `restore_rate` per second up to `capacity`. A request
+    reserves its estimated cost before it is sent; waiters are served in
+    priority order (then FIFO) by a dispatcher that sleeps exactly until the
+    head of the queue fits, so requests go out at the shop's restore rate
+    instead of being rejected by Shopify. Every response carrying
+    `throttleStatus` resynchronizes the mirror with Shopify's own numbers.
+    """
+
+    def __init__(self, capacity: float = DEFAULT_BUCKET_SIZE, restore_rate: float = DEFAULT_RESTORE_RATE,
+                 query_cost: float = DEFAULT_QUERY_COST):
+        self.capacity = capacity
+        self.restore_rate = restore_rate
+        self.available = capacity
+        self.query_cost = query_cost
+        self.in_flight = 0.0
+        self._updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.throttled = 0
+        self.waited = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.restore_rate)
+        self._updated = now
+
+    def estimate(self, queries: int = 1) -> float:
+        return min(self.query_cost * queries, self.capacity)
+
+    def _fits(self, cost: float, priority: int) -> bool:
+        reserve = self.capacity * BACKGROUND_RESERVE if priority > INTERACTIVE else 0.0
+        return self.available - reserve >= cost
+
+    async def acquire(self, cost: float, priority: int = INTERACTIVE):
+        self._refill()
+        if not self._waiters and self._fits(cost, priority):
+            self.available -= cost
+            self.in_flight += cost
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), cost, future))
+        self.waited += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(cost)  # dispatched just as the caller gave up
+            raise
+
+    async def _dispatch(self):
+        while self._waiters:
+            priority, _, cost, future = self._waiters[0]
+            if future.done():  # caller gave up (cancelled or timed out)
+                heapq.heappop(self._waiters)
+                continue
+            self._refill()
+            if self._fits(cost, priority):
+                heapq.heappop(self._waiters)
+                self.available -= cost
+                self.in_flight += cost
+                future.set_result(None)
+                continue
+            reserve = self.capacity * BACKGROUND_RESERVE if priority > INTERACTIVE else 0.0
+            await asyncio.sleep(max(cost + reserve - self.available, 0.0) / self.restore_rate)
+
+    @property
+    def tier(self) -> str:
+        """
+        Plan tier implied by the restore rate, used to label metrics without a
+        per-shop label.
+        """
+        if self.restore_rate >= 1000:
+            return "plus"
+        if self.restore_rate >= 200:
+            return "advanced"
+        return "standard"
+
+    def release(self, reserved: float, extensions: Optional[Dict[str, Any]] = None, queries: int = 1):
+        """
+        Settles a reservation once the response arrived (or the request
+        failed). With `extensions.cost`, adopts Shopify's bucket state and
+        learns the per-query cost for future estimates.
+        """
+        self.in_flight = max(self.in_flight - reserved, 0.0)
+        cost = (extensions or {}).get("cost") or {}
+        status = cost.get("throttleStatus")
+        if status:
+            self.capacity = float(status.get("maximumAvailable", self.capacity))
+            self.restore_rate = float(status.get("restoreRate", self.restore_rate)) or self.restore_rate
+            # Shopify's figure does not include requests still in flight
+            self.available = float(status.get("currentlyAvailable", self.available)) - self.in_flight
+            self._updated = time.monotonic()
+        requested = cost.get("requestedQueryCost")
+        if requested:
+            self.query_cost = max(float(requested) / max(queries, 1), 1.0)
+
+    def drain(self):
+        """
+        Called on a throttled response without cost data (e.g. HTTP 429):
+        assume the bucket is empty.
+        """
+        self.available = min(self.available, 0.0)
+        self._updated = time.monotonic()
+
+    @property
+    def idle(self) -> bool:
+        return not self._waiters and self.in_flight <= 0
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "capacity": self.capacity,
+            "restore_rate": self.restore_rate,
+            "available": round(self.available, 1),
+            "queued": len(self._waiters),
+            "throttled": self.throttled,
+            "waited": self.waited,
+        }
+
+
+class CostScheduler:
+    """
+    One ShopBucket per shop domain, for at most `max_shops` shops: beyond
+    that the least recently used idle buckets are dropped (a shop seen again
+    starts from a full bucket and resyncs on its first response).
+    """
+
+    def __init__(self, max_shops: int = SHOPIFY_MAX_SHOPS):
+        self.max_shops = max_shops
+        self._buckets: "OrderedDict[str, ShopBucket]" = OrderedDict()
+
+    def bucket(self, domain: str) -> ShopBucket:
+        bucket = self._buckets.get(domain)
+        if bucket is None:
+            bucket = self._buckets[domain] = ShopBucket()
+            if len(self._buckets) > self.max_shops:
+                self._prune()
+        else:
+            self._buckets.move_to_end(domain)
+        return bucket
+
+    def _prune(self):
+        idle = [domain for domain, bucket in self._buckets.items() if bucket.idle]
+        for domain in idle[:len(self._buckets) - self.max_shops]:
+            del self._buckets[domain]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {domain: bucket.stats() for domain, bucket in self._buckets.items()}
+
+
+# Shared by every agent in the worker process.
+scheduler = CostScheduler()
@@ -0,0 +1,182 @@
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator
+
+from rate_limit import SHOPIFY_MAX_SHOPS
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Failure rate over the last BREAKER_WINDOW calls that opens a shop's circuit,
+# once at least BREAKER_MIN_CALLS have been seen.
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+# Seconds an open circuit fails fast before letting a probe through
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+# Overall budget for answering one request, and the cap on any single upstream call
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE_SECONDS", "10"))
+SHOPIFY_TIMEOUT = float(os.getenv("SHOPIFY_TIMEOUT_SECONDS", "10"))
+
+
+class CircuitOpen(Exception):
+    """
+    The shop's circuit is open; the call was not attempted.
+    """
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    The request's time budget ran out before an upstream call could start.
+    """
+
+
+class Deadline:
+    """
+    Absolute time budget for one request. Each stage asks for its timeout
+    with timeout(cap), so time spent earlier shrinks what later stages get.
+    """
+
+    def __init__(self, budget: float = REQUEST_DEADLINE):
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float = SHOPIFY_TIMEOUT) -> float:
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        return min(cap, remaining)
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker for one shop.
+
+    Closed: calls go through and outcomes are recorded in a sliding window of
+    the last `window` calls; once the failure rate reaches `failure_rate`
+    (with at least `min_calls` outcomes) the circuit opens. Open: calls fail
+    immediately with CircuitOpen for `cooldown` seconds. Half-open: a single
+    probe call is let through; success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, failure_rate: float = BREAKER_FAILURE_RATE, window: int = BREAKER_WINDOW,
+                 min_calls: int = BREAKER_MIN_CALLS, cooldown: float = BREAKER_COOLDOWN):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._outcomes: Deque[bool] = deque(maxlen=window)  # True = failure
+        self._opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self):
+        self._probing = False
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+            self._outcomes.clear()
+        self._outcomes.append(False)
+
+    def record_failure(self):
+        self._probing = False
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append(True)
+        if len(self._outcomes) >= self.min_calls and \
+                sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    @contextmanager
+    def guard(self, neutral: tuple = ()) -> Iterator[None]:
+        """
+        Wraps one upstream call. Raises CircuitOpen without running the body
+        when the circuit rejects the call. Exceptions listed in `neutral`
+        (e.g. throttling) and cancellations are not held against the shop.
+        """
+        if not self.allow():
+            self.rejected += 1
+            raise CircuitOpen("Shop is unavailable (circuit open)")
+        try:
+            yield
+        except neutral:
+            self._probing = False
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Cancelled or closed early by the consumer: no verdict either way
+            self._probing = False
+            raise
+        else:
+            self.record_success()
+
+    def stats(self) -> Dict[str, Any]:
+        failures = sum(self._outcomes)
+        return {
+            "state": self.state,
+            "failure_rate": round(failures / len(self._outcomes), 2) if self._outcomes else 0.0,
+            "calls": len(self._outcomes),
+            "rejected": self.rejected,
+        }
+
+
+class BreakerRegistry:
+    """
+    One CircuitBreaker per shop domain, for at most `max_shops` shops:
+    beyond that the least recently used closed breakers are dropped. Open
+    and half-open ones are kept, so their shops keep failing fast.
+    """
+
+    def __init__(self, max_shops: int = SHOPIFY_MAX_SHOPS):
+        self.max_shops = max_shops
+        self._breakers: "OrderedDict[str, CircuitBreaker]" = OrderedDict()
+
+    def get(self, domain: str) -> CircuitBreaker:
+        breaker = self._breakers.get(domain)
+        if breaker is None:
+            breaker = self._breakers[domain] = CircuitBreaker()
+            if len(self._breakers) > self.max_shops:
+                self._prune()
+        else:
+            self._breakers.move_to_end(domain)
+        return breaker
+
+    def _prune(self):
+        closed = [domain for domain, breaker in self._breakers.items() if breaker.state == CLOSED]
+        for domain in closed[:len(self._breakers) - self.max_shops]:
+            del self._breakers[domain]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {domain: breaker.stats() for domain, breaker in self._breakers.items()}
+
+
+# Shared by every agent in the worker process.
+breakers = BreakerRegistry()
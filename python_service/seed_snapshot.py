@@ -0,0 +1,90 @@
+"""
+Writes a synthetic columnar snapshot for a shop so the local ShopifyQL engine
+can be tried without a bulk export:
+
+    python seed_snapshot.py demo-store.myshopify.com --orders 1000000
+    SHOPIFY_QL_BACKEND=local python main.py
+"""
+import argparse
+import time
+
+import numpy as np
+
+from local_engine import snapshot_store
+
+PRODUCTS = ["Classic Jeans", "White Sneakers", "Black Belt", "Fast-Selling Tee", "Limited Edition Mug",
+            "Summer Hat", "Wool Sweater", "Skinny Jeans", "Boots", "Cap (Red)"]
+COUNTRIES = ["United States", "Canada", "United Kingdom", "Germany", "Australia"]
+DISCOUNTS = ["", "SUMMER20", "WELCOME10", "FREESHIP"]
+SOURCES = ["Google", "Instagram", "Facebook", "TikTok", "Email Newsletter", "Direct"]
+DEVICES = ["Mobile", "Desktop", "Tablet"]
+
+
+def _timestamps(rng, n, days):
+    now = np.datetime64("now", "s")
+    return now - rng.integers(0, days * 86400, n).astype("timedelta64[s]")
+
+
+def seed(shop_domain: str, orders: int, days: int = 120, variants: int = len(PRODUCTS), seed_value: int = 7):
+    rng = np.random.default_rng(seed_value)
+    write = snapshot_store.write_table
+
+    write(shop_domain, "orders", {
+        "timestamp": _timestamps(rng, orders, days),
+        "total_price": np.round(rng.gamma(2.0, 40.0, orders), 2),
+        "billing_address_country": rng.choice(COUNTRIES, orders, p=[0.55, 0.15, 0.15, 0.1, 0.05]),
+        "discount_code": rng.choice(DISCOUNTS, orders, p=[0.7, 0.1, 0.15, 0.05]),
+    }, time_column="timestamp")
+
+    lines = orders * 2
+    quantity = rng.integers(1, 4, lines)
+    write(shop_domain, "sales", {
+        "timestamp": _timestamps(rng, lines, days),
+        "product_title": rng.choice(PRODUCTS, lines),
+        "net_quantity": quantity,
+        "returns": (rng.random(lines) < 0.06).astype(np.int64),
+        "total_sales": np.round(quantity * rng.uniform(10, 90, lines), 2),
+    }, time_column="timestamp")
+
+    # Variants beyond the named products get numbered product titles
+    titles = np.array(PRODUCTS + [f"Product {i:06d}" for i in range(len(PRODUCTS), variants)])[:variants]
+    velocity = np.round(rng.uniform(0.5, 6.0, variants), 1)
+    write(shop_domain, "inventory", {
+        "inventory_item_id": np.arange(1, variants + 1, dtype=np.int64) + 40000000000,
+        "product_title": titles,
+        "product_variant_title": np.char.add(titles, " (Default)"),
+        "quantity": rng.integers(0, 60, variants),
+        "avg_daily_sales": velocity,
+        "reorder_point": np.full(variants, 20),
+        "recommended_order_qty": rng.integers(10, 60, variants),
+    }, aggs={"avg_daily_sales": "avg", "reorder_point": "avg"})
+
+    sessions = orders * 4
+    write(shop_domain, "visits", {
+        "timestamp": _timestamps(rng, sessions, days),
+        "referrer_source": rng.choice(SOURCES, sessions),
+        "type": rng.choice(["search", "social", "email", "direct"], sessions),
+        "device_type": rng.choice(DEVICES, sessions, p=[0.65, 0.3, 0.05]),
+        "conversion_rate": np.round(rng.uniform(0.01, 0.06, sessions), 4),
+        "total_sales": np.round(rng.gamma(0.3, 40.0, sessions), 2),
+    }, aggs={"conversion_rate": "avg"}, time_column="timestamp")
+
+    customer_orders = orders // 2
+    write(shop_domain, "customers", {
+        "timestamp": _timestamps(rng, customer_orders, days),
+        "customer_name": np.array([f"Customer {i:05d}" for i in rng.integers(0, max(customer_orders // 3, 1), customer_orders)]),
+    }, time_column="timestamp")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("shop_domain")
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--variants", type=int, default=len(PRODUCTS), help="inventory rows (catalog size)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    seed(args.shop_domain, args.orders, args.days, args.variants)
+    print(f"Seeded snapshot for {args.shop_domain} ({args.orders} orders) "
+          f"in {time.perf_counter() - start:.1f}s under {snapshot_store.root}")
@@ -0,0 +1,155 @@
+import json
+import os
+import struct
+import zlib
+from typing import Any, FrozenSet, List, Optional, Sequence, Tuple, Union
+
+# orjson is several times faster than the json module and serializes NumPy
+# scalars and arrays directly; the stdlib encoder is the fallback.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Brotli is optional: offered to clients only when the module is installed.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+# Fixed gzip member header: deflate, no flags, no mtime, unknown OS
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+# An empty final deflate block, closing a stream of sync-flushed fragments
+_DEFLATE_END = b"\x03\x00"
+
+
+def _default(value: Any) -> Any:
+    if hasattr(value, "tolist"):  # NumPy arrays and scalars
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+                            default=_default)
+
+    loads = orjson.loads
+else:
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+    loads = json.loads
+
+
+def _deflate_fragment(data: bytes) -> bytes:
+    """
+    Raw deflate blocks for `data`, compressed on their own and ending on a
+    sync flush (no final block), so fragments can be concatenated.
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class Payload:
+    """
+    A pre-serialized JSON fragment (a cached table, a fallback fixture)
+    that is written into response bodies as-is.
+
+    Its deflate encoding is computed on first use and kept, so a gzip
+    response embedding it only compresses the few bytes around it.
+    """
+
+    __slots__ = ("raw", "_deflated")
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self._deflated: Optional[bytes] = None
+
+    @classmethod
+    def of(cls, value: Any) -> "Payload":
+        return cls(dumps(value))
+
+    def deflated(self) -> bytes:
+        if self._deflated is None:
+            self._deflated = _deflate_fragment(self.raw)
+        return self._deflated
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+
+Chunk = Union[bytes, Payload]
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> FrozenSet[str]:
+    """
+    The supported content codings ("br", "gzip") an Accept-Encoding header
+    allows, honoring q=0. Brotli only when the module is installed.
+    """
+    accepted = set()
+    refused = set()
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.partition(";")
+        quality = params.strip()
+        try:
+            allowed = not quality.startswith("q=") or float(quality[2:]) > 0
+        except ValueError:
+            allowed = False
+        (accepted if allowed else refused).add(name.strip())
+    if "*" in accepted:
+        accepted.update({"br", "gzip"} - refused)
+    if brotli is None:
+        accepted.discard("br")
+    return frozenset(accepted & {"br", "gzip"})
+
+
+def _gzip(chunks: Sequence[Chunk]) -> bytes:
+    """
+    One gzip member spliced from per-chunk deflate fragments: Payloads
+    contribute their stored encoding, plain bytes are compressed now.
+    """
+    parts: List[bytes] = [_GZIP_HEADER]
+    crc = 0
+    size = 0
+    pending: List[bytes] = []  # adjacent plain chunks, compressed together
+    for chunk in list(chunks) + [None]:
+        if isinstance(chunk, bytes):
+            pending.append(chunk)
+            continue
+        if pending:
+            raw = b"".join(pending)
+            parts.append(_deflate_fragment(raw))
+            crc = zlib.crc32(raw, crc)
+            size += len(raw)
+            pending = []
+        if chunk is not None:
+            parts.append(chunk.deflated())
+            crc = zlib.crc32(chunk.raw, crc)
+            size += len(chunk.raw)
+    parts.append(_DEFLATE_END)
+    parts.append(struct.pack("<II", crc, size & 0xFFFFFFFF))
+    return b"".join(parts)
+
+
+def encode_body(chunks: Sequence[Chunk], accepted: FrozenSet[str] = frozenset()) -> Tuple[bytes, Optional[str]]:
+    """
+    Concatenates `chunks` into a response body. Returns (body,
+    content_encoding); small bodies stay uncompressed.
+
+    A body embedding stored Payloads is sent as gzip when allowed, so only
+    the bytes around them are compressed. Otherwise brotli is preferred.
+    """
+    size = sum(len(chunk) for chunk in chunks)
+    if not accepted or size < COMPRESS_MIN_BYTES:
+        return b"".join(c.raw if isinstance(c, Payload) else c for c in chunks), None
+    precompressed = any(isinstance(chunk, Payload) for chunk in chunks)
+    if "gzip" in accepted and (precompressed or "br" not in accepted):
+        return _gzip(chunks), "gzip"
+    raw = b"".join(c.raw if isinstance(c, Payload) else c for c in chunks)
+    return brotli.compress(raw, quality=BROTLI_QUALITY), "br"
@@ -0,0 +1,249 @@
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from logs import get_logger
+
+logger = get_logger("shared_store")
+
+# Path of the SQLite file shared by all worker processes on a host. Unset
+# means single-process mode: every cache and aggregate stays in memory.
+SHARED_STORE_PATH = os.getenv("SHARED_STORE_PATH", "")
+SHARED_STORE_MMAP_BYTES = int(os.getenv("SHARED_STORE_MMAP_BYTES", str(256 * 1024 * 1024)))
+# How long a worker may hold the right to fetch a query before others stop waiting for it
+LEASE_SECONDS = float(os.getenv("SHARED_LEASE_SECONDS", "15"))
+# Webhook events older than this are pruned from the shared log
+EVENT_RETENTION_SECONDS = float(os.getenv("SHARED_EVENT_RETENTION_DAYS", "90")) * 86400
+# Metrics of a worker that stopped publishing are dropped after this long
+METRICS_RETENTION_SECONDS = float(os.getenv("SHARED_METRICS_RETENTION_HOURS", "24")) * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    shop TEXT NOT NULL,
+    query TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    payload BLOB NOT NULL,
+    PRIMARY KEY (shop, query)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS leases (
+    shop TEXT NOT NULL,
+    query TEXT NOT NULL,
+    owner INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (shop, query)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    webhook_id TEXT UNIQUE,
+    shop TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    received_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metrics (
+    worker TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL,
+    payload BLOB NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class SharedStore:
+    """
+    Cross-process L2 store on one SQLite file in WAL mode, read through a
+    memory map so hot pages are shared by every worker via the OS page cache.
+
+    Holds encoded query results (so a result fetched by one worker serves
+    all of them), short leases that let one worker fetch a query while the
+    others wait for its result, the webhook event log every worker replays
+    into its in-memory aggregates, and each worker's metrics, so a scrape of
+    any worker reports all of them.
+
+    Connections are opened lazily per process, since SQLite handles must not
+    cross a fork (gunicorn preload).
+
+    The methods block (a write may wait up to 5s for the file lock), so
+    coroutines call them through `run` or `submit`, which execute them, in
+    order, on the store's own thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        self._worker = ""
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid = 0
+        self._lock = threading.Lock()
+        self._appended = 0
+        self._stored = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={SHARED_STORE_MMAP_BYTES}")
+            conn.executescript(_SCHEMA)
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('log_started', ?)", (time.time(),))
+            self._conn, self._pid = conn, os.getpid()
+            # This process's metrics row; a restarted worker gets a new one
+            self._worker = f"{os.getpid()}-{time.time_ns()}"
+        return self._conn
+
+    def _thread(self) -> ThreadPoolExecutor:
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-store")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Awaits `fn(*args)` run on the store's thread, off the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._thread(), functools.partial(fn, *args))
+
+    def submit(self, fn: Callable[..., Any], *args: Any):
+        """
+        Queues `fn(*args)` on the store's thread without waiting for it (a
+        write-through or a lease release). Runs after every call queued before.
+        """
+        self._thread().submit(fn, *args).add_done_callback(_log_failure)
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self._lock:
+            return self._db().execute(sql, params).fetchall()
+
+    def _write(self, sql: str, params: Tuple = ()) -> int:
+        with self._lock:
+            return self._db().execute(sql, params).rowcount
+
+    # -- results -----------------------------------------------------------
+
+    def get(self, shop: str, query: str) -> Optional[Tuple[Any, float, float]]:
+        """
+        (decoded payload, stored_at, expires_at) of a live result, else None.
+        Times are wall-clock.
+        """
+        rows = self._query(
+            "SELECT payload, stored_at, expires_at FROM results WHERE shop = ? AND query = ? AND expires_at > ?",
+            (shop, query, time.time()),
+        )
+        if not rows:
+            return None
+        payload, stored_at, expires_at = rows[0]
+        return json.loads(payload), stored_at, expires_at
+
+    def put(self, shop: str, query: str, payload: Any, ttl: float):
+        now = time.time()
+        self._write(
+            "INSERT OR REPLACE INTO results (shop, query, stored_at, expires_at, payload) VALUES (?, ?, ?, ?, ?)",
+            (shop, query, now, now + ttl, json.dumps(payload, separators=(",", ":")).encode()),
+        )
+        self._stored += 1
+        if self._stored % 1000 == 0:
+            self.purge_expired()
+
+    def invalidate(self, shop: str, prefixes: Iterable[str]) -> int:
+        removed = 0
+        for prefix in prefixes:
+            # Queries are stored normalized; match the FROM clause case-insensitively
+            removed += self._write(
+                "DELETE FROM results WHERE shop = ? AND lower(substr(query, 1, ?)) = ?",
+                (shop, len(prefix), prefix),
+            )
+        return removed
+
+    def purge_expired(self):
+        self._write("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+
+    # -- leases ------------------------------------------------------------
+
+    def claim(self, shop: str, query: str, seconds: float = LEASE_SECONDS) -> bool:
+        """
+        True if this process may fetch the query now: no other live lease
+        exists (an expired one is taken over).
+        """
+        now = time.time()
+        claimed = self._write(
+            "INSERT INTO leases (shop, query, owner, expires_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (shop, query) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.expires_at <= ? OR leases.owner = excluded.owner",
+            (shop, query, os.getpid(), now + seconds, now),
+        )
+        return claimed > 0
+
+    def release(self, shop: str, query: str):
+        self._write("DELETE FROM leases WHERE shop = ? AND query = ? AND owner = ?", (shop, query, os.getpid()))
+
+    def leased(self, shop: str, query: str) -> bool:
+        return bool(self._query(
+            "SELECT 1 FROM leases WHERE shop = ? AND query = ? AND expires_at > ?", (shop, query, time.time())
+        ))
+
+    # -- webhook event log -------------------------------------------------
+
+    def append_event(self, shop: str, topic: str, payload: Dict[str, Any], webhook_id: Optional[str]) -> bool:
+        """
+        Appends a webhook to the log. False if this webhook id was already logged.
+        """
+        try:
+            self._write(
+                "INSERT INTO events (webhook_id, shop, topic, payload, received_at) VALUES (?, ?, ?, ?, ?)",
+                (webhook_id, shop, topic, json.dumps(payload, separators=(",", ":")).encode(), time.time()),
+            )
+        except sqlite3.IntegrityError:
+            return False
+        self._appended += 1
+        if self._appended % 1000 == 0:
+            self._write("DELETE FROM events WHERE received_at < ?", (time.time() - EVENT_RETENTION_SECONDS,))
+        return True
+
+    def log_started(self) -> float:
+        """
+        Wall-clock time the event log was created; it holds every webhook
+        received since (within EVENT_RETENTION_SECONDS).
+        """
+        return self._query("SELECT value FROM meta WHERE key = 'log_started'")[0][0]
+
+    def events_since(self, last_id: int) -> List[Tuple[int, str, str, Dict[str, Any]]]:
+        rows = self._query("SELECT id, shop, topic, payload FROM events WHERE id > ? ORDER BY id", (last_id,))
+        return [(row[0], row[1], row[2], json.loads(row[3])) for row in rows]
+
+    # -- metrics -----------------------------------------------------------
+
+    def put_metrics(self, state: Dict[str, Any]):
+        """
+        Stores this process's metrics (see metrics.state), replacing its last copy.
+        """
+        self._db()
+        self._write("INSERT OR REPLACE INTO metrics (worker, updated_at, payload) VALUES (?, ?, ?)",
+                    (self._worker, time.time(), json.dumps(state, separators=(",", ":")).encode()))
+
+    def all_metrics(self) -> List[Dict[str, Any]]:
+        """
+        The stored metrics of every worker, dropping those of workers gone
+        for METRICS_RETENTION_SECONDS.
+        """
+        self._write("DELETE FROM metrics WHERE updated_at < ?", (time.time() - METRICS_RETENTION_SECONDS,))
+        return [json.loads(row[0]) for row in self._query("SELECT payload FROM metrics")]
+
+
+def _log_failure(future: Future):
+    if future.exception() is not None:
+        logger.error("Shared store write failed", exc_info=future.exception())
+
+
+# Shared by every agent in the worker process; None in single-process mode.
+shared_store: Optional[SharedStore] = SharedStore(SHARED_STORE_PATH) if SHARED_STORE_PATH else None
@@ -0,0 +1,411 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import httpx
+
+from metrics import UPSTREAM_RESPONSES
+from rate_limit import (BACKGROUND, INTERACTIVE, SHOPIFY_MAX_SHOPS, ShopBucket, ShopifyThrottled, is_throttled,
+                        scheduler)
+from resilience import DeadlineExceeded, breakers
+from streaming import TableStreamParser
+
+# HTTP/2 needs the optional `h2` package (installed via `httpx[http2]`).
+# Without it we still get pooled HTTP/1.1 keep-alive connections.
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+API_VERSION = "2023-10"
+
+# Where a shop's Admin API lives; "{shop}" is replaced by the normalized domain.
+# Pointed at benchmarks/fake_shopify.py for load tests.
+SHOPIFY_API_BASE_URL = os.getenv("SHOPIFY_API_BASE_URL", "https://{shop}")
+
+# Times a THROTTLED query is re-queued behind the shop's bucket before giving up
+MAX_THROTTLE_RETRIES = int(os.getenv("SHOPIFY_MAX_THROTTLE_RETRIES", "3"))
+
+# An evicted shop's client is closed this long after eviction, once requests
+# still using it have finished (no call runs longer)
+CLIENT_CLOSE_GRACE_SECONDS = 120.0
+
+# Access tokens remembered as accepted, per shop and in total
+VERIFIED_TOKENS_PER_SHOP = 4
+VERIFIED_TOKEN_SHOPS = int(os.getenv("VERIFIED_TOKEN_SHOPS", "10000"))
+
+SHOPIFY_QL_SELECTION = """{
+    __typename
+    ... on TableResponse {
+      headers
+      rows
+    }
+    ... on ParseErrors {
+      errors {
+        message
+      }
+    }
+  }"""
+
+SHOPIFY_QL_DOCUMENT = """
+query($qlQuery: String!) {
+  shopifyqlQuery(query: $qlQuery) %s
+}
+""" % SHOPIFY_QL_SELECTION
+
+
+BULK_RUN_DOCUMENT = """
+mutation($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+BULK_STATUS_DOCUMENT = """
+query($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation { id status errorCode objectCount url partialDataUrl }
+  }
+}
+"""
+
+
+def build_batch_document(count: int) -> str:
+    """
+    One GraphQL document with an aliased shopifyqlQuery field (q0, q1, ...)
+    per ShopifyQL string, each bound to its own variable.
+    """
+    variables = ", ".join(f"$q{i}: String!" for i in range(count))
+    fields = "\n".join(f"  q{i}: shopifyqlQuery(query: $q{i}) {SHOPIFY_QL_SELECTION}" for i in range(count))
+    return f"query({variables}) {{\n{fields}\n}}"
+
+
+def normalize_domain(shop_domain: str) -> str:
+    """
+    Strips the scheme and trailing slash and ensures the .myshopify.com suffix.
+    """
+    domain = shop_domain.replace("https://", "").replace("http://", "").strip().rstrip("/")
+    if not domain.endswith(".myshopify.com"):
+        domain += ".myshopify.com"
+    return domain
+
+
+class VerifiedTokens:
+    """
+    Digests of the access tokens Shopify has accepted for each shop.
+
+    Results cached or in flight for a shop, its aggregates and its snapshot
+    are shared by every caller for that shop, so they are only served to a
+    caller presenting one of these tokens. Any other token goes to Shopify,
+    which checks it; a token Shopify rejects is forgotten.
+    """
+
+    def __init__(self, max_shops: int = VERIFIED_TOKEN_SHOPS, per_shop: int = VERIFIED_TOKENS_PER_SHOP):
+        self.max_shops = max_shops
+        self.per_shop = per_shop
+        self._shops: "OrderedDict[str, OrderedDict[str, None]]" = OrderedDict()
+
+    @staticmethod
+    def _digest(access_token: str) -> str:
+        return hashlib.sha256(access_token.encode()).hexdigest()
+
+    def verified(self, shop_domain: str, access_token: str) -> bool:
+        tokens = self._shops.get(normalize_domain(shop_domain))
+        return bool(access_token) and tokens is not None and self._digest(access_token) in tokens
+
+    def accepted(self, shop_domain: str, access_token: str):
+        domain = normalize_domain(shop_domain)
+        tokens = self._shops.get(domain)
+        if tokens is None:
+            tokens = self._shops[domain] = OrderedDict()
+            if len(self._shops) > self.max_shops:
+                self._shops.popitem(last=False)
+        else:
+            self._shops.move_to_end(domain)
+        digest = self._digest(access_token)
+        tokens[digest] = None
+        tokens.move_to_end(digest)
+        if len(tokens) > self.per_shop:
+            tokens.popitem(last=False)
+
+    def rejected(self, shop_domain: str, access_token: str):
+        tokens = self._shops.get(normalize_domain(shop_domain))
+        if tokens is not None:
+            tokens.pop(self._digest(access_token), None)
+
+
+# Shared by every agent in the worker process.
+verified_tokens = VerifiedTokens()
+
+
+def _check_credentials(domain: str, access_token: str, response: httpx.Response):
+    if response.status_code in (401, 403):
+        verified_tokens.rejected(domain, access_token)
+    elif response.is_success:
+        verified_tokens.accepted(domain, access_token)
+
+
+class ShopifyClientPool:
+    """
+    Keeps one long-lived AsyncClient per shop domain so that every /analyze call
+    reuses warm keep-alive (and, when available, HTTP/2) connections instead of
+    paying a fresh TCP+TLS handshake.
+
+    Holds clients for at most `max_shops` shops. Beyond that the least
+    recently used client is evicted and closed CLIENT_CLOSE_GRACE_SECONDS
+    later, after any request still using it.
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive: int = 20,
+                 keepalive_expiry: float = 30.0, timeout: float = 10.0, max_shops: int = SHOPIFY_MAX_SHOPS):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.max_shops = max_shops
+        self._clients: "OrderedDict[str, httpx.AsyncClient]" = OrderedDict()
+        # Evicted clients with the time they may be closed, oldest first
+        self._retired: "deque[Tuple[float, httpx.AsyncClient]]" = deque()
+        self.evicted = 0
+
+    def get(self, domain: str) -> httpx.AsyncClient:
+        client = self._clients.get(domain)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=SHOPIFY_API_BASE_URL.format(shop=domain),
+                http2=HTTP2_AVAILABLE,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+            self._clients[domain] = client
+            self._evict()
+        else:
+            self._clients.move_to_end(domain)
+        if self._retired and self._retired[0][0] <= time.monotonic():
+            self._close_retired()
+        return client
+
+    def _evict(self):
+        while len(self._clients) > self.max_shops:
+            _, client = self._clients.popitem(last=False)
+            self._retired.append((time.monotonic() + CLIENT_CLOSE_GRACE_SECONDS, client))
+            self.evicted += 1
+
+    def _close_retired(self):
+        now = time.monotonic()
+        while self._retired and self._retired[0][0] <= now:
+            asyncio.ensure_future(self._retired.popleft()[1].aclose())
+
+    async def aclose(self):
+        clients, self._clients = self._clients, OrderedDict()
+        retired, self._retired = self._retired, deque()
+        for client in list(clients.values()) + [client for _, client in retired]:
+            await client.aclose()
+
+
+# Shared across requests (and agents) for the lifetime of the worker process.
+pool = ShopifyClientPool(
+    max_connections=int(os.getenv("SHOPIFY_MAX_CONNECTIONS", "100")),
+    max_keepalive=int(os.getenv("SHOPIFY_MAX_KEEPALIVE", "20")),
+)
+
+
+async def execute_shopify_ql(shop_domain: str, access_token: str, query: str,
+                             timeout: float = 10.0, priority: int = INTERACTIVE) -> Dict[str, Any]:
+    """
+    Sends a ShopifyQL query to the Shopify GraphQL Admin API over the pooled client.
+    """
+    payload = {
+        "query": SHOPIFY_QL_DOCUMENT,
+        "variables": {"qlQuery": query}
+    }
+
+    return await _post_graphql(shop_domain, access_token, payload, timeout, priority=priority)
+
+
+async def execute_shopify_ql_batch(shop_domain: str, access_token: str, queries: List[str],
+                                   timeout: float = 10.0, priority: int = INTERACTIVE) -> List[Dict[str, Any]]:
+    """
+    Sends several ShopifyQL queries in one aliased GraphQL request and splits
+    the response back into one single-query shaped result per query.
+    """
+    payload = {
+        "query": build_batch_document(len(queries)),
+        "variables": {f"q{i}": query for i, query in enumerate(queries)}
+    }
+    body = await _post_graphql(shop_domain, access_token, payload, timeout,
+                               queries=len(queries), priority=priority)
+
+    data = body.get("data") or {}
+    errors_by_alias: Dict[str, list] = {}
+    for error in body.get("errors", []):
+        path = error.get("path") or [None]
+        errors_by_alias.setdefault(path[0], []).append(error)
+
+    results = []
+    for i in range(len(queries)):
+        alias = f"q{i}"
+        result: Dict[str, Any] = {"data": {"shopifyqlQuery": data.get(alias)}}
+        # Errors without a path (e.g. throttling) apply to every query
+        errors = errors_by_alias.get(alias, []) + errors_by_alias.get(None, [])
+        if errors:
+            result["errors"] = errors
+        results.append(result)
+    return results
+
+
+async def run_bulk_query(shop_domain: str, access_token: str, query: str,
+                         timeout: float = 30.0, priority: int = BACKGROUND) -> Dict[str, Any]:
+    """
+    Starts a bulk operation exporting the result of `query` as JSONL and
+    returns it ({"id", "status"}). Raises ValueError on userErrors (e.g.
+    another bulk operation is already running for the shop).
+    """
+    payload = {"query": BULK_RUN_DOCUMENT, "variables": {"query": query}}
+    body = await _post_graphql(shop_domain, access_token, payload, timeout, priority=priority)
+    result = (body.get("data") or {}).get("bulkOperationRunQuery") or {}
+    errors = result.get("userErrors") or body.get("errors")
+    if errors or not result.get("bulkOperation"):
+        raise ValueError(f"bulkOperationRunQuery failed: {errors}")
+    return result["bulkOperation"]
+
+
+async def get_bulk_operation(shop_domain: str, access_token: str, operation_id: str,
+                             timeout: float = 30.0, priority: int = BACKGROUND) -> Dict[str, Any]:
+    """
+    Current state of a bulk operation: status, errorCode, objectCount and,
+    once COMPLETED, the url of its JSONL export.
+    """
+    payload = {"query": BULK_STATUS_DOCUMENT, "variables": {"id": operation_id}}
+    body = await _post_graphql(shop_domain, access_token, payload, timeout, priority=priority)
+    operation = (body.get("data") or {}).get("node")
+    if not operation:
+        raise ValueError(f"Unknown bulk operation {operation_id}: {body.get('errors')}")
+    return operation
+
+
+async def stream_shopify_ql(shop_domain: str, access_token: str, query: str,
+                            timeout: float = 10.0, priority: int = INTERACTIVE) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Like execute_shopify_ql, but yields ("headers", [...]) and then one
+    ("row", [...]) event per table row while the response body is still
+    being received, without materializing the whole table.
+    """
+    domain = normalize_domain(shop_domain)
+    client = pool.get(domain)
+
+    headers = {
+        "Content-Type": "application/json",
+        "X-Shopify-Access-Token": access_token
+    }
+
+    payload = {
+        "query": SHOPIFY_QL_DOCUMENT,
+        "variables": {"qlQuery": query}
+    }
+
+    # The cost report comes after the rows, so streamed queries settle on the estimate
+    bucket = scheduler.bucket(domain)
+    cost = bucket.estimate()
+    expires_at = time.monotonic() + timeout
+    parser = TableStreamParser()
+    with breakers.get(domain).guard(neutral=_NEUTRAL_ERRORS):
+        await _acquire(bucket, cost, priority, expires_at)
+        try:
+            async with client.stream("POST", f"/admin/api/{API_VERSION}/graphql.json", headers=headers,
+                                     json=payload, timeout=max(expires_at - time.monotonic(), 0.001)) as response:
+                UPSTREAM_RESPONSES.inc(status=response.status_code)
+                _check_credentials(domain, access_token, response)
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    for event in parser.feed(chunk):
+                        yield event
+                    if parser.done:
+                        break
+        finally:
+            bucket.release(cost)
+    # A body without a table (e.g. ParseErrors) is a query problem, not a shop outage
+    parser.close()
+
+
+# Failures that say nothing about the shop's health
+_NEUTRAL_ERRORS = (ShopifyThrottled, DeadlineExceeded)
+
+
+async def _acquire(bucket: ShopBucket, cost: float, priority: int, expires_at: float):
+    try:
+        await asyncio.wait_for(bucket.acquire(cost, priority), max(expires_at - time.monotonic(), 0.0))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Timed out waiting for the shop's rate limit budget")
+
+
+async def _post_graphql(shop_domain: str, access_token: str, payload: Dict[str, Any],
+                        timeout: float, queries: int = 1, priority: int = INTERACTIVE) -> Dict[str, Any]:
+    """
+    Posts a GraphQL document once the shop's cost bucket has room for it.
+    Throttled responses are re-queued (keeping their priority) instead of
+    being surfaced as failures. Fails fast with CircuitOpen while the shop's
+    circuit breaker is open.
+    """
+    domain = normalize_domain(shop_domain)
+    client = pool.get(domain)
+    bucket = scheduler.bucket(domain)
+
+    headers = {
+        "Content-Type": "application/json",
+        "X-Shopify-Access-Token": access_token
+    }
+
+    # `timeout` bounds the whole call: queueing for the bucket, throttle retries and the request itself
+    expires_at = time.monotonic() + timeout
+    with breakers.get(domain).guard(neutral=_NEUTRAL_ERRORS):
+        for _ in range(MAX_THROTTLE_RETRIES + 1):
+            cost = bucket.estimate(queries)
+            await _acquire(bucket, cost, priority, expires_at)
+            # Checked outside the try below, which would report it as an upstream timeout
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                bucket.release(cost)
+                raise DeadlineExceeded("Request deadline exceeded while queued")
+            try:
+                # httpx timeouts are per network operation; wait_for caps the whole exchange
+                response = await asyncio.wait_for(
+                    client.post(f"/admin/api/{API_VERSION}/graphql.json",
+                                headers=headers, json=payload, timeout=remaining),
+                    remaining)
+                UPSTREAM_RESPONSES.inc(status=response.status_code)
+                _check_credentials(domain, access_token, response)
+                if response.status_code == 429:
+                    bucket.release(cost)
+                    bucket.drain()
+                    bucket.throttled += 1
+                    continue
+                response.raise_for_status()
+                body = response.json()
+            except asyncio.TimeoutError:
+                bucket.release(cost)
+                UPSTREAM_RESPONSES.inc(status="timeout")
+                raise TimeoutError(f"{domain} did not answer within {remaining:.2f}s")
+            except httpx.TransportError:
+                bucket.release(cost)
+                UPSTREAM_RESPONSES.inc(status="transport_error")
+                raise
+            except BaseException:
+                bucket.release(cost)
+                raise
+
+            bucket.release(cost, body.get("extensions"), queries)
+            if not is_throttled(body):
+                return body
+            bucket.throttled += 1
+            UPSTREAM_RESPONSES.inc(status="throttled")
+
+        raise ShopifyThrottled(f"{domain} is still throttled after {MAX_THROTTLE_RETRIES} retries")
@@ -0,0 +1,271 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Union
+
+
+class UnsupportedQuery(ValueError):
+    """
+    Raised for ShopifyQL outside the subset the local engine understands.
+    Callers fall back to Shopify's API for these.
+    """
+
+
+# Expression nodes
+@dataclass(frozen=True)
+class Col:
+    name: str
+
+
+@dataclass(frozen=True)
+class Agg:
+    fn: str
+    arg: Optional["Expr"]  # None for count()
+
+
+@dataclass(frozen=True)
+class BinOp:
+    op: str
+    left: "Expr"
+    right: "Expr"
+
+
+@dataclass(frozen=True)
+class Lit:
+    value: Union[float, str]
+
+
+@dataclass(frozen=True)
+class Forecast:
+    arg: "Expr"
+    horizon: str  # e.g. "1m"
+
+
+Expr = Union[Col, Agg, BinOp, Lit, Forecast]
+
+AGGREGATES = {"sum", "count", "avg", "min", "max"}
+
+
+@dataclass
+class Field:
+    expr: Expr
+    alias: str
+
+
+@dataclass
+class Condition:
+    left: Expr
+    op: str
+    right: Expr
+
+
+@dataclass
+class Query:
+    source: str
+    fields: List[Field]
+    group_by: List[str] = field(default_factory=list)
+    over: Optional[Tuple[str, str]] = None  # ("day", "timestamp")
+    where: List[Condition] = field(default_factory=list)
+    since_days: Optional[int] = None
+    until_today: bool = False
+    order_by: Optional[Tuple[str, bool]] = None  # (name, descending)
+    limit: Optional[int] = None
+
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+      (?P<number>\d+(?:\.\d+)?)
+    | (?P<string>"[^"]*"|'[^']*')
+    | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<op><=|>=|!=|[-+*/(),<>=])
+    )""", re.VERBOSE)
+
+_CLAUSES = {"FROM", "SHOW", "BY", "WHERE", "SINCE", "UNTIL", "ORDER", "LIMIT", "OVER"}
+
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if m is None or m.end() == pos:
+            if text[pos:].strip() == "":
+                break
+            raise UnsupportedQuery(f"Unexpected input at: {text[pos:pos + 20]!r}")
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self, offset: int = 0) -> Tuple[str, str]:
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else ("eof", "")
+
+    def next(self) -> Tuple[str, str]:
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def keyword(self, offset: int = 0) -> str:
+        kind, value = self.peek(offset)
+        return value.upper() if kind == "ident" else ""
+
+    def expect(self, value: str):
+        kind, got = self.next()
+        if got.upper() != value.upper():
+            raise UnsupportedQuery(f"Expected {value}, got {got!r}")
+
+    def at_clause(self) -> bool:
+        return self.peek()[0] == "eof" or self.keyword() in _CLAUSES
+
+    # expr := term (('+'|'-') term)*
+    def expr(self) -> Expr:
+        node = self.term()
+        while self.peek() in (("op", "+"), ("op", "-")):
+            node = BinOp(self.next()[1], node, self.term())
+        return node
+
+    # term := atom (('*'|'/') atom)*
+    def term(self) -> Expr:
+        node = self.atom()
+        while self.peek() in (("op", "*"), ("op", "/")):
+            node = BinOp(self.next()[1], node, self.atom())
+        return node
+
+    def atom(self) -> Expr:
+        kind, value = self.next()
+        if kind == "number":
+            return Lit(float(value))
+        if kind == "string":
+            return Lit(value[1:-1])
+        if (kind, value) == ("op", "("):
+            node = self.expr()
+            self.expect(")")
+            return node
+        if (kind, value) == ("op", "-"):
+            return BinOp("-", Lit(0.0), self.atom())
+        if kind == "ident":
+            if self.peek() == ("op", "("):
+                fn = value.lower()
+                if fn == "forecast":
+                    return self.forecast()
+                if fn not in AGGREGATES:
+                    raise UnsupportedQuery(f"Function {value}() is not supported locally")
+                self.next()
+                arg = None
+                if self.peek() != ("op", ")"):
+                    arg = self.expr()
+                self.expect(")")
+                return Agg(fn, arg)
+            return Col(value)
+        raise UnsupportedQuery(f"Unexpected token {value!r}")
+
+    def forecast(self) -> Forecast:
+        # forecast(column, "1m")
+        self.next()
+        arg = self.expr()
+        self.expect(",")
+        kind, horizon = self.next()
+        if kind != "string":
+            raise UnsupportedQuery("forecast() needs a horizon such as \"1m\"")
+        self.expect(")")
+        return Forecast(arg, horizon[1:-1])
+
+    def field(self) -> Field:
+        expr = self.expr()
+        alias = None
+        if self.keyword() == "OVER":
+            # sum(x) OVER day(timestamp): a per-day series of the aggregate
+            self.next()
+            _, grain = self.next()
+            self.expect("(")
+            _, column = self.next()
+            self.expect(")")
+            self.over = (grain.lower(), column)
+        if self.keyword() == "AS":
+            self.next()
+            alias = self.next()[1]
+        return Field(expr, alias or _default_alias(expr))
+
+    def condition(self) -> Condition:
+        left = self.expr()
+        kind, op = self.next()
+        if kind != "op" or op not in ("<", ">", "<=", ">=", "=", "!="):
+            raise UnsupportedQuery(f"Unsupported comparison {op!r}")
+        return Condition(left, op, self.expr())
+
+    def parse(self) -> Query:
+        self.over = None
+        self.expect("FROM")
+        source = self.next()[1]
+        self.expect("SHOW")
+        fields = [self.field()]
+        while self.peek() == ("op", ","):
+            self.next()
+            fields.append(self.field())
+
+        query = Query(source=source, fields=fields, over=self.over)
+        while self.peek()[0] != "eof":
+            clause = self.keyword()
+            self.next()
+            if clause == "BY":
+                query.group_by.append(self.next()[1])
+                while self.peek() == ("op", ","):
+                    self.next()
+                    query.group_by.append(self.next()[1])
+            elif clause == "WHERE":
+                query.where.append(self.condition())
+                while self.keyword() == "AND":
+                    self.next()
+                    query.where.append(self.condition())
+            elif clause == "SINCE":
+                self.expect("-")
+                _, amount = self.next()
+                _, unit = self.next()
+                if unit != "d":
+                    raise UnsupportedQuery(f"Unsupported SINCE unit {unit!r}")
+                query.since_days = int(amount)
+            elif clause == "UNTIL":
+                if self.next()[1].lower() != "today":
+                    raise UnsupportedQuery("Only UNTIL today is supported")
+                query.until_today = True
+            elif clause == "ORDER":
+                self.expect("BY")
+                name = self.next()[1]
+                descending = False
+                if self.keyword() in ("ASC", "DESC"):
+                    descending = self.next()[1].upper() == "DESC"
+                query.order_by = (name, descending)
+            elif clause == "LIMIT":
+                query.limit = int(self.next()[1])
+            else:
+                raise UnsupportedQuery(f"Unsupported clause {clause or self.peek(-1)[1]!r}")
+        return query
+
+
+def _default_alias(expr: Expr) -> str:
+    if isinstance(expr, Col):
+        return expr.name
+    if isinstance(expr, Agg):
+        inner = _default_alias(expr.arg) if expr.arg is not None else ""
+        return f"{expr.fn}({inner})"
+    if isinstance(expr, Forecast):
+        return "forecast"
+    return "value"
+
+
+def parse(text: str) -> Query:
+    """
+    Parses the ShopifyQL subset generated by the intent table:
+    FROM t SHOW expr [AS a], ... [OVER day(col)] [BY d, ...] [WHERE c [AND c]]
+    [SINCE -Nd] [UNTIL today] [ORDER BY x [ASC|DESC]] [LIMIT n] [#tag]
+    """
+    # Trailing "#tag" markers are routing hints, not ShopifyQL
+    text = text.split("#", 1)[0]
+    return _Parser(_tokenize(text)).parse()
@@ -0,0 +1,77 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls that share a key: the first caller starts
+    the work, later callers await the same task, and every waiter receives
+    its result or its exception.
+
+    The shared task is shielded, so one waiter being cancelled (e.g. a client
+    disconnect) does not cancel the upstream call for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.started += 1
+            task.add_done_callback(lambda t, key=key: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def do_many(self, keys: List[Hashable],
+                      fn: Callable[[List[Hashable]], Awaitable[List[Any]]]) -> List[Any]:
+        """
+        Like do() for several keys at once. Keys that are not already in
+        flight are resolved by a single call to `fn(missing_keys)`, which must
+        return one result per key in the same order. Returns one outcome per
+        key, with failures returned as exception instances rather than raised.
+        """
+        missing = [key for key in dict.fromkeys(keys) if key not in self._calls]
+        self.coalesced += len(keys) - len(missing)
+        if missing:
+            batch = asyncio.ensure_future(fn(missing))
+            self.started += 1
+            for index, key in enumerate(missing):
+                task = asyncio.ensure_future(self._pick(batch, index))
+                self._calls[key] = task
+                task.add_done_callback(lambda t, key=key: self._finish(key, t))
+            # Only the per-key tasks are awaited; retrieve the batch outcome here
+            batch.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        tasks = [self._calls[key] for key in keys]
+        return await asyncio.gather(*(asyncio.shield(task) for task in tasks), return_exceptions=True)
+
+    @staticmethod
+    async def _pick(batch: asyncio.Future, index: int) -> Any:
+        return (await batch)[index]
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "upstream_started": self.started,
+            "coalesced": self.coalesced,
+        }
+
+
+# Shared ShopifyQL executions, keyed on (shop domain, normalized ShopifyQL).
+shopify_inflight = SingleFlight()
@@ -0,0 +1,206 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from local_engine import SnapshotStore, snapshot_store
+from shopify_client import normalize_domain
+from shopifyql import UnsupportedQuery
+from table import ColumnarTable
+
+# Products with fewer days of stock than this are "at risk" (stock_risk intent)
+RISK_DAYS = float(os.getenv("RISK_DAYS", "7"))
+# At most this many at-risk products are returned, most urgent first
+RISK_TOP_K = int(os.getenv("RISK_TOP_K", "100"))
+# Reorders bring stock up to the reorder point plus this many days of sales
+REORDER_COVER_DAYS = float(os.getenv("REORDER_COVER_DAYS", "30"))
+
+
+def _days_left(quantity: np.ndarray, velocity: np.ndarray) -> np.ndarray:
+    """
+    Days until stock runs out at the current velocity: 0 once it is gone,
+    inf for products that do not sell (out of stock or not, they are not
+    running out).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(velocity > 0, np.maximum(quantity, 0) / velocity, np.inf)
+
+
+def _reorder_qty(quantity: np.ndarray, velocity: np.ndarray, reorder_point: np.ndarray) -> np.ndarray:
+    target = reorder_point + velocity * REORDER_COVER_DAYS
+    return np.maximum(np.ceil(target - quantity), 0).astype(np.int64)
+
+
+def _most_urgent(days_left: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the `k` smallest days_left, ordered (argpartition, then a
+    sort of only those k).
+    """
+    if k < len(days_left):
+        candidates = np.argpartition(days_left, k)[:k]
+    else:
+        candidates = np.arange(len(days_left))
+    return candidates[np.argsort(days_left[candidates], kind="stable")]
+
+
+class RiskIndex:
+    """
+    Catalog-wide stock-out risk for one shop, per product: stock on hand,
+    daily sales velocity, reorder point, days until empty and reorder
+    quantity, all as arrays computed in one vectorized pass over the
+    inventory snapshot's variant rows.
+
+    inventory_levels/update webhooks change one variant and refresh only its
+    product's entries. A webhook reports one location's level, so the
+    variant's quantity moves by the change at that location: the new level
+    minus the last known one. Known levels come from the snapshot's
+    inventory_levels table; without it, the first location reported for a
+    variant is assumed to hold all of its snapshot stock.
+    """
+
+    def __init__(self, products: np.ndarray, variant_product: np.ndarray, variant_quantity: np.ndarray,
+                 velocity: np.ndarray, reorder_point: np.ndarray, items: Dict[int, int],
+                 levels: Optional[Dict[Tuple[int, int], float]] = None):
+        n = len(products)
+        self.products = products
+        self.variant_product = variant_product
+        self.variant_quantity = variant_quantity.astype(np.float64)
+        self.quantity = np.bincount(variant_product, weights=self.variant_quantity, minlength=n)
+        self.velocity = velocity
+        self.reorder_point = reorder_point
+        self.days_left = _days_left(self.quantity, self.velocity)
+        self.reorder_qty = _reorder_qty(self.quantity, self.velocity, self.reorder_point)
+        self._items = items  # inventory_item_id -> variant row
+        self._per_location = levels is not None
+        self._levels: Dict[Tuple[int, int], float] = levels or {}  # (inventory item, location) -> available
+        self._reported: Set[int] = set()  # variant rows with a level reported by webhook
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_snapshot(cls, store: SnapshotStore, shop_domain: str) -> "RiskIndex":
+        table = store.open(shop_domain, "inventory")
+        for name in ("product_title", "quantity", "avg_daily_sales", "reorder_point"):
+            table.kind(name)  # raises UnsupportedQuery when a column is missing
+        codes = np.asarray(table.values("product_title"), dtype=np.int64)
+        products = table.dictionary("product_title")
+        n = len(products)
+        # A product sells as fast as all of its variants together
+        velocity = np.bincount(codes, weights=table.values("avg_daily_sales"), minlength=n)
+        reorder_point = np.bincount(codes, weights=table.values("reorder_point"), minlength=n)
+        items: Dict[int, int] = {}
+        if table.has("inventory_item_id"):
+            ids = table.values("inventory_item_id")
+            items = dict(zip(np.asarray(ids, dtype=np.int64).tolist(), range(len(ids))))
+        levels = None
+        if store.has_table(shop_domain, "inventory_levels"):
+            located = store.open(shop_domain, "inventory_levels")
+            keys = zip(np.asarray(located.values("inventory_item_id"), dtype=np.int64).tolist(),
+                       np.asarray(located.values("location_id"), dtype=np.int64).tolist())
+            levels = dict(zip(keys, np.asarray(located.values("available"), dtype=np.float64).tolist()))
+        return cls(products, codes, np.asarray(table.values("quantity")), velocity, reorder_point, items, levels)
+
+    def set_level(self, inventory_item_id: Any, location_id: Any, available: float) -> bool:
+        """
+        Applies an inventory_levels/update. False if the item is unknown.
+        """
+        try:
+            key = (int(inventory_item_id), int(location_id))
+        except (TypeError, ValueError):
+            return False
+        row = self._items.get(key[0])
+        if row is None:
+            return False
+        with self._lock:
+            previous = self._levels.get(key)
+            if previous is None:
+                # A location new to this variant, or (without per-location
+                # levels) the one holding its snapshot stock
+                previous = 0.0 if self._per_location or row in self._reported else self.variant_quantity[row]
+            self._reported.add(row)
+            self._levels[key] = float(available)
+            delta = float(available) - previous
+            product = self.variant_product[row]
+            self.quantity[product] += delta
+            self.variant_quantity[row] += delta
+            self.days_left[product] = _days_left(self.quantity[product:product + 1],
+                                                 self.velocity[product:product + 1])[0]
+            self.reorder_qty[product] = _reorder_qty(self.quantity[product:product + 1],
+                                                     self.velocity[product:product + 1],
+                                                     self.reorder_point[product:product + 1])[0]
+        return True
+
+    def at_risk(self, days: float = RISK_DAYS, limit: int = RISK_TOP_K) -> ColumnarTable:
+        """
+        The stock_risk result: products running out within `days`, most
+        urgent first.
+        """
+        with self._lock:
+            risky = np.flatnonzero(self.days_left < days)
+            rows = risky[_most_urgent(self.days_left[risky], limit)]
+            return ColumnarTable.from_arrays(
+                ["product_title", "quantity", "avg_daily_sales", "days_left"],
+                [self.products[rows], np.rint(self.quantity[rows]).astype(np.int64),
+                 np.round(self.velocity[rows], 2), np.round(self.days_left[rows], 1)],
+            )
+
+    def reorders(self, first: int = RISK_TOP_K) -> ColumnarTable:
+        """
+        The reorder result: every product below its reorder point with the
+        quantity to order, the `first` most urgent of them leading.
+        """
+        with self._lock:
+            below = np.flatnonzero(self.quantity < self.reorder_point)
+            urgent = _most_urgent(self.days_left[below], first)
+            rest = np.setdiff1d(np.arange(len(below)), urgent, assume_unique=True)
+            rows = below[np.concatenate([urgent, rest])]
+            return ColumnarTable.from_arrays(
+                ["product_title", "quantity", "recommended_order_qty"],
+                [self.products[rows], np.rint(self.quantity[rows]).astype(np.int64), self.reorder_qty[rows]],
+            )
+
+
+class RiskEngine:
+    """
+    RiskIndex per shop, built from the inventory snapshot on first use and
+    rebuilt when the snapshot is rewritten.
+    """
+
+    def __init__(self, store: SnapshotStore):
+        self.store = store
+        self._indexes: Dict[str, Tuple[Any, RiskIndex]] = {}
+        self._lock = threading.Lock()
+
+    def index(self, shop_domain: str) -> Optional[RiskIndex]:
+        domain = normalize_domain(shop_domain)
+        version = self.store.version(domain, "inventory")
+        if version is None:
+            return None
+        with self._lock:
+            cached = self._indexes.get(domain)
+            if cached is None or cached[0] != version:
+                try:
+                    cached = (version, RiskIndex.from_snapshot(self.store, domain))
+                except UnsupportedQuery:
+                    return None
+                self._indexes[domain] = cached
+        return cached[1]
+
+    def set_level(self, shop_domain: str, level: Dict[str, Any]) -> bool:
+        index = self.index(shop_domain)
+        if index is None:
+            return False
+        return index.set_level(level.get("inventory_item_id"), level.get("location_id"),
+                               level.get("available") or 0)
+
+    def answer(self, shop_domain: str, intent_id: str) -> Optional[ColumnarTable]:
+        if intent_id not in ("stock_risk", "reorder"):
+            return None
+        index = self.index(shop_domain)
+        if index is None:
+            return None
+        return index.at_risk() if intent_id == "stock_risk" else index.reorders()
+
+
+# Shared by every agent in the worker process.
+risk_engine = RiskEngine(snapshot_store)
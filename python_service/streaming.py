@@ -0,0 +1,103 @@
+import codecs
+import json
+import re
+from typing import Any, List, Tuple
+
+from serialization import dumps
+
+# Media types that switch /analyze into streaming mode
+NDJSON = "application/x-ndjson"
+SSE = "text/event-stream"
+
+_KEY = re.compile(r'"(headers|rows)"\s*:\s*')
+_SKIP = " \t\r\n,"
+
+
+class TableStreamParser:
+    """
+    Incrementally extracts `headers` and the elements of `rows` from a
+    shopifyqlQuery response body as it arrives.
+
+    feed() takes raw bytes and returns ("headers", [...]) / ("row", [...])
+    events for everything that is complete so far. Only the unparsed tail of
+    the body is buffered, so memory stays bounded by the chunk size plus one
+    row regardless of how many rows the table has.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._state = "seek"  # seek -> rows -> done
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, chunk: bytes) -> List[Tuple[str, Any]]:
+        self._buf = self._buf[self._pos:] + self._utf8.decode(chunk)
+        self._pos = 0
+        events: List[Tuple[str, Any]] = []
+
+        while self._state != "done":
+            if self._state == "seek":
+                m = _KEY.search(self._buf, self._pos)
+                if m is None:
+                    break
+                if m.group(1) == "headers":
+                    try:
+                        headers, end = self._decoder.raw_decode(self._buf, m.end())
+                    except json.JSONDecodeError:
+                        break  # headers list not complete yet
+                    events.append(("headers", headers))
+                    self._pos = end
+                else:
+                    if m.end() >= len(self._buf):
+                        break
+                    if self._buf[m.end()] != "[":
+                        self._state = "done"  # rows: null
+                        break
+                    self._pos = m.end() + 1
+                    self._state = "rows"
+            else:
+                pos = self._pos
+                while pos < len(self._buf) and self._buf[pos] in _SKIP:
+                    pos += 1
+                self._pos = pos
+                if pos >= len(self._buf):
+                    break
+                if self._buf[pos] == "]":
+                    self._pos = pos + 1
+                    self._state = "done"
+                    break
+                try:
+                    row, end = self._decoder.raw_decode(self._buf, pos)
+                except json.JSONDecodeError:
+                    break  # row not complete yet
+                events.append(("row", row))
+                self._pos = end
+        return events
+
+    def close(self):
+        """
+        Called at end of body. Raises if the response never contained a
+        table (e.g. GraphQL errors or ShopifyQL ParseErrors).
+        """
+        if self._state == "done":
+            return
+        if self._state == "rows":
+            raise ValueError("Shopify response ended in the middle of the rows array")
+        try:
+            body = json.loads(self._buf)
+        except json.JSONDecodeError:
+            raise ValueError("Shopify response did not contain a result table")
+        raise ValueError(f"Shopify returned no table: {body.get('errors') or body}")
+
+
+def encode_ndjson(event: str, payload: Any) -> bytes:
+    return dumps(payload) + b"\n"
+
+
+def encode_sse(event: str, payload: Any) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + dumps(payload) + b"\n\n"
@@ -0,0 +1,172 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+# Column kinds. Numeric kinds carry parsed float/int values; columns parsed
+# from strings also keep the original cells for output, since "$12,500" and
+# "$3,200.00" cannot be reproduced from the number alone.
+INT = "int"
+FLOAT = "float"
+NUMBER = "number"      # numeric strings such as "1500.00"
+CURRENCY = "currency"  # "$12,500" -> 12500.0
+PERCENT = "percent"    # "85%" -> 0.85
+TEXT = "text"
+
+NUMERIC_KINDS = (INT, FLOAT, NUMBER, CURRENCY, PERCENT)
+
+
+@dataclass
+class Column:
+    name: str
+    kind: str
+    values: np.ndarray
+    display: Optional[np.ndarray] = None  # original cells, when they differ from `values`
+
+    def cells(self) -> np.ndarray:
+        return self.display if self.display is not None else self.values
+
+
+def _parse_column(name: str, cells: Sequence[Any]) -> Column:
+    types = set(map(type, cells))
+
+    display = np.empty(len(cells), dtype=object)
+    display[:] = cells
+
+    try:
+        if types <= {int}:
+            return Column(name, INT, np.array(cells, dtype=np.int64))
+        if types <= {int, float}:
+            # Keep the original cells so integers are not re-emitted as floats
+            return Column(name, FLOAT, np.array(cells, dtype=np.float64),
+                          None if types == {float} else display)
+    except OverflowError:
+        return Column(name, TEXT, display)
+
+    if types != {str}:
+        return Column(name, TEXT, display)
+
+    text = np.char.strip(np.array(cells, dtype=str))
+    if np.char.startswith(text, "$").all():
+        kind, body, scale = CURRENCY, np.char.replace(np.char.lstrip(text, "$"), ",", ""), 1.0
+    elif np.char.endswith(text, "%").all():
+        kind, body, scale = PERCENT, np.char.rstrip(text, "%"), 0.01
+    else:
+        kind, body, scale = NUMBER, text, 1.0
+
+    try:
+        values = body.astype(np.float64) * scale
+    except ValueError:
+        return Column(name, TEXT, display)
+    return Column(name, kind, values, display)
+
+
+class ColumnarTable:
+    """
+    Typed, column-oriented form of a ShopifyQL result table.
+
+    Built once when a Shopify response (or fixture) is decoded: each column
+    becomes a NumPy array, with currency, percent and numeric-string cells
+    parsed to floats so explanations and aggregations can run as vectorized
+    column operations. to_dict() reproduces the original
+    {"headers": [...], "rows": [[...], ...]} shape for output.
+    """
+
+    def __init__(self, columns: List[Column], row_count: int):
+        self.columns = columns
+        self.row_count = row_count
+
+    @classmethod
+    def from_rows(cls, headers: Sequence[str], rows: Sequence[Sequence[Any]]) -> "ColumnarTable":
+        headers = list(headers)
+        if not rows:
+            return cls([Column(h, TEXT, np.empty(0, dtype=object)) for h in headers], 0)
+        transposed = list(zip(*rows))
+        # Tables may omit headers; name the extra columns by position
+        names = headers + [f"column_{i}" for i in range(len(headers), len(transposed))]
+        return cls([_parse_column(n, cells) for n, cells in zip(names, transposed)], len(rows))
+
+    @classmethod
+    def from_arrays(cls, headers: Sequence[str], arrays: Sequence[np.ndarray]) -> "ColumnarTable":
+        """
+        Builds a table directly from result columns (local engine output),
+        skipping cell parsing. Object arrays become text columns.
+        """
+        columns = []
+        for name, values in zip(headers, arrays):
+            values = np.asarray(values)
+            if values.dtype.kind in "iub":
+                columns.append(Column(name, INT, values.astype(np.int64, copy=False)))
+            elif values.dtype.kind == "f":
+                columns.append(Column(name, FLOAT, values))
+            else:
+                columns.append(Column(name, TEXT, values.astype(object, copy=False)))
+        return cls(columns, len(arrays[0]) if len(arrays) else 0)
+
+    @property
+    def headers(self) -> List[str]:
+        return [c.name for c in self.columns]
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def column(self, index: int) -> Column:
+        return self.columns[index]
+
+    def numeric(self, index: int) -> np.ndarray:
+        """
+        Float values of a column; raises if the column is not numeric.
+        """
+        column = self.columns[index]
+        if column.kind not in NUMERIC_KINDS:
+            raise ValueError(f"Column '{column.name}' is not numeric")
+        return column.values.astype(np.float64, copy=False)
+
+    def cell(self, row: int, index: int) -> Any:
+        value = self.columns[index].cells()[row]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def row(self, row: int) -> List[Any]:
+        return [self.cell(row, i) for i in range(len(self.columns))]
+
+    def to_rows(self) -> List[List[Any]]:
+        if not self.row_count:
+            return []
+        return [list(r) for r in zip(*(c.cells().tolist() for c in self.columns))]
+
+    def iter_rows(self, chunk: int = 1000) -> Iterator[List[Any]]:
+        for start in range(0, self.row_count, chunk):
+            stop = min(start + chunk, self.row_count)
+            columns = [c.cells()[start:stop].tolist() for c in self.columns]
+            for r in zip(*columns):
+                yield list(r)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"headers": self.headers, "rows": self.to_rows()}
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate in-memory size, used for cache accounting.
+        """
+        size = 0
+        for c in self.columns:
+            if c.values.dtype != object:
+                size += c.values.nbytes
+            if c.display is not None or c.values.dtype == object:
+                size += sum(len(str(v)) for v in c.cells())
+        return size
+
+
+def decode_result(payload: Dict[str, Any]) -> Optional[ColumnarTable]:
+    """
+    Extracts the result table from a shopifyqlQuery response (or a fixture
+    payload). Returns None when the response carries errors instead.
+    """
+    if not payload or "errors" in payload:
+        return None
+    inner = payload.get("data") or {}
+    table = inner.get("table") or inner.get("shopifyqlQuery")
+    if not table or table.get("errors"):
+        return None
+    return ColumnarTable.from_rows(table.get("headers") or [], table.get("rows") or [])
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+from resilience import Deadline
+
+
+def controller(**limits):
+    options = dict(max_concurrent=2, per_shop=1, max_queued=4, per_shop_queued=2, queue_timeout=1.0)
+    options.update(limits)
+    return AdmissionController(**options)
+
+
+def test_admits_up_to_the_limits():
+    async def scenario():
+        admission = controller()
+        first = await admission.acquire("a.myshopify.com", Deadline())
+        second = await admission.acquire("b.myshopify.com", Deadline())
+        assert admission.active == 2
+        first.release()
+        first.release()  # a second release is a no-op
+        second.release()
+        assert admission.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_shop_queue_full_is_429():
+    async def scenario():
+        admission = controller(per_shop_queued=1)
+        await admission.acquire("a.myshopify.com", Deadline())
+        waiter = asyncio.ensure_future(admission.acquire("a.myshopify.com", Deadline()))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as shed:
+            await admission.acquire("a.myshopify.com", Deadline())
+        assert (shed.value.reason, shed.value.status_code) == ("shop_queue_full", 429)
+        waiter.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_queue_full_is_503():
+    async def scenario():
+        admission = controller(max_concurrent=1, max_queued=1)
+        await admission.acquire("a.myshopify.com", Deadline())
+        waiter = asyncio.ensure_future(admission.acquire("b.myshopify.com", Deadline()))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as shed:
+            await admission.acquire("c.myshopify.com", Deadline())
+        assert (shed.value.reason, shed.value.status_code) == ("queue_full", 503)
+        assert shed.value.retry_after >= 1
+        waiter.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_is_503_and_leaves_the_queue():
+    async def scenario():
+        admission = controller(queue_timeout=0.05)
+        await admission.acquire("a.myshopify.com", Deadline())
+        with pytest.raises(Overloaded) as shed:
+            await admission.acquire("a.myshopify.com", Deadline())
+        assert (shed.value.reason, shed.value.status_code) == ("queue_timeout", 503)
+        assert admission.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_freed_slots_rotate_between_shops():
+    async def scenario():
+        admission = controller(max_concurrent=1, per_shop=1, per_shop_queued=3, max_queued=10)
+        order = []
+
+        async def request(shop, tag):
+            slot = await admission.acquire(shop, Deadline())
+            order.append(tag)
+            await asyncio.sleep(0)
+            slot.release()
+
+        held = await admission.acquire("busy.myshopify.com", Deadline())
+        # A burst from shop a queues ahead of shop b's single request
+        tasks = [asyncio.ensure_future(request("a.myshopify.com", f"a{i}")) for i in range(3)]
+        tasks.append(asyncio.ensure_future(request("b.myshopify.com", "b0")))
+        await asyncio.sleep(0)
+        held.release()
+        await asyncio.gather(*tasks)
+        assert order == ["a0", "b0", "a1", "a2"]
+
+    asyncio.run(scenario())
+
+
+def test_requests_without_upstream_work_bypass_the_limits():
+    async def scenario():
+        admission = controller(max_concurrent=1, max_queued=0)
+        await admission.acquire("a.myshopify.com", Deadline())
+        slot = await admission.acquire("a.myshopify.com", Deadline(), upstream=False)
+        slot.release()
+        assert admission.active == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_take_a_slot():
+    async def scenario():
+        admission = controller(max_concurrent=1)
+        held = await admission.acquire("a.myshopify.com", Deadline())
+        waiter = asyncio.ensure_future(admission.acquire("a.myshopify.com", Deadline()))
+        await asyncio.sleep(0)
+        # The client goes away and the slot frees up before the waiter runs again
+        waiter.cancel()
+        held.release()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert (admission.active, admission.queued) == (0, 0)
+        slot = await admission.acquire("b.myshopify.com", Deadline())
+        slot.release()
+
+    asyncio.run(scenario())
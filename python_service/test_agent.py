@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from agent import ShopifyAgent
+from cache import result_cache
+from intents import matcher
+from local_engine import local_engine
+from serialization import Payload
+from shopify_client import verified_tokens
+from table import ColumnarTable
+
+SHOP = "agent-test.myshopify.com"
+QUESTION = "Which country do my orders come from?"
+
+
+@pytest.fixture
+def cached_answer(monkeypatch):
+    calls = []
+
+    async def upstream(agent, query):
+        calls.append(agent.access_token)
+        raise PermissionError("401 Unauthorized")
+
+    monkeypatch.setattr(ShopifyAgent, "_execute_shopify_ql", upstream)
+    match = matcher.classify(QUESTION)
+    table = ColumnarTable.from_rows(["billing_address_country", "total_sales"], [["US", 100.0]])
+    result_cache.put(SHOP, match.shopify_ql, table, ttl=60, size=table.nbytes)
+    verified_tokens.accepted(SHOP, "good-token")
+    yield calls
+    result_cache.invalidate_local(SHOP, [match.shopify_ql.split()[1]])
+
+
+def test_verified_token_is_served_from_cache(cached_answer):
+    agent = ShopifyAgent(SHOP, "good-token")
+    assert not agent.needs_upstream([QUESTION])
+    result = asyncio.run(agent.process_question(QUESTION))
+    assert result["cached"] and cached_answer == []
+
+
+def test_unverified_token_goes_to_shopify(cached_answer):
+    agent = ShopifyAgent(SHOP, "any-token")
+    assert agent.needs_upstream([QUESTION])
+    assert agent.answer_without_upstream(QUESTION, max_stale=3600) is None
+    result = asyncio.run(agent.process_question(QUESTION))
+    assert not result["cached"]
+    assert cached_answer == ["any-token"]
+
+
+def test_rejected_token_is_forgotten():
+    verified_tokens.accepted(SHOP, "revoked-token")
+    assert verified_tokens.verified(SHOP, "revoked-token")
+    verified_tokens.rejected(SHOP, "revoked-token")
+    assert not verified_tokens.verified(SHOP, "revoked-token")
+    assert not verified_tokens.verified(SHOP, "")
+
+
+def test_failed_local_query_goes_to_shopify(monkeypatch):
+    local_table = ColumnarTable.from_rows(["day", "total_sales"], [["2024-03-01", 5.0]])
+
+    def execute(shop_domain, query):
+        if "broken" in query:
+            raise FileNotFoundError("snapshot version removed")
+        return local_table
+
+    async def remote(agent, queries):
+        return [{"remote": query} for query in queries]
+
+    monkeypatch.setattr(local_engine, "can_execute", lambda shop_domain, query: True)
+    monkeypatch.setattr(local_engine, "execute", execute)
+    monkeypatch.setattr(ShopifyAgent, "_execute_remote", remote)
+    agent = ShopifyAgent(SHOP, "good-token")
+    agent.trusted = True
+    results = asyncio.run(agent._execute_many(["FROM orders ok", "FROM orders broken"]))
+    assert results == [local_table, {"remote": "FROM orders broken"}]
+
+
+def test_compound_results_are_merged_in_the_order_asked():
+    plan = matcher.classify_all("Show sales and inventory")
+    table = {"headers": ["day", "daily_sales"], "rows": [["2024-03-01", 10.0]]}
+    parts = [
+        {"answer": "Sales are up.", "shopify_ql": plan[0].shopify_ql, "confidence": "high",
+         "cached": True, "cache_age": 5.0, "data_json": Payload.of({"data": {"table": table}})},
+        {"answer": "Inventory is unavailable.", "shopify_ql": plan[1].shopify_ql, "confidence": "low",
+         "cached": False, "cache_age": None, "data": {"errors": [{"message": "Throttled"}]}},
+    ]
+    merged = ShopifyAgent._merge_results(plan, parts)
+    assert merged["answer"] == "Sales are up. Inventory is unavailable."
+    assert merged["shopify_ql"] == f"{plan[0].shopify_ql}\n{plan[1].shopify_ql}"
+    assert merged["data"]["data"]["table"] == table
+    assert merged["data"]["data"]["tables"] == [
+        {"intent": "sales", "shopify_ql": plan[0].shopify_ql, "table": table},
+        {"intent": "inventory", "shopify_ql": plan[1].shopify_ql, "errors": [{"message": "Throttled"}]},
+    ]
+    # The weakest part decides the confidence, freshness and cache flags
+    assert (merged["confidence"], merged["cached"], merged["cache_age"]) == ("low", False, None)
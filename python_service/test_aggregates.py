@@ -0,0 +1,68 @@
+import asyncio
+import datetime
+
+import numpy as np
+
+from aggregates import AggregateStore, ShopAggregates
+from local_engine import SnapshotStore
+
+TODAY = datetime.date(2024, 3, 10)
+
+
+def order(created_at, total, *codes):
+    return {"created_at": created_at, "total_price": str(total),
+            "discount_codes": [{"code": code} for code in codes]}
+
+
+def test_discount_usage_sums_the_window():
+    shop = ShopAggregates(today=TODAY)
+    shop.add_order(order("2024-03-09T12:00:00Z", 10, "SPRING"))
+    shop.add_order(order("2024-02-20T12:00:00Z", 5, "SPRING", "VIP"))
+    shop.add_order(order("2024-01-01T12:00:00Z", 7, "SPRING"))  # before the window
+    assert shop.discount_usage().to_rows() == [["SPRING", 2, 15.0], ["VIP", 1, 5.0]]
+
+
+def test_orders_dated_after_the_servers_today_are_counted():
+    shop = ShopAggregates(today=TODAY)
+    # Already the 11th in Tokyo while the server is still on the 10th
+    shop.add_order(order("2024-03-11T08:00:00+09:00", 10, "SPRING"))
+    assert shop.discount_usage().to_rows() == [["SPRING", 1, 10.0]]
+    assert shop.daily_sales().to_rows()[-1] == ["2024-03-11", 10.0]
+
+    shop.roll(TODAY + datetime.timedelta(days=1))
+    assert shop.discount_usage().to_rows() == [["SPRING", 1, 10.0]]
+
+
+def test_roll_moves_days_out_of_the_window():
+    shop = ShopAggregates(today=TODAY)
+    shop.add_order(order("2024-02-09T12:00:00Z", 5, "SPRING"))
+    shop.add_order(order("2024-03-01T12:00:00Z", 10, "SPRING"))
+    shop.roll(TODAY + datetime.timedelta(days=1))
+    assert shop.discount_usage().to_rows() == [["SPRING", 1, 10.0]]
+    assert len(shop.daily_sales()) == 31
+
+
+def test_seeding_runs_off_the_loop_and_keeps_webhooks(tmp_path):
+    shop_domain = "seed-test.myshopify.com"
+    store = SnapshotStore(str(tmp_path))
+    now = np.datetime64(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None), "s")
+    store.write_table(shop_domain, "orders", {
+        "timestamp": np.array([now - np.timedelta64(3, "D")]),
+        "total_price": [20.0], "discount_code": ["SPRING"], "billing_address_country": ["US"],
+    }, time_column="timestamp")
+    store.write_table(shop_domain, "sales", {"product_title": ["Mug"], "net_quantity": [2], "total_sales": [20.0]})
+
+    async def scenario():
+        aggregates = AggregateStore(store, backend="local")
+        aggregates._stream_since = lambda: 0.0  # the snapshot is newer than the webhook stream
+        assert not aggregates.answers(shop_domain, "discounts")
+        seeding = aggregates.seeding(shop_domain)
+        assert seeding is not None
+        # A webhook arriving meanwhile is carried over to the seeded aggregates
+        await aggregates.apply(shop_domain, "orders/create",
+                               order(datetime.datetime.now(datetime.timezone.utc).isoformat(), 5, "SPRING"))
+        await seeding
+        assert aggregates.answers(shop_domain, "discounts")
+        assert aggregates.answer(shop_domain, "discounts", {}).to_rows() == [["SPRING", 2, 25.0]]
+
+    asyncio.run(scenario())
@@ -0,0 +1,88 @@
+import copy
+
+import numpy as np
+import pytest
+
+import forecasting
+from forecasting import Forecaster, _smooth, daily_matrix, fit, forecast, parse_horizon
+
+WEEK = np.array([10.0, 12.0, 14.0, 16.0, 18.0, 30.0, 40.0])
+
+
+def weekly(days, products=2):
+    # Product i sells (i + 1) times the weekly pattern
+    return np.stack([np.resize(WEEK, days) * (i + 1) for i in range(products)])
+
+
+def test_fit_recovers_a_weekly_pattern():
+    state = fit(weekly(70))
+    total, confidence = forecast(state, 7)
+    assert total == pytest.approx([WEEK.sum(), 2 * WEEK.sum()], rel=0.05)
+    assert (confidence > 0.9).all()
+
+
+def test_short_history_forecasts_the_mean():
+    state = fit(np.array([[2.0, 4.0, 6.0]]))
+    total, _ = forecast(state, 10)
+    assert total == pytest.approx([40.0])
+
+
+def test_forecast_is_never_negative():
+    history = np.concatenate([np.full((1, 14), 50.0), np.zeros((1, 14))], axis=1)
+    total, _ = forecast(fit(history), 30)
+    assert total[0] >= 0.0
+
+
+def test_incremental_update_matches_smoothing_the_new_days():
+    products = np.array(["A", "B"])
+    data = weekly(130)
+    history = lambda first, last: data[:, first:last + 1]
+    forecaster = Forecaster()
+    model = forecaster.model(("shop",), products, 119, history)
+    expected = _smooth(data[:, 120:123], copy.deepcopy(model.state))
+
+    model = forecaster.model(("shop",), products, 122, history)
+    assert (forecaster.fits, forecaster.updates) == (1, 1)
+    assert model.last_day == 122
+    np.testing.assert_allclose(model.state.level, expected.level)
+    np.testing.assert_allclose(model.state.season, expected.season)
+    assert model.state.days == expected.days
+
+    # Nothing new: the model is returned as is
+    assert forecaster.model(("shop",), products, 122, history) is model
+    assert forecaster.updates == 1
+
+
+def test_refit_after_refit_days_or_a_catalog_change(monkeypatch):
+    monkeypatch.setattr(forecasting, "FORECAST_HISTORY_DAYS", 28)
+    data = weekly(60, products=3)
+    history = lambda first, last: data[:len(products), first:last + 1]
+    forecaster = Forecaster()
+
+    products = np.array(["A", "B"])
+    forecaster.model(("shop",), products, 30, history)
+    forecaster.model(("shop",), products, 30 + forecasting.FORECAST_REFIT_DAYS, history)
+    assert (forecaster.fits, forecaster.updates) == (2, 0)
+
+    products = np.array(["A", "B", "C"])
+    model = forecaster.model(("shop",), products, 38, history)
+    assert (forecaster.fits, forecaster.updates) == (3, 0)
+    assert model.fitted_day == 38
+
+
+def test_daily_matrix_sums_per_product_and_day():
+    codes = np.array([0, 1, 0, 0, 1])
+    days = np.array([10, 10, 10, 12, 20])
+    quantities = np.array([1, 2, 3, 4, 5])
+    matrix = daily_matrix(codes, days, quantities, 2, 10, 12)
+    # The row on day 20 is outside the range
+    assert matrix.tolist() == [[4.0, 0.0, 4.0], [2.0, 0.0, 0.0]]
+
+
+def test_parse_horizon():
+    assert parse_horizon("30d") == 30
+    assert parse_horizon(" 2W ") == 14
+    assert parse_horizon("1m") == 30
+    for spec in ("m", "3y", "-1d", ""):
+        with pytest.raises(ValueError):
+            parse_horizon(spec)
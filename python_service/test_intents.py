@@ -0,0 +1,28 @@
+from intents import matcher
+
+
+def intents(question):
+    return [match.id for match in matcher.classify_all(question)]
+
+
+def test_compound_question_is_split_in_the_order_asked():
+    assert intents("Show sales and inventory and top products") == ["sales", "inventory", "top_selling"]
+    assert intents("Top 5 products & sales last 30 days") == ["top_selling", "sales"]
+
+
+def test_each_clause_keeps_its_own_parameters():
+    top, sales = matcher.classify_all("Top 5 products & sales last 30 days")
+    assert top.params["limit"] == "5"
+    assert top.shopify_ql.endswith("LIMIT 5 #top_selling")
+    assert "limit" not in sales.params
+
+
+def test_repeated_queries_are_asked_once():
+    assert intents("What are my sales and how are sales") == ["sales"]
+
+
+def test_fewer_than_two_intents_classify_the_whole_question():
+    # "hello" is not an intent, so this is the single match for the whole question
+    assert matcher.classify_all("sales plus hello") == [matcher.classify("sales plus hello")]
+    assert intents("hello and goodbye") == ["fallback"]
+    assert intents("Which country do my orders come from?") == ["geography"]
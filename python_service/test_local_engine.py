@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from local_engine import LocalEngine, SnapshotStore
+
+SHOP = "test-shop.myshopify.com"
+
+
+@pytest.fixture
+def store(tmp_path):
+    # Snapshot timestamps are UTC, like the engine's today
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    store = SnapshotStore(str(tmp_path))
+    store.write_table(SHOP, "orders", {
+        "timestamp": np.array([now, now, now - timedelta(days=1), now - timedelta(days=2),
+                               now - timedelta(days=60)], dtype="datetime64[s]"),
+        "total_price": [4.0, 6.0, 5.0, 20.0, 100.0],
+        "discount_code": ["A", "A", "B", "", "A"],
+        "billing_address_country": ["US", "CA", "US", "US", "CA"],
+    }, time_column="timestamp")
+    return store
+
+
+def run(store, query):
+    return LocalEngine(store, backend="local").execute(SHOP, query)
+
+
+def test_group_by_sums_and_counts(store):
+    table = run(store, "FROM orders SHOW sum(total_price) AS total_sales, count() AS order_count "
+                       "BY billing_address_country ORDER BY total_sales DESC")
+    assert table.headers == ["billing_address_country", "total_sales", "order_count"]
+    assert table.to_rows() == [["CA", 106.0, 2], ["US", 29.0, 3]]
+
+
+def test_since_drops_older_rows_and_blank_groups(store):
+    table = run(store, "FROM orders SHOW count() AS usages, sum(total_price) AS revenue_generated "
+                       "BY discount_code SINCE -30d UNTIL today ORDER BY revenue_generated DESC")
+    assert table.to_rows() == [["A", 2, 10.0], ["B", 1, 5.0]]
+
+
+def test_where_on_a_raw_column(store):
+    table = run(store, 'FROM orders SHOW sum(total_price) AS total_sales BY discount_code '
+                       'WHERE billing_address_country = "US" ORDER BY total_sales ASC')
+    # The US order without a discount code is left out of the groups
+    assert table.to_rows() == [["A", 4.0], ["B", 5.0]]
+
+
+def test_where_on_an_aggregate(store):
+    table = run(store, "FROM orders SHOW count() AS orders_count BY billing_address_country "
+                       "WHERE orders_count > 1 SINCE -30d UNTIL today")
+    assert table.to_rows() == [["US", 3]]
+
+
+def test_order_by_with_limit(store):
+    table = run(store, "FROM orders SHOW sum(total_price) AS total_sales BY discount_code "
+                       "ORDER BY total_sales DESC LIMIT 1")
+    assert table.to_rows() == [["A", 110.0]]
+
+
+def test_rewrite_is_picked_up(store):
+    engine = LocalEngine(store, backend="local")
+    query = "FROM orders SHOW sum(total_price) AS total_sales BY billing_address_country"
+    engine.execute(SHOP, query)
+    store.write_table(SHOP, "orders", {"total_price": [1.0], "billing_address_country": ["FR"]})
+    assert engine.execute(SHOP, query).to_rows() == [["FR", 1.0]]
+
+
+def test_only_the_local_backend_executes(store):
+    query = "FROM orders SHOW sum(total_price) AS total_sales BY billing_address_country"
+    assert LocalEngine(store, backend="local").can_execute(SHOP, query)
+    assert not LocalEngine(store, backend="graphql").can_execute(SHOP, query)
+    assert not LocalEngine(store, backend="local").can_execute(SHOP, query.replace("orders", "visits"))
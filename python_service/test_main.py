@@ -0,0 +1,61 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import agent
+import main
+from intents import matcher
+from shopify_client import verified_tokens
+
+SALES = "Show me the sales for the last 30 days"
+GEOGRAPHY = "Which country do my orders come from?"
+TOP = "What are my top selling products?"
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    requests = []
+
+    async def execute_batch(shop_domain, access_token, queries, timeout=10.0, priority=0):
+        requests.append(list(queries))
+        return [{"data": {"shopifyqlQuery": {"__typename": "TableResponse", "headers": ["query"],
+                                             "rows": [[query]]}}} for query in queries]
+
+    async def execute(shop_domain, access_token, query, timeout=10.0, priority=0):
+        return (await execute_batch(shop_domain, access_token, [query]))[0]
+
+    monkeypatch.setattr(agent, "execute_shopify_ql_batch", execute_batch)
+    monkeypatch.setattr(agent, "execute_shopify_ql", execute)
+    return requests
+
+
+def analyze_batch(shop, queries, token):
+    client = TestClient(main.app)
+    return client.post("/analyze/batch", json={"queries": queries, "shop_domain": shop, "access_token": token})
+
+
+def test_batch_sends_each_distinct_query_once_and_answers_in_order(upstream):
+    response = analyze_batch("batch-order.myshopify.com", [SALES, GEOGRAPHY, SALES, TOP], "token")
+    assert response.status_code == 200
+    results = response.json()["results"]
+    expected = [matcher.classify(q).shopify_ql for q in (SALES, GEOGRAPHY, SALES, TOP)]
+    assert [r["shopify_ql"] for r in results] == expected
+    assert [r["data"]["data"]["table"]["rows"] for r in results] == [[[q]] for q in expected]
+    # One aliased request for the three distinct queries
+    assert upstream == [[expected[0], expected[1], expected[3]]]
+
+
+def test_batch_answers_cached_queries_without_resending(upstream):
+    shop = "batch-cached.myshopify.com"
+    verified_tokens.accepted(shop, "token")
+    analyze_batch(shop, [GEOGRAPHY], "token")
+    upstream.clear()
+    response = analyze_batch(shop, [GEOGRAPHY, TOP], "token")
+    results = response.json()["results"]
+    assert [r["cached"] for r in results] == [True, False]
+    assert upstream == [[matcher.classify(TOP).shopify_ql]]
+
+
+def test_batch_size_is_limited(upstream):
+    response = analyze_batch("batch-limit.myshopify.com", [SALES] * (main.MAX_BATCH_QUERIES + 1), "token")
+    assert response.status_code == 400
+    assert upstream == []
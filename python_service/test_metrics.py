@@ -0,0 +1,32 @@
+from metrics import Counter, Histogram, render, state
+from shared_store import SharedStore
+
+
+def test_counter_sums_worker_states():
+    counter = Counter("requests_total", "Requests.", ("status",))
+    one = [[["200"], 3.0], [["500"], 1.0]]
+    two = [[["200"], 2.0]]
+    assert counter.collect([one, two])[2:] == ['requests_total{status="200"} 5', 'requests_total{status="500"} 1']
+
+
+def test_histogram_sums_worker_states():
+    histogram = Histogram("latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="execute")
+    other = [[["execute"], [0, 2, 1], 3.5]]
+    lines = histogram.collect([histogram.state(), other])
+    assert 'latency_seconds_bucket{stage="execute",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{stage="execute",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{stage="execute",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{stage="execute"} 4' in lines
+
+
+def test_scrape_covers_every_worker(tmp_path):
+    path = str(tmp_path / "shared.db")
+    worker_a, worker_b = SharedStore(path), SharedStore(path)
+    worker_a.put_metrics(state())
+    worker_b._db()
+    worker_b._worker = "other"  # as if in a second process
+    worker_b.put_metrics({"analyze_questions_total": [[["sales", "cache"], 7.0]]})
+    states = worker_a.all_metrics()
+    assert len(states) == 2
+    assert 'analyze_questions_total{intent="sales",source="cache"} 7' in render(states)
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import prewarm
+from admission import admission
+from cache import ResultCache, normalize_query
+from intents import matcher
+from prewarm import Prewarmer
+from resilience import OPEN, breakers
+
+SHOP = "prewarm-test.myshopify.com"
+TOKEN = "shpat_test"
+TOP_SELLING = matcher.classify("What are my top selling products?")
+SALES = matcher.classify("How were my sales this month?")
+COUNTRIES = matcher.classify("Which country do my orders come from?")
+
+
+def asked(prewarmer, match, times, shop=SHOP):
+    for _ in range(times):
+        prewarmer.record(shop, TOKEN, match)
+
+
+def due_queries(prewarmer, now=None):
+    work = prewarmer.due(time.monotonic() if now is None else now)
+    return {domain: [p.match.id for p in stale] for domain, _, stale in work}
+
+
+def test_only_repeated_questions_are_kept_warm():
+    prewarmer = Prewarmer(ResultCache(), interval=30)
+    asked(prewarmer, TOP_SELLING, 2)
+    asked(prewarmer, SALES, 1)
+    asked(prewarmer, matcher.classify("hello there"), 5)  # fallback answers are never warmed
+    prewarmer.record("other.myshopify.com", "", SALES)  # nor anything without a token
+    assert due_queries(prewarmer) == {SHOP: ["top_selling"]}
+
+
+def test_top_k_most_asked_queries_are_selected():
+    prewarmer = Prewarmer(ResultCache(), interval=30, top_k=2)
+    asked(prewarmer, TOP_SELLING, 2)
+    asked(prewarmer, SALES, 4)
+    asked(prewarmer, COUNTRIES, 3)
+    assert due_queries(prewarmer) == {SHOP: ["sales", "geography"]}
+
+
+def test_results_that_stay_fresh_past_the_next_pass_are_skipped():
+    cache = ResultCache()
+    prewarmer = Prewarmer(cache, interval=30)
+    asked(prewarmer, TOP_SELLING, 2)
+    asked(prewarmer, SALES, 2)
+    cache.put(SHOP, TOP_SELLING.shopify_ql, {"rows": []}, ttl=600)
+    cache.put(SHOP, SALES.shopify_ql, {"rows": []}, ttl=45)  # expires before the pass after next
+    assert due_queries(prewarmer) == {SHOP: ["sales"]}
+
+
+def test_idle_shops_and_open_circuits_are_skipped(monkeypatch):
+    prewarmer = Prewarmer(ResultCache(), interval=30)
+    asked(prewarmer, TOP_SELLING, 2)
+    asked(prewarmer, TOP_SELLING, 2, shop="broken.myshopify.com")
+    monkeypatch.setattr(breakers.get("broken.myshopify.com"), "state", OPEN)
+    assert due_queries(prewarmer) == {SHOP: ["top_selling"]}
+    # Two days later the shop is forgotten along with its token
+    assert due_queries(prewarmer, time.monotonic() + prewarm.PREWARM_FORGET_AFTER + 1) == {}
+    assert SHOP not in prewarmer.stats()["shops"]
+
+
+def test_failures_back_off_exponentially():
+    prewarmer = Prewarmer(ResultCache(), interval=30)
+    asked(prewarmer, TOP_SELLING, 3)
+    asked(prewarmer, SALES, 2)
+    calls = []
+
+    async def refresh(shop, token, matches):
+        calls.append((shop, token, [m.id for m in matches]))
+        return [RuntimeError("throttled") if m.id == "sales" else None for m in matches]
+
+    asyncio.run(prewarmer.run_once(refresh))
+    assert calls == [(SHOP, TOKEN, ["top_selling", "sales"])]
+    assert (prewarmer.refreshed, prewarmer.failed) == (1, 1)
+    popularity = prewarmer._shops[SHOP].queries[normalize_query(SALES.shopify_ql)]
+    first_retry = popularity.retry_at - time.monotonic()
+    assert 50 < first_retry <= 60  # interval * 2
+
+    # Not retried before its backoff has passed; retried (and doubled) after
+    assert "sales" not in due_queries(prewarmer).get(SHOP, [])
+    later = popularity.retry_at + 1
+    assert "sales" in due_queries(prewarmer, later)[SHOP]
+    popularity.retry_at = 0.0
+    asyncio.run(prewarmer.run_once(refresh))
+    assert popularity.failures == 2
+    assert 110 < popularity.retry_at - time.monotonic() <= 120
+
+
+def test_a_refresh_that_raises_fails_every_query():
+    prewarmer = Prewarmer(ResultCache(), interval=30)
+    asked(prewarmer, TOP_SELLING, 2)
+    asked(prewarmer, SALES, 2)
+
+    async def refresh(shop, token, matches):
+        raise ConnectionError("down")
+
+    asyncio.run(prewarmer.run_once(refresh))
+    assert (prewarmer.refreshed, prewarmer.failed) == (0, 2)
+    assert due_queries(prewarmer) == {}
+
+
+def test_passes_are_skipped_while_requests_queue(monkeypatch):
+    prewarmer = Prewarmer(ResultCache(), interval=30)
+    asked(prewarmer, TOP_SELLING, 2)
+    monkeypatch.setattr(admission, "queued", 3)
+
+    async def refresh(shop, token, matches):
+        raise AssertionError("no refresh while busy")
+
+    asyncio.run(prewarmer.run_once(refresh))
+    assert (prewarmer.passes, prewarmer.skipped_busy) == (1, 1)
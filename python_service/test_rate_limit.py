@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from rate_limit import BACKGROUND, BACKGROUND_RESERVE, INTERACTIVE, ShopBucket, is_throttled
+
+
+def test_acquire_reserves_cost_until_released():
+    async def scenario():
+        bucket = ShopBucket(capacity=100, restore_rate=1, query_cost=10)
+        await bucket.acquire(30)
+        assert bucket.in_flight == 30
+        assert bucket.available == pytest.approx(70, abs=0.1)
+        bucket.release(30)
+        assert bucket.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_interactive_waiters_go_before_background_ones():
+    async def scenario():
+        bucket = ShopBucket(capacity=100, restore_rate=1000)
+        bucket.available = 0.0
+        order = []
+
+        async def request(name, priority):
+            await bucket.acquire(50, priority)
+            order.append(name)
+
+        background = asyncio.ensure_future(request("background", BACKGROUND))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(request("interactive", INTERACTIVE))
+        await asyncio.gather(background, interactive)
+        assert order == ["interactive", "background"]
+
+    asyncio.run(scenario())
+
+
+def test_background_work_leaves_a_reserve():
+    bucket = ShopBucket(capacity=100, restore_rate=1)
+    bucket.available = 100 * BACKGROUND_RESERVE + 5
+    assert bucket._fits(10, INTERACTIVE)
+    assert not bucket._fits(10, BACKGROUND)
+
+
+def test_release_resyncs_with_throttle_status():
+    bucket = ShopBucket(capacity=1000, restore_rate=50, query_cost=10)
+    bucket.in_flight = 40
+    bucket.release(20, {"cost": {"requestedQueryCost": 90, "throttleStatus": {
+        "maximumAvailable": 2000.0, "currentlyAvailable": 1500.0, "restoreRate": 100.0}}}, queries=3)
+    assert (bucket.capacity, bucket.restore_rate) == (2000.0, 100.0)
+    # Shopify's figure leaves out the 20 points still in flight
+    assert bucket.available == 1480.0
+    assert bucket.query_cost == 30.0
+
+
+def test_drain_and_throttle_detection():
+    bucket = ShopBucket(capacity=100)
+    bucket.drain()
+    assert bucket.available <= 0
+    assert is_throttled({"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}]})
+    assert not is_throttled({"errors": [{"message": "Invalid"}]})
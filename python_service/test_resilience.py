@@ -0,0 +1,66 @@
+import pytest
+
+from rate_limit import ShopifyThrottled
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, Deadline, DeadlineExceeded
+
+
+def fail(breaker, error=RuntimeError("boom"), neutral=()):
+    with pytest.raises(type(error)):
+        with breaker.guard(neutral=neutral):
+            raise error
+
+
+def test_opens_at_the_failure_rate_once_enough_calls_are_seen():
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=4, cooldown=60)
+    for _ in range(3):
+        fail(breaker)
+    assert breaker.state == CLOSED  # too few calls to judge
+    with breaker.guard():
+        pass
+    assert breaker.state == CLOSED  # a success never opens the circuit
+    fail(breaker)
+    assert breaker.state == OPEN
+
+
+def test_open_circuit_fails_fast():
+    breaker = CircuitBreaker(failure_rate=0.5, window=2, min_calls=2, cooldown=60)
+    fail(breaker)
+    fail(breaker)
+    ran = []
+    with pytest.raises(CircuitOpen):
+        with breaker.guard():
+            ran.append(True)
+    assert ran == [] and breaker.rejected == 1
+
+
+def test_half_open_probe_closes_or_reopens():
+    breaker = CircuitBreaker(failure_rate=0.5, window=2, min_calls=2, cooldown=0)
+    fail(breaker)
+    fail(breaker)
+    assert breaker.state == OPEN
+    # Cooldown over: a single probe goes through
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    with breaker.guard():
+        pass
+    assert breaker.state == CLOSED and breaker.stats()["calls"] == 1
+
+
+def test_neutral_errors_are_not_held_against_the_shop():
+    breaker = CircuitBreaker(failure_rate=0.5, window=2, min_calls=2, cooldown=60)
+    for _ in range(3):
+        fail(breaker, ShopifyThrottled("throttled"), neutral=(ShopifyThrottled,))
+    assert breaker.state == CLOSED and breaker.stats()["calls"] == 0
+
+
+def test_deadline_caps_timeouts_and_expires():
+    deadline = Deadline(5)
+    assert deadline.timeout(cap=2) == 2
+    assert 4 < deadline.timeout(cap=10) <= 5
+    expired = Deadline(0)
+    assert expired.expired
+    with pytest.raises(DeadlineExceeded):
+        expired.timeout()
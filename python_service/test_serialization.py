@@ -0,0 +1,70 @@
+import gzip
+
+import numpy as np
+
+import serialization
+from serialization import Payload, accepted_encodings, dumps, encode_body, loads
+
+TABLE = {"headers": ["product_title", "total_sold"],
+         "rows": [[f"Product {i} – “quoted”", i * 3] for i in range(200)]}
+
+
+def chunks():
+    payload = Payload.of(TABLE)
+    return [b'{"results":[{"intent":"top_selling","data":', payload,
+            b'},{"intent":"sales","data":', payload, b"}]}"]
+
+
+def plain(parts):
+    return b"".join(c.raw if isinstance(c, Payload) else c for c in parts)
+
+
+def test_gzip_splice_decodes_to_the_plain_body():
+    parts = chunks()
+    body, encoding = encode_body(parts, frozenset({"gzip"}))
+    assert encoding == "gzip"
+    assert gzip.decompress(body) == plain(parts)
+    assert loads(gzip.decompress(body))["results"][1]["data"] == TABLE
+
+
+def test_payload_deflate_is_reused():
+    payload = Payload.of(TABLE)
+    first = payload.deflated()
+    body, _ = encode_body([b"[", payload, b",", payload, b"]"], frozenset({"gzip"}))
+    assert payload.deflated() is first
+    assert loads(gzip.decompress(body)) == [TABLE, TABLE]
+
+
+def test_plain_chunks_only():
+    parts = [dumps(TABLE), b"\n", dumps(TABLE)]
+    body, encoding = encode_body(parts, frozenset({"gzip"}))
+    assert encoding == "gzip"
+    assert gzip.decompress(body) == b"".join(parts)
+
+
+def test_small_or_unaccepted_bodies_stay_plain():
+    small = [b'{"data":', Payload.of([1, 2]), b"}"]
+    assert encode_body(small, frozenset({"gzip"})) == (b'{"data":[1,2]}', None)
+    parts = chunks()
+    assert encode_body(parts) == (plain(parts), None)
+
+
+def test_brotli_when_preferred():
+    if serialization.brotli is None:
+        return
+    parts = [dumps(TABLE)]
+    body, encoding = encode_body(parts, frozenset({"br", "gzip"}))
+    assert encoding == "br"
+    assert serialization.brotli.decompress(body) == parts[0]
+
+
+def test_accepted_encodings():
+    assert accepted_encodings(None) == frozenset()
+    assert accepted_encodings("gzip, deflate") == frozenset({"gzip"})
+    assert accepted_encodings("gzip;q=0, *") == (frozenset({"br"}) if serialization.brotli else frozenset())
+    assert "gzip" in accepted_encodings("*")
+
+
+def test_dumps_numpy_round_trip():
+    value = {"count": np.int64(3), "share": np.float64(0.5), "rows": np.array([1, 2, 3])}
+    assert loads(dumps(value)) == {"count": 3, "share": 0.5, "rows": [1, 2, 3]}
@@ -0,0 +1,90 @@
+import asyncio
+
+import shopify_client
+from shopify_client import build_batch_document, execute_shopify_ql_batch
+
+
+def table(rows):
+    return {"__typename": "TableResponse", "headers": ["n"], "rows": rows}
+
+
+def batch(monkeypatch, body, queries):
+    sent = []
+
+    async def post(shop_domain, access_token, payload, timeout, queries=1, priority=0):
+        sent.append((payload, queries))
+        return body
+
+    monkeypatch.setattr(shopify_client, "_post_graphql", post)
+    results = asyncio.run(execute_shopify_ql_batch("batch.myshopify.com", "token", queries))
+    return sent, results
+
+
+def test_batch_document_aliases_every_query():
+    document = build_batch_document(2)
+    assert "query($q0: String!, $q1: String!)" in document
+    assert "q0: shopifyqlQuery(query: $q0)" in document and "q1: shopifyqlQuery(query: $q1)" in document
+
+
+def test_batch_splits_aliases_in_order(monkeypatch):
+    body = {"data": {"q1": table([[2]]), "q0": table([[1]])}}
+    sent, results = batch(monkeypatch, body, ["FROM a SHOW n", "FROM b SHOW n"])
+    (payload, queries), = sent
+    assert payload["variables"] == {"q0": "FROM a SHOW n", "q1": "FROM b SHOW n"}
+    assert queries == 2
+    assert results == [{"data": {"shopifyqlQuery": table([[1]])}}, {"data": {"shopifyqlQuery": table([[2]])}}]
+
+
+def test_batch_errors_go_to_their_alias(monkeypatch):
+    error = {"message": "Invalid ShopifyQL", "path": ["q1"]}
+    body = {"data": {"q0": table([[1]]), "q1": None}, "errors": [error]}
+    _, results = batch(monkeypatch, body, ["FROM a SHOW n", "FROM b SHOW n"])
+    assert "errors" not in results[0]
+    assert results[1] == {"data": {"shopifyqlQuery": None}, "errors": [error]}
+
+
+def test_batch_errors_without_a_path_apply_to_every_query(monkeypatch):
+    alias_error = {"message": "Invalid ShopifyQL", "path": ["q0"]}
+    shared_error = {"message": "Internal error"}
+    body = {"data": {"q0": None, "q1": table([[2]])}, "errors": [alias_error, shared_error]}
+    _, results = batch(monkeypatch, body, ["FROM a SHOW n", "FROM b SHOW n"])
+    assert results[0]["errors"] == [alias_error, shared_error]
+    assert results[1]["errors"] == [shared_error]
+    assert results[1]["data"]["shopifyqlQuery"] == table([[2]])
+
+
+def test_pool_evicts_and_later_closes_least_recently_used_clients():
+    async def scenario():
+        pool = shopify_client.ShopifyClientPool(max_shops=2)
+        a = pool.get("a.myshopify.com")
+        b = pool.get("b.myshopify.com")
+        assert pool.get("a.myshopify.com") is a  # a is now the most recently used
+        pool.get("c.myshopify.com")
+        assert set(pool._clients) == {"a.myshopify.com", "c.myshopify.com"}
+        assert not b.is_closed  # requests may still be using it
+        pool._retired[0] = (0.0, b)  # its grace period is over
+        pool.get("a.myshopify.com")
+        await asyncio.sleep(0)
+        assert b.is_closed and not a.is_closed
+        await pool.aclose()
+        assert a.is_closed
+
+    asyncio.run(scenario())
+
+
+def test_scheduler_and_breakers_drop_idle_shops_only():
+    from rate_limit import CostScheduler
+    from resilience import OPEN, BreakerRegistry
+
+    scheduler = CostScheduler(max_shops=2)
+    busy = scheduler.bucket("busy")
+    busy.in_flight = 10.0
+    scheduler.bucket("idle")
+    scheduler.bucket("new")
+    assert set(scheduler._buckets) == {"busy", "new"}
+
+    breakers = BreakerRegistry(max_shops=2)
+    breakers.get("down").state = OPEN
+    breakers.get("healthy")
+    breakers.get("new")
+    assert set(breakers._breakers) == {"down", "new"}
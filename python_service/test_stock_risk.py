@@ -0,0 +1,86 @@
+import numpy as np
+
+from local_engine import SnapshotStore
+from stock_risk import RiskEngine, RiskIndex
+
+
+def index(quantity, velocity, reorder_point=None):
+    n = len(quantity)
+    products = np.array([f"P{i}" for i in range(n)], dtype=object)
+    reorder_point = np.zeros(n) if reorder_point is None else np.asarray(reorder_point, dtype=np.float64)
+    return RiskIndex(products, np.arange(n), np.asarray(quantity), np.asarray(velocity, dtype=np.float64),
+                     reorder_point, {})
+
+
+def test_products_that_do_not_sell_are_not_at_risk():
+    # P0 and P1 are dead SKUs, one of them out of stock; P2 sells out in 2 days, P3 is already out
+    risk = index([0, 5, 4, 0], [0.0, 0.0, 2.0, 1.0])
+    assert risk.at_risk().to_rows() == [["P3", 0, 1.0, 0.0], ["P2", 4, 2.0, 2.0]]
+    assert np.isinf(risk.days_left[:2]).all()
+
+
+def test_at_risk_is_ordered_and_limited():
+    risk = index([10, 1, 30, 6], [1.0, 1.0, 1.0, 2.0])
+    assert [row[0] for row in risk.at_risk(days=7).to_rows()] == ["P1", "P3"]
+    assert [row[0] for row in risk.at_risk(days=100, limit=2).to_rows()] == ["P1", "P3"]
+
+
+def test_reorders_lead_with_the_most_urgent():
+    risk = index([5, 9, 50, 8], [1.0, 1.0, 1.0, 4.0], reorder_point=[10, 10, 10, 10])
+    rows = risk.reorders(first=1).to_rows()
+    assert rows[0][0] == "P3"  # 2 days left
+    assert sorted(row[0] for row in rows) == ["P0", "P1", "P3"]
+    # Up to the reorder point plus REORDER_COVER_DAYS of sales
+    assert dict((row[0], row[2]) for row in rows)["P0"] == 10 + 30 - 5
+
+
+def test_set_level_moves_stock_by_the_change_at_the_location():
+    # Two variants of P0 (items 100, 101) and one of P1 (item 200)
+    products = np.array(["P0", "P1"], dtype=object)
+    items = {100: 0, 101: 1, 200: 2}
+    levels = {(100, 1): 4.0, (100, 2): 6.0, (101, 1): 5.0, (200, 1): 3.0}
+    risk = RiskIndex(products, np.array([0, 0, 1]), np.array([10, 5, 3]), np.array([3.0, 1.0]),
+                     np.zeros(2), items, levels)
+    assert risk.quantity.tolist() == [15.0, 3.0]
+
+    assert risk.set_level(100, 2, 0)
+    assert risk.quantity.tolist() == [9.0, 3.0]
+    assert risk.days_left[0] == 3.0
+    # A location not seen before adds its stock
+    assert risk.set_level(200, 9, 2)
+    assert risk.quantity.tolist() == [9.0, 5.0]
+
+
+def test_set_level_without_per_location_levels():
+    risk = RiskIndex(np.array(["P0"], dtype=object), np.array([0]), np.array([10]), np.array([1.0]),
+                     np.zeros(1), {100: 0})
+    # The first location reported holds the snapshot stock, a second one adds to it
+    assert risk.set_level(100, 1, 4)
+    assert risk.quantity.tolist() == [4.0]
+    assert risk.set_level(100, 2, 3)
+    assert risk.quantity.tolist() == [7.0]
+
+
+def test_set_level_ignores_unknown_items():
+    risk = index([5], [1.0])
+    assert not risk.set_level(999, 1, 0)
+    assert not risk.set_level("not-a-number", 1, 0)
+    assert risk.quantity.tolist() == [5.0]
+
+
+def test_engine_applies_webhooks_and_rebuilds_on_a_new_snapshot(tmp_path):
+    shop = "risk-test.myshopify.com"
+    store = SnapshotStore(str(tmp_path))
+    inventory = {"product_title": ["Mug", "Cap"], "quantity": [20, 3], "avg_daily_sales": [1.0, 1.0],
+                 "reorder_point": [5, 5], "inventory_item_id": [100, 200]}
+    store.write_table(shop, "inventory", inventory)
+    engine = RiskEngine(store)
+    assert engine.answer(shop, "stock_risk").to_rows() == [["Cap", 3, 1.0, 3.0]]
+
+    assert engine.set_level(shop, {"inventory_item_id": 100, "location_id": 1, "available": 2})
+    assert [row[0] for row in engine.answer(shop, "stock_risk").to_rows()] == ["Mug", "Cap"]
+    assert not engine.set_level(shop, {"inventory_item_id": 300, "location_id": 1, "available": 2})
+
+    store.write_table(shop, "inventory", inventory)
+    assert engine.answer(shop, "stock_risk").to_rows() == [["Cap", 3, 1.0, 3.0]]
+    assert engine.answer("other.myshopify.com", "stock_risk") is None
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from streaming import TableStreamParser
+
+BODY = json.dumps({
+    "data": {"shopifyqlQuery": {"tableData": {
+        "headers": [{"name": "product_title"}, {"name": "total_sold"}],
+        "rows": [
+            ["Café \"Noir\" Mug", 12],
+            ["Back\\slash [x], {y}", 3],
+            ["日本茶 \U0001F375", 7],
+            [None, 0],
+        ],
+    }}},
+}, ensure_ascii=False).encode("utf-8")
+
+
+def parse(chunks):
+    parser = TableStreamParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    parser.close()
+    return events
+
+
+def expected():
+    table = json.loads(BODY)["data"]["shopifyqlQuery"]["tableData"]
+    return [("headers", table["headers"])] + [("row", row) for row in table["rows"]]
+
+
+def test_whole_body():
+    assert parse([BODY]) == expected()
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7])
+def test_every_chunk_size(size):
+    # Splits land inside keys, escapes, multi-byte characters and numbers
+    assert parse([BODY[i:i + size] for i in range(0, len(BODY), size)]) == expected()
+
+
+def test_every_split_point():
+    for cut in range(1, len(BODY)):
+        assert parse([BODY[:cut], BODY[cut:]]) == expected(), cut
+
+
+def test_escaped_quote_split_before_the_quote():
+    cut = BODY.index(b'\\"Noir') + 1  # chunk ends on the backslash
+    assert parse([BODY[:cut], BODY[cut:]]) == expected()
+
+
+def test_null_rows():
+    body = b'{"data":{"shopifyqlQuery":{"tableData":{"headers":[{"name":"a"}],"rows":null}}}}'
+    assert parse([body[:40], body[40:]]) == [("headers", [{"name": "a"}])]
+
+
+def test_truncated_rows_raise():
+    parser = TableStreamParser()
+    parser.feed(BODY[:BODY.index(b"12]") + 3])
+    with pytest.raises(ValueError):
+        parser.close()
+
+
+def test_errors_without_table_raise():
+    parser = TableStreamParser()
+    parser.feed(b'{"errors":[{"message":"Throttled"}]}')
+    with pytest.raises(ValueError, match="Throttled"):
+        parser.close()
@@ -0,0 +1,21 @@
+import base64
+import hashlib
+import hmac
+import os
+from typing import Optional
+
+# Shared secret used by Shopify to sign webhook bodies (the app's API secret)
+SHOPIFY_WEBHOOK_SECRET = os.getenv("SHOPIFY_WEBHOOK_SECRET", "")
+
+SUPPORTED_TOPICS = ("orders/create", "refunds/create", "inventory_levels/update")
+
+
+def verify_webhook(body: bytes, hmac_header: Optional[str], secret: str = SHOPIFY_WEBHOOK_SECRET) -> bool:
+    """
+    Checks X-Shopify-Hmac-Sha256: base64(HMAC-SHA256(secret, raw body)).
+    Always False when no secret is configured.
+    """
+    if not secret or not hmac_header:
+        return False
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), hmac_header)
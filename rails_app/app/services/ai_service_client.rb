@@ -8,6 +8,10 @@ class AiServiceClient
     new.analyze(question, shop_domain, access_token)
   end
 
+  def self.analyze_batch(questions:, shop_domain:, access_token:)
+    new.analyze_batch(questions, shop_domain, access_token)
+  end
+
   def analyze(question, shop_domain, access_token)
     response = self.class.post('/analyze', body: {
       query: question,
@@ -23,4 +27,22 @@ class AiServiceClient
   rescue StandardError => e
     OpenStruct.new(success?: false, error_message: e.message)
   end
+
+  # Answers several questions (e.g. every dashboard tile) in one round trip.
+  # The body's "results" array is in the same order as `questions`.
+  def analyze_batch(questions, shop_domain, access_token)
+    response = self.class.post('/analyze/batch', body: {
+      queries: questions,
+      shop_domain: shop_domain,
+      access_token: access_token
+    }.to_json, headers: { 'Content-Type' => 'application/json' })
+
+    if response.success?
+      OpenStruct.new(success?: true, body: response.parsed_response)
+    else
+      OpenStruct.new(success?: false, error_message: response.message)
+    end
+  rescue StandardError => e
+    OpenStruct.new(success?: false, error_message: e.message)
+  end
 end